@@ -0,0 +1,81 @@
+"""
+Benchmarks for webify.  Run these from the repository root, e.g.,
+
+  python -m benchmarks.bench_build --output results.json
+  python -m benchmarks.bench_logging
+  python -m benchmarks.bench_notebooks
+
+sitegen generates the synthetic source trees that the benchmarks build.
+"""
+import os
+import sys
+import shutil
+import logging
+
+webify_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'webify')
+if not webify_dir in sys.path:
+    sys.path.insert(0, webify_dir)
+
+import util2 as util
+import webify2
+
+logger_names = ['main', 'html', 'rc', 'db', 'yaml', 'render', 'db-ignore', 'dirlist', 'availability',
+                'ignore', 'next-run', 'available', 'not-compiled', 'compiled', 'ignored', 'not-copied',
+                'md-file', 'md-buffer', 'md-rc', 'md-timestamps', 'nb', 'nb-settings', 'jobs', 'manifest',
+                'profile', 'pandoc', 'mdfile', 'file', 'watchdir', 'run-webify', 'browser', 'keyboard']
+
+def setup_loggers(loglevel=logging.ERROR):
+    """
+    Quiets webify loggers, including "Webify took ...", which is logged at
+    critical level.
+    """
+    for name in logger_names:
+        util.WebifyLogger.make(name=name, loglevel=logging.ERROR if name.startswith('md-') else loglevel)
+    util.WebifyLogger.get('main').handlers[0].setLevel(logging.CRITICAL + 1)
+
+def cache_dir(destdir):
+    return os.path.abspath(destdir) + '-cache'
+
+def remove_build(destdir):
+    """
+    Removes destdir along with its manifest and caches.
+    """
+    shutil.rmtree(destdir, ignore_errors=True)
+    shutil.rmtree(cache_dir(destdir), ignore_errors=True)
+
+def build(srcdir, destdir, *args, **kwargs):
+    """
+    Builds srcdir into destdir (see make_webify) and stops webify's worker
+    processes and threads.
+    """
+    webify = make_webify(srcdir, destdir, *args, **kwargs)
+    try:
+        webify.traverse()
+    finally:
+        webify.shutdown()
+
+def make_webify(srcdir, destdir, jobs=1, use_threads=False, meta_data={}, copy_mode=None, copy_threads=None, notebook_kernels=None):
+    """
+    Sets up webify as webify2.py does for "webify2.py srcdir destdir -j jobs
+    ...".  Options left to None take their command line defaults.  The
+    build manifest and caches go next to destdir (see cache_dir), rather
+    than in the user's cache folder.  meta_data overrides the meta data
+    that follows from the command line.
+    """
+    args = [srcdir, destdir, '--cache-dir', cache_dir(destdir), '--jobs', str(jobs)]
+    if use_threads:
+        args.append('--threads')
+    for option, value in [('--copy-mode', copy_mode), ('--copy-threads', copy_threads), ('--notebook-kernels', notebook_kernels)]:
+        if value != None:
+            args.extend([option, str(value)])
+    cmdline_args = webify2.make_cmdline_parser().parse_args(args)
+    md = webify2.make_meta_data(cmdline_args, webify2.__file__, os.path.dirname(webify2.__file__), os.getcwd())
+    md.update(meta_data)
+    webify = webify2.Webify()
+    webify.set_src(os.path.normpath(srcdir))
+    webify.set_meta_data(md)
+    webify.set_jobs(cmdline_args.jobs, cmdline_args.threads)
+    webify.set_copy(cmdline_args.copy_mode, cmdline_args.copy_threads)
+    webify.set_notebooks(cmdline_args.notebook_kernels, cmdline_args.notebook_timeout)
+    webify.set_dest(os.path.normpath(destdir))
+    return webify
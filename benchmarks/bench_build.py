@@ -0,0 +1,258 @@
+"""
+Times webify builds of a synthetic site (see sitegen):
+
+  cold              first build into an empty destination folder
+  noop              rebuild, nothing changed
+  change-md         rebuild after editing one markdown file
+  change-yaml       rebuild after editing the yaml file of one folder
+  incremental-md    same as change-md, but only the affected folders are
+  incremental-yaml  processed again (Webify.traverse(changed_paths)), as
+                    in --live mode
+  live              time from saving a markdown file to the end of the
+                    rebuild in --live mode, i.e., through a watchdog
+                    observer, running.DirChangeHandler and running.RunWebify.
+                    This includes DirChangeHandler.time_resolution.
+
+Rebuilds reuse the python process, so process-level caches stay warm
+between runs.  The best and median of --runs runs are reported.  Results
+are saved as json (--output).  --baseline compares these against an
+earlier results file and exits with status 1 if a benchmark got slower
+by more than --tolerance.
+
+Usage: python -m benchmarks.bench_build [--output results.json] [--baseline old.json] [--runs 3] [sitegen options]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import datetime
+import threading
+import subprocess
+
+from benchmarks import util, webify2, build, make_webify, remove_build, setup_loggers
+from benchmarks import sitegen
+
+def time_call(func, *args, **kwargs):
+    tic = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - tic
+
+def time_build(webify):
+    try:
+        return time_call(webify.traverse)
+    finally:
+        webify.shutdown()
+
+def edit_file(filepath, run):
+    """
+    Appends a line to filepath.  Markdown files get a new paragraph, yaml
+    files a new key.
+    """
+    with open(filepath, 'a', encoding='utf-8') as stream:
+        if filepath.endswith('.yaml'):
+            stream.write('edit_%d: %d\n' % (run, run))
+        else:
+            stream.write('\nEdit number %d.\n' % run)
+
+def summarize(timings):
+    s = sorted(timings)
+    return {'runs': timings, 'min': s[0], 'median': s[len(s) // 2]}
+
+def bench_cold(srcdir, workdir, runs, jobs, use_threads):
+    timings = []
+    for run in range(runs):
+        destdir = os.path.join(workdir, 'cold-%d' % run)
+        timings.append(time_build(make_webify(srcdir, destdir, jobs, use_threads)))
+        remove_build(destdir)
+    return summarize(timings)
+
+def bench_rebuild(srcdir, destdir, runs, jobs, use_threads, edit_filepath=None):
+    timings = []
+    for run in range(runs):
+        if edit_filepath:
+            edit_file(edit_filepath, run)
+        timings.append(time_build(make_webify(srcdir, destdir, jobs, use_threads)))
+    return summarize(timings)
+
+def bench_incremental(srcdir, destdir, runs, jobs, use_threads, edit_filepath):
+    webify = make_webify(srcdir, destdir, jobs, use_threads)
+    timings = []
+    try:
+        webify.traverse()
+        for run in range(runs):
+            edit_file(edit_filepath, run)
+            webify.meta_data['__time__'] = datetime.datetime.now()
+            timings.append(time_call(webify.traverse, changed_paths=[edit_filepath]))
+    finally:
+        webify.shutdown()
+    return summarize(timings)
+
+class RefreshProbe:
+    """
+    Takes the place of browser.BrowserController.  RunWebify calls refresh()
+    once a run is done.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.time = None
+
+    def refresh(self):
+        self.time = time.perf_counter()
+        self.done.set()
+
+def bench_live(srcdir, destdir, runs, jobs, use_threads, edit_filepath):
+    try:
+        import running
+        from watchdog.observers import Observer
+    except Exception as e:
+        return {'skipped': 'Cannot import running: %s' % e}
+
+    webify = make_webify(srcdir, destdir, jobs, use_threads)
+    webify.traverse()
+
+    probe = RefreshProbe()
+    run_webify = running.RunWebify(webify=webify, browser_controller=probe)
+    handler = running.DirChangeHandler(watched_dir=srcdir, run_webify=run_webify)
+    observer = Observer()
+    observer.schedule(handler, srcdir, recursive=True)
+    observer.start()
+
+    timings = []
+    try:
+        for run in range(runs):
+            probe.done.clear()
+            tic = time.perf_counter()
+            edit_file(edit_filepath, run)
+            if not probe.done.wait(timeout=120):
+                return {'skipped': 'No rebuild within 120 seconds'}
+            timings.append(probe.time - tic)
+            # Let trailing file system events settle
+            time.sleep(2 * handler.time_resolution)
+    finally:
+        observer.stop()
+        observer.join()
+        run_webify.stop()
+        webify.shutdown()
+
+    results = summarize(timings)
+    results['time_resolution'] = handler.time_resolution
+    return results
+
+def get_meta():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except:
+        revision = None
+    try:
+        pandoc_version = util.pypandoc.get_pandoc_version()
+    except:
+        pandoc_version = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'webify': webify2.__version__,
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandoc': pandoc_version
+    }
+
+def run_benchmarks(workdir, spec, runs, jobs, use_threads, selected):
+    srcdir = os.path.join(workdir, 'src')
+    destdir = os.path.join(workdir, 'dest')
+    counts = sitegen.generate_site(srcdir, **spec)
+    md_filepath = os.path.join(srcdir, 'post0.md')
+    yaml_filepath = os.path.join(srcdir, 'section0', 'data.yaml') if spec['depth'] > 0 else os.path.join(srcdir, 'data.yaml')
+
+    benchmarks = [
+        ('cold',             lambda: bench_cold(srcdir, workdir, runs, jobs, use_threads)),
+        ('noop',             lambda: bench_rebuild(srcdir, destdir, runs, jobs, use_threads)),
+        ('change-md',        lambda: bench_rebuild(srcdir, destdir, runs, jobs, use_threads, md_filepath)),
+        ('change-yaml',      lambda: bench_rebuild(srcdir, destdir, runs, jobs, use_threads, yaml_filepath)),
+        ('incremental-md',   lambda: bench_incremental(srcdir, destdir, runs, jobs, use_threads, md_filepath)),
+        ('incremental-yaml', lambda: bench_incremental(srcdir, destdir, runs, jobs, use_threads, yaml_filepath)),
+        ('live',             lambda: bench_live(srcdir, destdir, runs, jobs, use_threads, md_filepath))
+    ]
+
+    # Rebuilds need an up-to-date destination folder
+    build(srcdir, destdir, jobs, use_threads)
+
+    results = {}
+    for name, func in benchmarks:
+        if selected and not name in selected:
+            continue
+        results[name] = func()
+        if 'skipped' in results[name]:
+            print('%-18s skipped: %s' % (name, results[name]['skipped']))
+        else:
+            print('%-18s min %8.3fs  median %8.3fs' % (name, results[name]['min'], results[name]['median']))
+    return counts, results
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change with respect to baseline.  Returns the names of the
+    benchmarks that got slower by more than tolerance.
+    """
+    slower = []
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if not b or not 'min' in r or not 'min' in b:
+            continue
+        change = (r['min'] - b['min']) / b['min']
+        flag = ''
+        if change > tolerance:
+            flag = '  SLOWER'
+            slower.append(name)
+        print('%-18s %8.3fs -> %8.3fs  %+6.1f%%%s' % (name, b['min'], r['min'], 100.0 * change, flag))
+    return slower
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser()
+    cmdline_parser.add_argument('--output', default=None, help='Saves results to this json file')
+    cmdline_parser.add_argument('--baseline', default=None, help='Compares results against this json file')
+    cmdline_parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown with respect to the baseline (0.2 is 20%%)')
+    cmdline_parser.add_argument('--runs', type=int, default=3, help='Runs per benchmark')
+    cmdline_parser.add_argument('-j', '--jobs', type=int, default=1, help='Passed on to webify')
+    cmdline_parser.add_argument('--threads', action='store_true', default=False, help='Passed on to webify')
+    cmdline_parser.add_argument('--only', action='append', default=[], help='Runs only this benchmark (can be repeated)')
+    cmdline_parser.add_argument('--keep', action='store_true', default=False, help='Keeps the generated site and its build')
+    for key, value in sitegen.default_spec.items():
+        if isinstance(value, bool):
+            cmdline_parser.add_argument('--no-%s' % key.replace('_', '-'), dest=key, action='store_false', default=value, help='Site generator setting')
+        else:
+            cmdline_parser.add_argument('--%s' % key.replace('_', '-'), dest=key, type=int, default=value, help='Site generator setting')
+    cmdline_args = cmdline_parser.parse_args()
+
+    setup_loggers()
+    spec = dict([(key, getattr(cmdline_args, key)) for key in sitegen.default_spec.keys()])
+
+    workdir = tempfile.mkdtemp(prefix='webify-bench-')
+    try:
+        counts, results = run_benchmarks(workdir, spec, cmdline_args.runs, cmdline_args.jobs, cmdline_args.threads, cmdline_args.only)
+    finally:
+        if cmdline_args.keep:
+            print('Site and build kept in: %s' % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    report = {
+        'meta': get_meta(),
+        'settings': {'runs': cmdline_args.runs, 'jobs': cmdline_args.jobs, 'threads': cmdline_args.threads},
+        'spec': spec,
+        'counts': counts,
+        'results': results
+    }
+    if cmdline_args.output:
+        with open(cmdline_args.output, 'w') as stream:
+            json.dump(report, stream, indent=2)
+        print('Results saved to: %s' % cmdline_args.output)
+
+    if cmdline_args.baseline:
+        with open(cmdline_args.baseline) as stream:
+            baseline = json.load(stream)
+        if len(compare(results, baseline, cmdline_args.tolerance)) > 0:
+            sys.exit(1)
@@ -0,0 +1,87 @@
+"""
+Measures the cost of debug logging on a no-op rebuild of a generated tree.
+
+Webify pretty-prints the rendering context and the directory listings at
+debug level for every folder.  These messages are formatted lazily (see
+util2.WebifyLogger.pformat) and skipped altogether when the loggers are
+not at debug level.  This benchmark compares that against eager
+formatting, i.e., pp.pformat evaluated on every call.
+
+Usage: python -m benchmarks.bench_logging [--files 10000] [--dirs 100] [--runs 3]
+"""
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import pprint as pp
+
+from benchmarks import util, build, make_webify, logger_names, setup_loggers
+
+def make_tree(rootdir, num_files, num_dirs):
+    """
+    Creates num_files small text files spread over num_dirs folders,
+    ten folders per level.
+    """
+    dirs = []
+    for d in range(num_dirs):
+        path = rootdir
+        for part in str(d):
+            path = os.path.join(path, 'd%s' % part)
+        dirs.append(path)
+        os.makedirs(path, exist_ok=True)
+    for f in range(num_files):
+        with open(os.path.join(dirs[f % num_dirs], 'f%d.txt' % f), 'w') as stream:
+            stream.write('%d\n' % f)
+
+def set_eager(eager):
+    """
+    Eager mode: loggers accept debug records and messages are formatted
+    whether or not these are emitted.
+    """
+    if eager:
+        util.WebifyLogger.pformat = staticmethod(lambda obj, **kwargs: pp.pformat(obj, **kwargs))
+    else:
+        util.WebifyLogger.pformat = staticmethod(lambda obj, **kwargs: util.LazyMessage(pp.pformat, obj, **kwargs))
+    for name in logger_names:
+        logger = util.WebifyLogger.get(name)
+        logger.setLevel(logging.DEBUG if eager else min([h.level for h in logger.handlers]))
+
+def time_rebuilds(srcdir, destdir, runs, eager):
+    set_eager(eager)
+    timings = []
+    for i in range(runs):
+        webify = make_webify(srcdir, destdir)
+        tic = time.perf_counter()
+        webify.traverse()
+        timings.append(time.perf_counter() - tic)
+        webify.shutdown()
+    return min(timings)
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser()
+    cmdline_parser.add_argument('--files', type=int, default=10000, help='Number of files in the generated tree')
+    cmdline_parser.add_argument('--dirs', type=int, default=100, help='Number of folders in the generated tree')
+    cmdline_parser.add_argument('--runs', type=int, default=3, help='Best of this many no-op rebuilds is reported')
+    cmdline_args = cmdline_parser.parse_args()
+
+    setup_loggers(logging.WARNING)
+
+    tmpdir = tempfile.mkdtemp(prefix='webify-bench-')
+    try:
+        srcdir = os.path.join(tmpdir, 'src')
+        destdir = os.path.join(tmpdir, 'dest')
+        make_tree(srcdir, cmdline_args.files, cmdline_args.dirs)
+        print('Generated %d files in %d folders: %s' % (cmdline_args.files, cmdline_args.dirs, srcdir))
+
+        # First build copies everything, subsequent builds are no-ops
+        build(srcdir, destdir)
+
+        eager = time_rebuilds(srcdir, destdir, cmdline_args.runs, eager=True)
+        lazy = time_rebuilds(srcdir, destdir, cmdline_args.runs, eager=False)
+        print('No-op rebuild, eager debug formatting: %.3fs' % eager)
+        print('No-op rebuild, lazy debug formatting:  %.3fs' % lazy)
+        print('Saving: %.3fs (%.1f%%)' % (eager - lazy, 100.0 * (eager - lazy) / eager))
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,126 @@
+"""
+Times jupyter notebook handling on a folder of large notebooks with
+embedded images (see sitegen.generate_notebooks):
+
+  list     reading the title and lesson plan of each notebook, as done
+           when listing a folder (JupyterNotebookfile.load)
+  convert  list, then convert each notebook to html, without the
+           notebook cache
+  build    first webify build of the folder into an empty destination
+           folder
+  rebuild  webify -i rebuild, which finds the html in the notebook cache
+
+The best and median of --runs runs are reported.  --output and
+--baseline work as in bench_build.
+
+Usage: python -m benchmarks.bench_notebooks [--output results.json] [--baseline old.json] [--notebooks 20] [--cells 20] [--image-kb 64]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+from benchmarks import build, make_webify, remove_build, setup_loggers
+from benchmarks import sitegen
+from benchmarks.bench_build import time_call, time_build, summarize, compare, get_meta
+import nbfile
+
+def list_notebooks(srcdir):
+    nb_files = []
+    for filename in sorted(os.listdir(srcdir)):
+        if filename.endswith('.ipynb'):
+            nb_file = nbfile.JupyterNotebookfile(os.path.join(srcdir, filename), False)
+            nb_file.load()
+            nb_file.get_metadata()
+            nb_files.append(nb_file)
+    return nb_files
+
+def convert_notebooks(srcdir):
+    for nb_file in list_notebooks(srcdir):
+        nb_file.get_html_buffer()
+
+def bench_list(srcdir, runs):
+    return summarize([time_call(list_notebooks, srcdir) for run in range(runs)])
+
+def bench_convert(srcdir, runs):
+    nbfile.notebook_cache = None
+    return summarize([time_call(convert_notebooks, srcdir) for run in range(runs)])
+
+def bench_build(srcdir, workdir, runs, jobs, use_threads):
+    timings = []
+    for run in range(runs):
+        destdir = os.path.join(workdir, 'build-%d' % run)
+        timings.append(time_build(make_webify(srcdir, destdir, jobs, use_threads)))
+        remove_build(destdir)
+    return summarize(timings)
+
+def bench_rebuild(srcdir, destdir, runs, jobs, use_threads):
+    build(srcdir, destdir, jobs, use_threads)
+    timings = []
+    for run in range(runs):
+        webify = make_webify(srcdir, destdir, jobs, use_threads, meta_data={'__ignore_times__': True})
+        timings.append(time_build(webify))
+    return summarize(timings)
+
+def run_benchmarks(workdir, notebooks, cells, image_kb, runs, jobs, use_threads, selected):
+    srcdir = os.path.join(workdir, 'src')
+    destdir = os.path.join(workdir, 'dest')
+    size = sitegen.generate_notebooks(srcdir, count=notebooks, cells=cells, image_kb=image_kb)
+
+    benchmarks = [
+        ('list',    lambda: bench_list(srcdir, runs)),
+        ('convert', lambda: bench_convert(srcdir, runs)),
+        ('build',   lambda: bench_build(srcdir, workdir, runs, jobs, use_threads)),
+        ('rebuild', lambda: bench_rebuild(srcdir, destdir, runs, jobs, use_threads))
+    ]
+
+    results = {}
+    for name, func in benchmarks:
+        if selected and not name in selected:
+            continue
+        results[name] = func()
+        print('%-10s min %8.3fs  median %8.3fs' % (name, results[name]['min'], results[name]['median']))
+    return size, results
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser()
+    cmdline_parser.add_argument('--output', default=None, help='Saves results to this json file')
+    cmdline_parser.add_argument('--baseline', default=None, help='Compares results against this json file')
+    cmdline_parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown with respect to the baseline (0.2 is 20%%)')
+    cmdline_parser.add_argument('--runs', type=int, default=3, help='Runs per benchmark')
+    cmdline_parser.add_argument('-j', '--jobs', type=int, default=1, help='Passed on to webify')
+    cmdline_parser.add_argument('--threads', action='store_true', default=False, help='Passed on to webify')
+    cmdline_parser.add_argument('--only', action='append', default=[], help='Runs only this benchmark (can be repeated)')
+    cmdline_parser.add_argument('--notebooks', type=int, default=20, help='Number of notebooks')
+    cmdline_parser.add_argument('--cells', type=int, default=20, help='Code cells (each with an image) per notebook')
+    cmdline_parser.add_argument('--image-kb', type=int, default=64, help='Size of each image')
+    cmdline_args = cmdline_parser.parse_args()
+
+    setup_loggers()
+
+    workdir = tempfile.mkdtemp(prefix='webify-bench-')
+    try:
+        size, results = run_benchmarks(workdir, cmdline_args.notebooks, cmdline_args.cells, cmdline_args.image_kb,
+                                       cmdline_args.runs, cmdline_args.jobs, cmdline_args.threads, cmdline_args.only)
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        'meta': get_meta(),
+        'settings': {'runs': cmdline_args.runs, 'jobs': cmdline_args.jobs, 'threads': cmdline_args.threads},
+        'spec': {'notebooks': cmdline_args.notebooks, 'cells': cmdline_args.cells, 'image_kb': cmdline_args.image_kb},
+        'counts': {'bytes': size},
+        'results': results
+    }
+    if cmdline_args.output:
+        with open(cmdline_args.output, 'w') as stream:
+            json.dump(report, stream, indent=2)
+        print('Results saved to: %s' % cmdline_args.output)
+
+    if cmdline_args.baseline:
+        with open(cmdline_args.baseline) as stream:
+            baseline = json.load(stream)
+        if len(compare(results, baseline, cmdline_args.tolerance)) > 0:
+            sys.exit(1)
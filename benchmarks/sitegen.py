@@ -0,0 +1,236 @@
+"""
+Synthetic site generator.  Creates a source tree that exercises the same
+code paths as a course or personal website: nested folders, markdown posts
+with frontmatter, jinja2 templates, html pages that list the markdown files
+in their folder, yaml data files, _partials, availability rules and media
+filters.  generate_notebooks creates a folder of jupyter notebooks with
+embedded images (see bench_notebooks).
+
+Usage: python -m benchmarks.sitegen DIR [--depth 2] [--fanout 3] ...
+"""
+import os
+import json
+import base64
+import random
+import argparse
+
+default_spec = {
+    'depth': 2,             # Levels of sub-folders below the root folder
+    'fanout': 3,            # Sub-folders per folder
+    'md_files': 5,          # Markdown files per folder
+    'html_files': 1,        # Html files per folder
+    'misc_files': 5,        # Other files (copied as-is) per folder
+    'md_paragraphs': 10,    # Paragraphs per markdown file
+    'yaml_entries': 50,     # Entries in the yaml data file of each folder
+    'partials': True,       # _partials folder in the root folder
+    'availability': True,   # Availability rules for some markdown files
+    'media_filters': True,  # Markdown files use a media filter template
+    'seed': 0
+}
+
+words = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud '
+         'exercitation ullamco laboris nisi aliquip ex ea commodo consequat').split()
+
+page_template = """<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <title>{{ title }}</title>
+  </head>
+  <body>
+    {% if header_html %}{{ header_html }}{% endif %}
+    <h1>{{ title }}</h1>
+    <p>{{ author }}, {{ date }}</p>
+    {{ body }}
+    <p>Last updated: {{ __last_updated__ }}</p>
+  </body>
+</html>
+"""
+
+index_template = """<!DOCTYPE html>
+<html lang="en">
+  <body>
+    <h1>{{ folder_title }}</h1>
+    <ul>
+    {% for f in __md__ %}
+      <li><a href="{{ f.filename }}">{{ f.data.title }}</a> ({{ f.data.date }})</li>
+    {% endfor %}
+    </ul>
+    <ul>
+    {% for e in entries[:10] %}
+      <li>{{ e.title }} - {{ e.venue }} ({{ e.year }})</li>
+    {% endfor %}
+    </ul>
+  </body>
+</html>
+"""
+
+img_filter = """<figure>
+<img src="{{file}}" alt="{{caption}}" {{#width}}width="{{width}}"{{/width}}>
+{{#caption}}<figcaption>{{caption}}</figcaption>{{/caption}}
+</figure>
+"""
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(words) for i in range(n)).capitalize() + '.'
+
+def write_file(filepath, text):
+    with open(filepath, 'w', encoding='utf-8') as stream:
+        stream.write(text)
+
+def make_md(rng, spec, index):
+    frontmatter = [
+        '---',
+        'title: "Post %d: %s"' % (index, sentence(rng, 4)[:-1]),
+        'author: "Author %d"' % rng.randint(1, 20),
+        'date: "2020-%02d-%02d"' % (rng.randint(1, 12), rng.randint(1, 28)),
+        'render: "{{__root__}}/_templates/page.jinja2"',
+        'renderer: jinja2'
+    ]
+    if spec['media_filters']:
+        frontmatter.append('html-img: "{{__root__}}/_templates/img.mustache"')
+    frontmatter.append('---')
+
+    body = []
+    for p in range(spec['md_paragraphs']):
+        if p % 4 == 1:
+            body.append('## %s' % sentence(rng, 3)[:-1])
+        body.append(' '.join(sentence(rng, rng.randint(8, 16)) for i in range(4)))
+        if p % 5 == 2:
+            body.append('Inline math $x_%d^2 + y^2$ and `code %d`.' % (p, p))
+        if spec['media_filters'] and p % 5 == 3:
+            body.append('![Figure %d](image%d.png)' % (p, p % 3))
+    return '\n'.join(frontmatter) + '\n\n' + '\n\n'.join(body) + '\n'
+
+def make_yaml(rng, spec, folder_title, md_filenames):
+    lines = ['folder_title: "%s"' % folder_title, 'entries:']
+    for i in range(spec['yaml_entries']):
+        lines.append('  - title: "%s"' % sentence(rng, 6)[:-1])
+        lines.append('    venue: "%s"' % sentence(rng, 3)[:-1])
+        lines.append('    year: %d' % rng.randint(1990, 2024))
+        lines.append('    tags: [%s]' % ', '.join(rng.sample(words, 3)))
+
+    if spec['availability'] and len(md_filenames) > 0:
+        # Available posts, one of which closes in the future, and one post
+        # that only becomes available in the future
+        lines.append('availability:')
+        lines.append('  - file: %s' % md_filenames[0])
+        lines.append('    start: 1 Jan 2000')
+        lines.append('    end: 1 Jan 2100')
+        if len(md_filenames) > 1:
+            lines.append('  - file: %s' % md_filenames[-1])
+            lines.append('    start: 1 Jan 2100')
+            lines.append('    end:')
+    return '\n'.join(lines) + '\n'
+
+def generate_folder(rng, spec, dirpath, level, counts):
+    os.makedirs(dirpath, exist_ok=True)
+    counts['dirs'] += 1
+
+    md_filenames = []
+    for i in range(spec['md_files']):
+        filename = 'post%d.md' % i
+        write_file(os.path.join(dirpath, filename), make_md(rng, spec, i))
+        md_filenames.append(filename)
+    counts['md'] += spec['md_files']
+
+    for i in range(spec['html_files']):
+        write_file(os.path.join(dirpath, 'index.html' if i == 0 else 'page%d.html' % i), index_template)
+    counts['html'] += spec['html_files']
+
+    for i in range(spec['misc_files']):
+        ext = 'png' if i < 3 else 'txt'
+        with open(os.path.join(dirpath, ('image%d.' if ext == 'png' else 'notes%d.') % i + ext), 'wb') as stream:
+            stream.write(bytes(rng.getrandbits(8) for j in range(256 + 64 * i)))
+    counts['misc'] += spec['misc_files']
+
+    write_file(os.path.join(dirpath, 'data.yaml'), make_yaml(rng, spec, os.path.basename(dirpath), md_filenames))
+    counts['yaml'] += 1
+
+    if level < spec['depth']:
+        for i in range(spec['fanout']):
+            generate_folder(rng, spec, os.path.join(dirpath, 'section%d' % i), level + 1, counts)
+
+def generate_site(rootdir, **kwargs):
+    """
+    Generates a site in rootdir according to default_spec, overridden by
+    kwargs.  Returns the number of folders and files of each kind created.
+    """
+    spec = dict(default_spec)
+    spec.update(kwargs)
+    rng = random.Random(spec['seed'])
+    counts = {'dirs': 0, 'md': 0, 'html': 0, 'misc': 0, 'yaml': 0}
+
+    templates_dir = os.path.join(rootdir, '_templates')
+    os.makedirs(templates_dir, exist_ok=True)
+    write_file(os.path.join(templates_dir, 'page.jinja2'), page_template)
+    write_file(os.path.join(templates_dir, 'img.mustache'), img_filter)
+    write_file(os.path.join(rootdir, '.webifyignore'), '_templates\n')
+
+    if spec['partials']:
+        partials_dir = os.path.join(rootdir, '_partials')
+        os.makedirs(partials_dir, exist_ok=True)
+        write_file(os.path.join(partials_dir, 'site.yaml'), 'site_name: Benchmark site\nsite_url: https://example.com\n')
+        write_file(os.path.join(partials_dir, 'header.html'), '<header><a href="{{ site_url }}">{{ site_name }}</a></header>\n')
+        write_file(os.path.join(partials_dir, 'footer.md'), '---\ntitle: Footer\n---\n\n*Generated* by the benchmark suite.\n')
+
+    generate_folder(rng, spec, rootdir, 0, counts)
+    return counts
+
+def make_notebook(rng, index, cells, image_kb):
+    """
+    Returns the json of a notebook with a title, a lesson plan and cells 
+    code cells, each with a text output and an embedded png of image_kb 
+    kilobytes (random bytes, the exporter does not decode these).
+    """
+    nb_cells = [
+        {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Notebook %d\n' % index]},
+        {'cell_type': 'markdown', 'metadata': {}, 'source': ['## Lesson Plan\n', '\n', '- %s\n' % sentence(rng, 6), '- %s' % sentence(rng, 6)]}
+    ]
+    for c in range(cells):
+        png = base64.b64encode(bytes(rng.getrandbits(8) for i in range(image_kb * 1024))).decode('ascii')
+        nb_cells.append({'cell_type': 'markdown', 'metadata': {}, 'source': ['%s\n' % sentence(rng, 12), '\n', 'Math: $x_%d^2$' % c]})
+        nb_cells.append({
+            'cell_type': 'code', 'execution_count': c + 1, 'metadata': {},
+            'source': ['import numpy as np\n', 'x = np.linspace(0, %d, 100)\n' % (c + 1), 'plot(x, x ** 2)'],
+            'outputs': [
+                {'output_type': 'stream', 'name': 'stdout', 'text': ['%s\n' % sentence(rng, 8)]},
+                {'output_type': 'display_data', 'metadata': {}, 'data': {'image/png': png, 'text/plain': ['<Figure>']}}
+            ]
+        })
+    for k, cell in enumerate(nb_cells):
+        cell['id'] = 'cell%d' % k
+    return json.dumps({
+        'cells': nb_cells,
+        'metadata': {'kernelspec': {'name': 'python3', 'display_name': 'Python 3', 'language': 'python'}},
+        'nbformat': 4,
+        'nbformat_minor': 5
+    }, indent=1)
+
+def generate_notebooks(rootdir, count=20, cells=20, image_kb=64, seed=0):
+    """
+    Generates a folder of count notebooks with embedded images.  Returns
+    the total size in bytes.
+    """
+    rng = random.Random(seed)
+    os.makedirs(rootdir, exist_ok=True)
+    size = 0
+    for i in range(count):
+        text = make_notebook(rng, i, cells, image_kb)
+        write_file(os.path.join(rootdir, 'notebook%d.ipynb' % i), text)
+        size += len(text)
+    return size
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser()
+    cmdline_parser.add_argument('rootdir', help='Folder in which the site is generated')
+    for key, value in default_spec.items():
+        if isinstance(value, bool):
+            cmdline_parser.add_argument('--no-%s' % key.replace('_', '-'), dest=key, action='store_false', default=value)
+        else:
+            cmdline_parser.add_argument('--%s' % key.replace('_', '-'), dest=key, type=int, default=value)
+    cmdline_args = cmdline_parser.parse_args()
+
+    spec = dict(vars(cmdline_args))
+    rootdir = spec.pop('rootdir')
+    print(generate_site(rootdir, **spec))
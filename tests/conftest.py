@@ -0,0 +1,60 @@
+"""
+Unit tests for webify.  Run from the repository root:
+
+  python -m pytest tests
+
+The test sites in this folder (webify-test, webify-test2, mdfile-test) are
+source trees, not python tests.
+"""
+import os
+import sys
+
+import pytest
+import pypandoc
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+webify_dir = os.path.join(root_dir, 'webify')
+if not webify_dir in sys.path:
+    sys.path.insert(0, webify_dir)
+
+import webify2
+
+def pandoc_found():
+    # Webify runs the pandoc found by pypandoc, which may be its own copy
+    try:
+        return pypandoc.get_pandoc_path() != None
+    except OSError:
+        return False
+
+requires_pandoc = pytest.mark.skipif(not pandoc_found(), reason='pandoc not found')
+
+def cache_dir(destdir):
+    return os.path.abspath(destdir) + '-cache'
+
+def make_webify(srcdir, destdir, *args):
+    """
+    Sets up webify as webify2.py does for "webify2.py srcdir destdir args".
+    The build manifest and caches go next to destdir (see cache_dir), 
+    rather than in the user's cache folder.
+    """
+    cmdline_args = webify2.make_cmdline_parser().parse_args([srcdir, destdir, '--cache-dir', cache_dir(destdir)] + list(args))
+    meta_data = webify2.make_meta_data(cmdline_args, webify2.__file__, os.path.dirname(webify2.__file__), os.getcwd())
+    webify = webify2.Webify()
+    webify.set_src(os.path.normpath(srcdir))
+    webify.set_meta_data(meta_data)
+    webify.set_jobs(cmdline_args.jobs, cmdline_args.threads)
+    webify.set_copy(cmdline_args.copy_mode, cmdline_args.copy_threads)
+    webify.set_notebooks(cmdline_args.notebook_kernels, cmdline_args.notebook_timeout)
+    webify.set_dest(os.path.normpath(destdir))
+    return webify
+
+def build(srcdir, destdir, *args):
+    """
+    Builds srcdir into destdir (see make_webify) and stops webify's worker
+    processes and threads.
+    """
+    webify = make_webify(srcdir, destdir, *args)
+    try:
+        webify.traverse()
+    finally:
+        webify.shutdown()
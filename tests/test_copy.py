@@ -0,0 +1,88 @@
+import os
+import filecmp
+
+import pytest
+
+import manifest as mf
+import util2 as util
+from conftest import build
+
+def write(filepath, text):
+    with open(filepath, 'w') as stream:
+        stream.write(text)
+
+@pytest.fixture
+def site(tmp_path):
+    srcdir = str(tmp_path / 'src')
+    os.makedirs(srcdir)
+    write(os.path.join(srcdir, 'style.css'), 'body {}\n')
+    return srcdir, str(tmp_path / 'dest')
+
+@pytest.fixture
+def compares(monkeypatch):
+    calls = []
+    cmp = filecmp.cmp
+    def counting_cmp(f1, f2, *args, **kwargs):
+        calls.append(f1)
+        return cmp(f1, f2, *args, **kwargs)
+    monkeypatch.setattr(filecmp, 'cmp', counting_cmp)
+    return calls
+
+def test_copy_returns_hash(tmp_path):
+    src, dest = str(tmp_path / 'a.bin'), str(tmp_path / 'b.bin')
+    with open(src, 'wb') as stream:
+        stream.write(os.urandom(3 << 20))
+    assert util.copy_file_with_hash(src, dest, False) == (True, 'Copied', mf.file_hash(src))
+    assert filecmp.cmp(src, dest, shallow=False)
+    assert os.stat(src).st_mtime_ns == os.stat(dest).st_mtime_ns
+    assert util.copy_file_with_hash(src, dest, False) == (True, 'Exists', None)
+
+def test_changed_assets_are_not_compared(site, compares):
+    srcdir, destdir = site
+    build(srcdir, destdir, '--copy-threads', '0')
+    write(os.path.join(srcdir, 'style.css'), 'body { margin: 0; }\n')
+    build(srcdir, destdir, '--copy-threads', '0')
+    with open(os.path.join(destdir, 'style.css')) as stream:
+        assert stream.read() == 'body { margin: 0; }\n'
+    # The first build has no manifest to go by
+    assert compares == [os.path.join(srcdir, 'style.css')]
+
+def test_touched_assets_are_not_copied(site):
+    srcdir, destdir = site
+    build(srcdir, destdir, '--copy-threads', '0')
+    output_st = os.stat(os.path.join(destdir, 'style.css'))
+    os.utime(os.path.join(srcdir, 'style.css'), ns=(0, 0))
+    build(srcdir, destdir, '--copy-threads', '0')
+    assert os.stat(os.path.join(destdir, 'style.css')).st_mtime_ns == output_st.st_mtime_ns
+
+def test_links_are_not_hashed(site, monkeypatch):
+    srcdir, destdir = site
+    monkeypatch.setattr(util, 'copy_strategy', 'hardlink')
+    monkeypatch.setattr(mf, 'file_hash', lambda filepath: pytest.fail('hashed %s' % filepath))
+    src, dest = os.path.join(srcdir, 'style.css'), os.path.join(srcdir, 'copy.css')
+    assert util.copy_file_with_hash(src, dest, True) == (True, 'Copied', None)
+    assert os.path.samefile(src, dest)
+
+def test_forced_copy_after_hardlink_build(site):
+    srcdir, destdir = site
+    src, dest = os.path.join(srcdir, 'style.css'), os.path.join(destdir, 'style.css')
+    build(srcdir, destdir, '--copy-mode', 'hardlink')
+    assert os.path.samefile(src, dest)
+    build(srcdir, destdir, '--force-copy')
+    with open(src) as stream:
+        assert stream.read() == 'body {}\n'
+    assert filecmp.cmp(src, dest, shallow=False)
+    assert not os.path.samefile(src, dest)
+
+def test_copies_replace_links(tmp_path):
+    src, dest = str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')
+    write(src, 'text\n')
+    for strategy in util.copy_strategies.values():
+        os.link(src, dest)
+        strategy(src, dest)
+        with open(src) as stream:
+            assert stream.read() == 'text\n'
+        if strategy != util.copy_file_hardlink:
+            assert not os.path.samefile(src, dest)
+        os.remove(dest)
+    assert os.listdir(str(tmp_path)) == ['a.txt']
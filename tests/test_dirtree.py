@@ -0,0 +1,135 @@
+import os
+import json
+import pickle
+
+import jinja2
+import pytest
+
+import dirtree as dt
+from conftest import build
+
+def make_tree():
+    """
+    a/ holds x.md and b/, b/ holds y.md and c/, c/ was skipped.
+    """
+    tree = dt.DirTree()
+    a = tree.DirNode('/src', '', 'a')
+    b = tree.DirNode('/src', 'a', 'b')
+    c = tree.DirNode('/src', 'a/b', 'c')
+    a.add_child(b)
+    b.add_child(c)
+    b.listing = [{'filename': 'y.md', 'title': 'Y'}]
+    a.listing = [{'filename': 'x.md', 'title': 'X'}]
+    return a, b
+
+expected = [{'filename': os.path.join('b', 'y.md'), 'title': 'Y'}, {'filename': 'x.md', 'title': 'X'}]
+
+def test_listing_matches_list():
+    a, b = make_tree()
+    files = dt.FileListing(a)
+    assert isinstance(files, list)
+    assert files == expected
+    assert len(files) == 2
+    assert files[-1]['filename'] == 'x.md'
+    assert list(reversed(files)) == expected[::-1]
+    assert expected[0] in files
+    assert dt.FileListing(b) == [{'filename': 'y.md', 'title': 'Y'}]
+
+def test_listing_is_filled_once():
+    a, b = make_tree()
+    files = dt.FileListing(a)
+    first = files[0]
+    assert files[0] is first
+
+def test_listing_concatenation():
+    a, b = make_tree()
+    extra = [{'filename': 'z.md'}]
+    assert dt.FileListing(a) + extra == expected + extra
+    assert extra + dt.FileListing(a) == extra + expected
+
+def test_listing_in_templates():
+    a, b = make_tree()
+    env = jinja2.Environment()
+    t = env.from_string('{{ __files__|length }} {{ __files__|map(attribute="title")|join(",") }} {{ (__files__ + [1])|length }}')
+    assert t.render(__files__=dt.FileListing(a)) == '2 Y,X 3'
+    t = env.from_string('{{ __files__|tojson }}')
+    assert json.loads(t.render(__files__=dt.FileListing(a))) == expected
+
+def test_listing_pickles_as_list():
+    a, b = make_tree()
+    files = pickle.loads(pickle.dumps(dt.FileListing(a)))
+    assert type(files) == list
+    assert files == [dict(i, obj=None) for i in expected]
+
+def test_listing_length_does_not_fill():
+    a, b = make_tree()
+    files = dt.FileListing(a)
+    assert len(files) == 2 and files
+    assert not files.filled
+    empty = dt.DirTree().DirNode('/src', '', 'e')
+    empty.listing = []
+    assert not dt.FileListing(empty)
+
+def test_stored_listing():
+    a, b = make_tree()
+    store = dt.ListingStore.create()
+    try:
+        snapshot = pickle.dumps(dt.FileListing(a, store))
+        # b is saved along with a, and is not saved again
+        assert len(store.records) == 2
+        assert pickle.loads(pickle.dumps(dt.FileListing(b, store))).dir_node.record_id == b.record_id
+        assert len(store.records) == 2
+
+        files = pickle.loads(snapshot)
+        assert isinstance(files, dt.FileListing) and not files.filled
+        assert files == [dict(i, obj=None) for i in expected]
+        # As read by a worker process
+        del dt.ListingStore.stores[store.dirpath]
+        files = pickle.loads(pickle.dumps(pickle.loads(snapshot)))
+        assert dt.ListingStore.stores[store.dirpath] is not store
+        assert len(files) == 2
+        assert files == [dict(i, obj=None) for i in expected]
+    finally:
+        store.close()
+    assert not os.path.exists(store.dirpath)
+
+def make_site(srcdir, depth):
+    """
+    A chain of depth folders, each with a page and a file.  Only the top 
+    page lists the files.
+    """
+    dirpath = srcdir
+    for d in range(depth):
+        os.makedirs(dirpath, exist_ok=True)
+        with open(os.path.join(dirpath, 'page.html'), 'w') as stream:
+            stream.write('{{ __files__|map(attribute="filename")|sort|join(",") }}' if d == 0 else 'page %d' % d)
+        with open(os.path.join(dirpath, 'notes.txt'), 'w') as stream:
+            stream.write('notes\n')
+        dirpath = os.path.join(dirpath, 'd%d' % d)
+
+def read_top_page(destdir):
+    with open(os.path.join(destdir, 'page.html')) as stream:
+        return stream.read().split(',')
+
+@pytest.mark.parametrize('args', [['--jobs', '2', '--threads'], ['--jobs', '2']])
+def test_listings_filled_when_read(tmp_path, monkeypatch, args):
+    fills = []
+    fill = dt.FileListing.fill
+    def counting_fill(self):
+        if not self.filled:
+            fills.append(self.dir_node.name)
+        fill(self)
+    monkeypatch.setattr(dt.FileListing, 'fill', counting_fill)
+
+    srcdir, destdir = str(tmp_path / 'src'), str(tmp_path / 'dest')
+    make_site(srcdir, 6)
+    build(srcdir, destdir, *args)
+    files = read_top_page(destdir)
+    assert len(files) == 12
+    assert os.path.join('d0', 'd1', 'notes.txt') in files
+    if '--threads' in args:
+        # Only the top folder reads __files__
+        assert fills == ['']
+    else:
+        # Worker processes fill their own copies
+        assert fills == []
@@ -0,0 +1,93 @@
+import io
+import glob
+import os
+
+import pytest
+import yaml
+
+import yamlfile
+from conftest import root_dir
+
+edge_cases = [
+    '',
+    '---\n',
+    '---\n---\n',
+    'a: 1\n---\nb: 2',
+    '# c\n\n---\na: 1\n...\nbody',
+    '\ufeff---\r\na: 1\r\n---\r\nbody\r\n',
+    '--- {a: 1}\n---\n',
+    'title: x\n',
+    '---\na: |\n  ---\n  x\n---\n',
+    '%YAML 1.1\n---\na: 1\n---\n',
+    '# T\n\ntext\n',
+    '---\ntitle: T\n---\n\n# Heading\n\n---\n\nmore: text\n',
+    '---\ntitle: [unclosed\n---\nbody\n',
+]
+
+def first_document(buffer):
+    """
+    What MDfile.load did before frontmatter was split: parse the whole
+    buffer and keep the first yaml document.
+    """
+    try:
+        for section in yaml.safe_load_all(buffer):
+            return ('ok', section)
+        return ('ok', None)
+    except yaml.YAMLError:
+        return ('error',)
+
+def split_document(buffer):
+    try:
+        return ('ok', yamlfile.FrontmatterCache().load(yamlfile.split_frontmatter(buffer)))
+    except yaml.YAMLError:
+        return ('error',)
+
+def md_files():
+    return sorted(glob.glob(os.path.join(root_dir, '**', '*.md'), recursive=True))
+
+@pytest.mark.parametrize('buffer', edge_cases)
+def test_edge_cases(buffer):
+    assert split_document(buffer) == first_document(buffer)
+
+def test_repo_markdown_files():
+    files = md_files()
+    assert len(files) > 0
+    for filepath in files:
+        with open(filepath, encoding='utf-8') as stream:
+            buffer = stream.read()
+        assert split_document(buffer) == first_document(buffer), filepath
+
+def test_read_frontmatter_stops_at_end():
+    stream = io.StringIO('---\ntitle: T\n---\nbody\n')
+    assert yamlfile.read_frontmatter(stream) == '---\ntitle: T\n'
+    assert stream.readline() == 'body\n'
+
+def test_cache_returns_copies():
+    cache = yamlfile.FrontmatterCache()
+    text = 'tags: [a, b]\n'
+    cache.load(text)['tags'].append('c')
+    assert cache.load(text) == {'tags': ['a', 'b']}
+    assert cache.load('', default={}) == {}
+
+def test_yaml_cache_racy(tmp_path):
+    filepath = str(tmp_path / 'info.yaml')
+    cache = yamlfile.YAMLCache(snapshot_dir=str(tmp_path / 'cache'))
+    with open(filepath, 'w') as f:
+        f.write('a: 1\n')
+    assert cache.load(filepath) == {'a': 1}
+
+    # Same size, same timestamp: only the racy rule notices the change
+    st = os.stat(filepath)
+    with open(filepath, 'w') as f:
+        f.write('a: 2\n')
+    os.utime(filepath, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert cache.load(filepath) == {'a': 2}
+
+    old = st.st_mtime_ns - 10 * 1000000000
+    os.utime(filepath, ns=(old, old))
+    assert cache.load(filepath) == {'a': 2}
+    with open(filepath, 'w') as f:
+        f.write('a: 3\n')
+    os.utime(filepath, ns=(old, old))
+    assert cache.load(filepath) == {'a': 2}
+    assert yamlfile.YAMLCache(snapshot_dir=str(tmp_path / 'cache')).load(filepath) == {'a': 2}
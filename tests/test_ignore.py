@@ -0,0 +1,60 @@
+import os
+import random
+import fnmatch
+
+import util2 as util
+
+patterns = ['?bc.md', '*bc.md', 'ab*', '*', '.#*', '#*', '*.ai', '*checkpoint.ipynb', '.ipynb_checkpoints', '_templates',
+            '/*.html', '/3/3/3.md', '/4', 'foo.md', '2/', '/3/', '*.tmp', 'a*/b?.md', '/x/*/', '[ab]*.txt', 'sub/',
+            '/d1/*.md', '*/*.yaml', '/', '[!a]*.md', '*.[ch]', 'x*y*z']
+
+names = ['abc.md', 'xbc.md', 'a.md', 'b1.md', 'b2.md', 'foo.md', '3.md', 'x.html', 'y.ai', '.#q', '#z', '_templates',
+         '2', '3', '4', 'x', 'd1', 'sub', 'a.txt', 'c.txt', 'note.yaml', 'n.ipynb', 'm-checkpoint.ipynb', 'p.c', 'xayz',
+         '.ipynb_checkpoints', 'a*b', '[ab]']
+
+def fnmatch_ignore(ignore_list, path, name, is_dir):
+    """
+    What IgnoreList.ignore did before patterns were combined: fnmatch
+    against every pattern in turn.
+    """
+    srcdir = ignore_list.srcdir
+    path = '/' if path == srcdir else path.replace(srcdir, '')
+    return any([ignore_list.match(path, name, is_dir, p, f) for (p, f) in ignore_list.ignorelist])
+
+def test_name_matcher():
+    rnd = random.Random(3)
+    name_patterns = [p for p in patterns if not '/' in p]
+    for run in range(200):
+        ps = rnd.sample(name_patterns, rnd.randint(1, len(name_patterns)))
+        matcher = util.NameMatcher(ps)
+        for name in names:
+            assert matcher.match(os.path.normcase(name)) == any([fnmatch.fnmatch(name, p) for p in ps]), (name, ps)
+
+def test_ignore_list():
+    rnd = random.Random(1)
+    srcdir = '/src'
+    dirs = [srcdir] + [srcdir + '/' + '/'.join(rnd.choice(['2', '3', '4', 'x', 'd1', 'sub', 'ab', 'a1']) for i in range(rnd.randint(1, 3)))
+                       for j in range(60)]
+    for run in range(30):
+        ignore_list = util.IgnoreList(srcdir)
+        for pattern in rnd.sample(patterns, rnd.randint(0, len(patterns))):
+            p, f = os.path.split(pattern)
+            if p or f:
+                ignore_list.ignorelist.append((p, f))
+        ignore_list.compile()
+        for path in dirs:
+            for name in names:
+                for is_dir in [False, True]:
+                    assert ignore_list.ignore(path, name, is_dir) == fnmatch_ignore(ignore_list, path, name, is_dir), \
+                        (path, name, is_dir, ignore_list.ignorelist)
+
+def test_read_ignore_file(tmp_path):
+    ignorefile = tmp_path / '.webifyignore'
+    ignorefile.write_text('*.tmp\n\n_templates\n/drafts/\n')
+    ignore_list = util.IgnoreList(str(tmp_path))
+    ignore_list.read_ignore_file(str(ignorefile))
+    assert ignore_list.ignore(str(tmp_path), 'a.tmp', False)
+    assert ignore_list.ignore(str(tmp_path / 'sub'), '_templates', True)
+    assert ignore_list.ignore(str(tmp_path), 'drafts', True)
+    assert not ignore_list.ignore(str(tmp_path / 'sub'), 'drafts', True)
+    assert not ignore_list.ignore(str(tmp_path), 'a.md', False)
@@ -0,0 +1,55 @@
+import os
+
+import nbfile
+
+class FakeKernelPool(nbfile.KernelPool):
+    """
+    Hands out folder names in place of kernels.
+    """
+    def __init__(self, max_spares):
+        super().__init__(max_spares)
+        self.started = []
+        self.released = []
+
+    def start_kernel(self, cwd):
+        self.started.append(cwd)
+        return cwd
+
+    def release(self, km):
+        self.released.append(km)
+
+    def run(self, filepath):
+        # As NotebookPool does, for a notebook queued with expect
+        cwd = os.path.dirname(filepath)
+        self.begin(cwd)
+        km = self.acquire(cwd)
+        self.executor.submit(lambda: None).result()
+        self.release(km)
+
+def test_spares_follow_queued_notebooks():
+    pool = FakeKernelPool(max_spares=2)
+    notebooks = ['/a/1.ipynb', '/a/2.ipynb', '/a/3.ipynb', '/b/1.ipynb', '/b/2.ipynb']
+    for filepath in notebooks:
+        pool.expect(filepath)
+    for filepath in notebooks:
+        pool.run(filepath)
+    pool.shutdown()
+    # One kernel per notebook: no spare is started after a folder's last notebook
+    assert sorted(pool.started) == ['/a', '/a', '/a', '/b', '/b']
+    assert sorted(pool.released) == sorted(pool.started)
+
+def test_unused_spares_are_released():
+    pool = FakeKernelPool(max_spares=1)
+    for filepath in ['/a/1.ipynb', '/a/2.ipynb', '/b/1.ipynb', '/b/2.ipynb']:
+        pool.expect(filepath)
+    pool.run('/a/1.ipynb')
+    assert pool.spares == {'/a': ['/a']}
+    # /a/2.ipynb is converted without running it (e.g., found in the cache)
+    pool.begin('/a')
+    pool.run('/b/1.ipynb')
+    # The spare in /a was shut down, so that one can be started for /b
+    assert '/a' in pool.released
+    assert pool.spares == {'/b': ['/b']}
+    pool.run('/b/2.ipynb')
+    pool.shutdown()
+    assert sorted(pool.released) == sorted(pool.started)
@@ -0,0 +1,88 @@
+import pickle
+import random
+
+import pytest
+
+import nbfile
+import util2 as util
+from conftest import requires_pandoc
+
+class FakeConverter(util.PandocConverter):
+    """
+    Records batches and wraps each text in <p>, as pandoc would.
+    """
+    def __init__(self):
+        self.batches = []
+
+    def convert_batch(self, conversions):
+        self.batches.append([c['source'] for c in conversions])
+        return ['<p>%s</p>\n' % c['source'] if c['source'] else '' for c in conversions]
+
+@pytest.fixture
+def converter(tmp_path, monkeypatch):
+    converter = FakeConverter()
+    monkeypatch.setattr(util, 'pandoc_converter', converter)
+    monkeypatch.setattr(util, 'pandoc_snippet_cache', util.PandocSnippetCache(str(tmp_path / 'pandoc')))
+    monkeypatch.setattr(util, 'jinja2_templates', util.Jinja2Templates())
+    return converter
+
+def render(renderer, template, context):
+    return renderer(template=template, render_filepath='index.html', context=context, src_filepath='index.html')
+
+def test_converted_once_per_batch(converter):
+    batch = nbfile.LessonPlanBatch()
+    a, b, c = batch.add('a', 'a.ipynb'), batch.add('b', 'b.ipynb'), batch.add('a', 'c.ipynb')
+    assert converter.batches == []
+    assert str(b) == '<p>b</p>\n'
+    assert str(a) == str(c) == '<p>a</p>\n'
+    assert converter.batches == [['a', 'b']]
+    # Other folders find these in the snippet cache
+    assert str(nbfile.LessonPlanBatch().add('b', 'd.ipynb')) == '<p>b</p>\n'
+    assert converter.batches == [['a', 'b']]
+
+def test_workers_do_not_convert(converter):
+    batch = nbfile.LessonPlanBatch()
+    lesson_plan = batch.add('a', 'a.ipynb')
+    snapshot = pickle.dumps({'lesson_plan': lesson_plan})
+    assert converter.batches == [['a']]
+    copy = pickle.loads(snapshot)['lesson_plan']
+    assert copy.html == '<p>a</p>\n'
+    assert copy == lesson_plan
+
+def test_failed_conversion(converter, monkeypatch):
+    monkeypatch.setattr(converter, 'convert_batch', lambda conversions: [RuntimeError('failed') for c in conversions])
+    assert str(nbfile.LessonPlanBatch().add('*a*', 'a.ipynb')) == '*a*'
+
+def test_templates(converter):
+    batch = nbfile.LessonPlanBatch()
+    context = {'lesson_plan': batch.add('a "b"', 'a.ipynb'), 'empty': batch.add('', 'b.ipynb')}
+    html = '<p>a "b"</p>\n'
+    assert render(util.jinja2_renderer, '{{ lesson_plan }}', context) == html
+    assert render(util.jinja2_renderer, '{{ lesson_plan|e }}{{ lesson_plan|safe }}', context) == html + html
+    assert render(util.jinja2_renderer, '{{ lesson_plan|tojson }}', context) == '"\\u003cp\\u003ea \\"b\\"\\u003c/p\\u003e\\n"'
+    assert render(util.jinja2_renderer, '{{ lesson_plan == "%s" }} {{ lesson_plan.strip() }}' % html.replace('"', '\\"').replace('\n', '\\n'), context) == 'True <p>a "b"</p>'
+    assert render(util.jinja2_renderer, '{{ lesson_plan|length }} {{ "b" in lesson_plan }} {{ lesson_plan[:3] }} {{ "x" + lesson_plan }}', context) == '13 True <p> x' + html
+    assert render(util.jinja2_renderer, '{% if empty %}x{% endif %}{{ empty|default("none", true) }}', context) == 'none'
+    assert render(util.mustache_renderer, '{{#lesson_plan}}[{{{lesson_plan}}}]{{/lesson_plan}}{{#empty}}x{{/empty}}', context) == '[%s]' % html
+
+def random_lesson_plan(rnd):
+    pieces = ['Some *text*.', '- item\n- item', '1. one\n2. two', '# Heading', '## Heading', '```\ncode\n```',
+              'A footnote[^1].\n\n[^1]: Note.', '[link][r]\n\n[r]: http://x', '(@) example', '$x^2$', '<div>html</div>',
+              '| a | b |\n|---|---|\n| 1 | 2 |', '> quote', '\tindented', '', '<!-- comment -->']
+    return '\n\n'.join(rnd.choice(pieces) for i in range(rnd.randint(0, 4)))
+
+@requires_pandoc
+@pytest.mark.parametrize('make_converter', [util.PandocConverter, util.PandocServer])
+def test_matches_per_text_conversion(tmp_path, monkeypatch, make_converter):
+    rnd = random.Random(24)
+    texts = [random_lesson_plan(rnd) for i in range(60)]
+    converter = make_converter()
+    monkeypatch.setattr(util, 'pandoc_converter', converter)
+    monkeypatch.setattr(util, 'pandoc_snippet_cache', None)
+    try:
+        batch = nbfile.LessonPlanBatch()
+        lesson_plans = [batch.add(text, 'n.ipynb') for text in texts]
+        for text, lesson_plan in zip(texts, lesson_plans):
+            assert str(lesson_plan) == util.pandoc_convert_text(text, to='html', format='md', extra_args=util.pandoc_filter_args), text
+    finally:
+        converter.close()
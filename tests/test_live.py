@@ -0,0 +1,142 @@
+import os
+
+import pytest
+from watchdog import events
+
+import manifest as mf
+from conftest import make_webify
+
+def test_visited_folders_stay_in_source(tmp_path, monkeypatch):
+    srcdir = str(tmp_path / 'site')
+    os.makedirs(os.path.join(srcdir, 'a'))
+    with open(os.path.join(srcdir, 'a', 'index.html'), 'w') as stream:
+        stream.write('a\n')
+    webify = make_webify(srcdir, str(tmp_path / 'dest'))
+    try:
+        webify.traverse()
+        # A folder next to the source folder, whose name starts with it
+        sibling = os.path.join(srcdir + '-old', 'a')
+        monkeypatch.setattr(webify, 'find_affected_dirs', lambda changed_paths: ({os.path.join(srcdir, 'a'), sibling}, set()))
+        visited = []
+        monkeypatch.setattr(webify.dir_tree, 'traverse', lambda **kwargs: visited.append(set(webify.visit_dirs)))
+        webify.traverse(changed_paths=[])
+        assert visited == [{srcdir, os.path.join(srcdir, 'a')}]
+    finally:
+        webify.shutdown()
+
+def make_site(tmp_path):
+    """
+    A site with a page in a/b that is rendered with a template kept in
+    _templates (recorded in the build manifest by hand, as md files need
+    pandoc), a yaml file in a and a partial in a/_partials.
+    """
+    srcdir = str(tmp_path / 'site')
+    for filepath, text in [('index.html', 'root\n'),
+                           ('a/index.html', 'a\n'),
+                           ('a/info.yaml', 'title: a\n'),
+                           ('a/_partials/p.html', 'partial\n'),
+                           ('a/b/index.html', 'b\n'),
+                           ('c/index.html', 'c\n'),
+                           ('_templates/page.html', 'template\n')]:
+        filepath = os.path.join(srcdir, filepath)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as stream:
+            stream.write(text)
+    webify = make_webify(srcdir, str(tmp_path / 'dest'))
+    webify.traverse()
+    src = os.path.join(srcdir, 'a', 'b', 'page.md')
+    template = os.path.join(srcdir, '_templates', 'page.html')
+    out = str(tmp_path / 'dest' / 'a' / 'b' / 'page.html')
+    webify.manifest.set(out, mf.make_record(src, [src, template], out, None, webify.file_stats))
+    return srcdir, webify
+
+def test_affected_by_template(tmp_path):
+    srcdir, webify = make_site(tmp_path)
+    try:
+        dirs, trees = webify.find_affected_dirs([os.path.join(srcdir, '_templates', 'page.html')])
+        assert os.path.join(srcdir, 'a', 'b') in dirs
+        assert os.path.join(srcdir, 'c') not in dirs
+        assert trees == set()
+    finally:
+        webify.shutdown()
+
+def test_affected_by_yaml_and_partials(tmp_path):
+    srcdir, webify = make_site(tmp_path)
+    try:
+        # Descendant folders read the yaml file, and the partials, too
+        for filepath in [os.path.join(srcdir, 'a', 'info.yaml'), os.path.join(srcdir, 'a', '_partials', 'p.html')]:
+            dirs, trees = webify.find_affected_dirs([filepath])
+            assert trees == {os.path.join(srcdir, 'a')}
+            webify.visit_dirs, webify.visit_trees = dirs, trees
+            assert webify.is_visited(webify.dir_tree.find(os.path.join(srcdir, 'a', 'b')))
+            assert not webify.is_visited(webify.dir_tree.find(os.path.join(srcdir, 'c')))
+    finally:
+        webify.shutdown()
+
+def test_affected_by_new_and_deleted_files(tmp_path):
+    srcdir, webify = make_site(tmp_path)
+    try:
+        dirpath = os.path.join(srcdir, 'c')
+        filepath = os.path.join(dirpath, 'new.html')
+        with open(filepath, 'w') as stream:
+            stream.write('new\n')
+        assert webify.find_affected_dirs([filepath]) == ({dirpath}, set())
+        assert 'new.html' in [f for v in webify.dir_tree.find(dirpath).files.values() for f in v]
+
+        os.remove(filepath)
+        assert webify.find_affected_dirs([filepath]) == ({dirpath}, set())
+        assert 'new.html' not in [f for v in webify.dir_tree.find(dirpath).files.values() for f in v]
+    finally:
+        webify.shutdown()
+
+def test_ignorefile_needs_full_run(tmp_path):
+    srcdir, webify = make_site(tmp_path)
+    try:
+        assert webify.find_affected_dirs([os.path.join(srcdir, 'a', '.webifyignore')]) == None
+    finally:
+        webify.shutdown()
+
+class FakeWebify:
+    def __init__(self):
+        self.meta_data = {'__ignore_times__': False}
+        self.next_run_time = None
+        self.runs = []
+
+    def traverse(self, changed_paths=None):
+        self.runs.append(changed_paths)
+
+class FakeBrowser:
+    def refresh(self):
+        pass
+
+def test_schedule(tmp_path, monkeypatch):
+    # pynput needs a display
+    running = pytest.importorskip('running', exc_type=ImportError)
+    run_webify = running.RunWebify(FakeWebify(), FakeBrowser())
+    scheduled = []
+    monkeypatch.setattr(run_webify, 'run', lambda **kwargs: scheduled.append(kwargs))
+    handler = running.DirChangeHandler(str(tmp_path), run_webify)
+
+    filepath = str(tmp_path / 'index.html')
+    with open(filepath, 'w') as stream:
+        stream.write('index\n')
+    handler.on_created(events.FileCreatedEvent(filepath))
+    handler.on_modified(events.FileModifiedEvent(filepath))
+    handler.on_deleted(events.FileDeletedEvent(str(tmp_path / 'old.md')))
+    assert len(scheduled) == 3 and all(kwargs['incremental'] for kwargs in scheduled)
+    run_webify.run_(ignore_times=False, force_copy=False, incremental=True)
+    assert run_webify.webify.runs == [{filepath, str(tmp_path / 'old.md')}]
+
+    # Folder events fall back to a full run, whatever else changed
+    handler.on_modified(events.FileModifiedEvent(filepath))
+    os.makedirs(str(tmp_path / 'a'))
+    handler.on_created(events.DirCreatedEvent(str(tmp_path / 'a')))
+    handler.on_modified(events.FileModifiedEvent(filepath))
+    run_webify.run_(ignore_times=False, force_copy=False, incremental=True)
+    assert run_webify.webify.runs[-1] == None
+
+    # Runs not triggered by file changes are full runs
+    handler.on_modified(events.FileModifiedEvent(filepath))
+    run_webify.run_(ignore_times=False, force_copy=False)
+    assert run_webify.webify.runs[-1] == None
+    assert run_webify.take_changes() == set()
@@ -0,0 +1,91 @@
+import os
+import time
+
+import manifest as mf
+
+def write(filepath, text):
+    with open(filepath, 'w') as stream:
+        stream.write(text)
+
+def touch(filepath):
+    t = time.time() + 10
+    os.utime(filepath, (t, t))
+
+def record_and_check(tmp_path, deps=[]):
+    src = str(tmp_path / 'src.md')
+    out = str(tmp_path / 'out.html')
+    write(src, 'source')
+    write(out, 'output')
+    files = [src] + [str(tmp_path / d) for d in deps]
+    record = mf.make_record(src, files, out, 'context', mf.FileStats())
+    check = lambda context='context': mf.check(record, files, out, context, mf.FileStats())
+    return src, out, record, check
+
+def test_no_record():
+    assert mf.check(None, [], 'out.html', None, mf.FileStats()) == None
+
+def test_up_to_date(tmp_path):
+    src, out, record, check = record_and_check(tmp_path)
+    assert check() == True
+
+def test_context_changed(tmp_path):
+    src, out, record, check = record_and_check(tmp_path)
+    assert check('other context') == False
+
+def test_dependency_changed(tmp_path):
+    src, out, record, check = record_and_check(tmp_path)
+    write(src, 'changed source')
+    assert check() == False
+
+def test_dependency_touched(tmp_path):
+    src, out, record, check = record_and_check(tmp_path)
+    touch(src)
+    assert check() == True
+    # The record now carries the new timestamp
+    assert record['deps'][os.path.normpath(src)][:2] == mf.FileStats().signature(src)
+
+def test_output_missing(tmp_path):
+    src, out, record, check = record_and_check(tmp_path)
+    os.remove(out)
+    assert check() == False
+
+def test_output_changed_outside_webify(tmp_path):
+    src, out, record, check = record_and_check(tmp_path)
+    write(out, 'edited by hand')
+    assert check() == None
+
+def test_missing_dependency_still_missing(tmp_path):
+    src, out, record, check = record_and_check(tmp_path, ['missing.css'])
+    assert record['deps'][os.path.normpath(str(tmp_path / 'missing.css'))] == None
+    assert check() == True
+    assert check() == True
+
+def test_missing_dependency_appears(tmp_path):
+    src, out, record, check = record_and_check(tmp_path, ['missing.css'])
+    write(str(tmp_path / 'missing.css'), 'body {}')
+    assert check() == False
+
+def test_dependency_removed(tmp_path):
+    write(str(tmp_path / 'style.css'), 'body {}')
+    src, out, record, check = record_and_check(tmp_path, ['style.css'])
+    os.remove(str(tmp_path / 'style.css'))
+    assert check() == False
+
+def test_rendering_context_keys(tmp_path):
+    class RC:
+        def __init__(self, values):
+            self.values = values
+        def fingerprint(self, k):
+            return mf.fingerprint(self.values.get(k))
+
+    src = str(tmp_path / 'src.html')
+    out = str(tmp_path / 'out.html')
+    write(src, 'source')
+    write(out, 'output')
+    record = mf.make_record(src, [src], out, None, mf.FileStats(), context_keys={'title': mf.fingerprint('A')})
+    assert mf.check(record, [src], out, None, mf.FileStats(), RC({'title': 'A', 'other': 1})) == True
+    assert mf.check(record, [src], out, None, mf.FileStats(), RC({'title': 'B'})) == False
+
+    record = mf.make_record(src, [src], out, None, mf.FileStats())
+    assert mf.check(record, [src], out, None, mf.FileStats(), RC({'title': 'A'})) == False
+    assert mf.check(record, [src], out, None, mf.FileStats()) == True
@@ -0,0 +1,125 @@
+import os
+import re
+import ast
+import random
+
+import mdfilters
+import util2 as util
+
+def old_apply(f, buffer, src_filepath):
+    """
+    HTML_Filter.apply as it was before its regexes were precompiled and its
+    output was joined once, for the templates loaded by f.
+    """
+    i = 0
+    tmp_buffer = ''
+    for img in re.finditer('(\\!\\[.*?\\])(\\(.+?\\))', buffer, flags=re.DOTALL):
+        s, e = img.start(), img.end()
+        caption = img.group(1)[2:-1]
+        mediafile = img.group(2)[1:-1]
+
+        context = {}
+        if len(caption) > 0:
+            caption_embedded_info = re.search('!\\{.+?\\}', caption)
+            if caption_embedded_info:
+                try:
+                    context.update(ast.literal_eval(caption_embedded_info.group(0)[1:]))
+                    caption = caption[:caption_embedded_info.start()] + caption[caption_embedded_info.end():]
+                except:
+                    pass
+            context['caption'] = caption.strip()
+
+        mm = mediafile.split('|')
+        if len(mm) == 1:
+            filename = mm[0].strip()
+            context['file'] = filename
+            if f.is_image(filename):
+                template = f.img_template
+                context['type'] = 'image'
+            elif f.is_video(filename):
+                template = f.vid_template
+                context['type'] = 'video'
+            else:
+                template = None
+        else:
+            if f.is_image(mm[0].strip()):
+                template = f.img_grid_template
+            elif f.is_video(mm[0].strip()):
+                template = f.vid_grid_template
+            else:
+                template = None
+            context['files'] = []
+            for item in mm:
+                filename = item.strip()
+                context['files'].append({'file': filename})
+                if not (f.is_image(filename) or f.is_video(filename)):
+                    template = None
+                    break
+
+        if template:
+            try:
+                r = util.mustache_renderer(template=template, render_filepath=src_filepath, context=context, src_filepath=src_filepath)
+            except:
+                r = buffer[s:e]
+            tmp_buffer += buffer[i:s] + r
+        else:
+            tmp_buffer += buffer[i:e]
+        i = e
+
+    if i > 0:
+        buffer = tmp_buffer + buffer[i:]
+    return buffer
+
+templates = {
+    'html-img': '<img src="{{file}}" alt="{{caption}}" width="{{width}}" class="{{type}}">',
+    'html-imgs': '<div>{{#files}}<img src="{{file}}">{{/files}}<p>{{caption}}</p></div>',
+    'html-vid': '<video src="{{file}}" title="{{caption}}" {{#loop}}loop{{/loop}}></video>',
+    'html-vids': '<div>{{#files}}<video src="{{file}}"></video>{{/files}}</div>',
+}
+
+def make_files(tmp_path, keys):
+    files = {}
+    for key in templates.keys():
+        filepath = str(tmp_path / ('%s.mustache' % key))
+        with open(filepath, 'w') as stream:
+            stream.write(templates[key])
+        files[key] = filepath if key in keys else None
+    return files
+
+def random_page(rnd):
+    captions = ['', 'A figure', 'Wide !{"width": "50%"}', "Loop !{'loop': True} video", 'Bad !{width: }', '[nested]', 'Two\nlines']
+    media = ['a.png', 'b.JPG', 'c.mp4', 'd.gif', 'e.txt', 'f.jpeg', ' g.png ']
+    pieces = []
+    for n in range(rnd.randint(0, 12)):
+        r = rnd.random()
+        if r < 0.4:
+            pieces.append(rnd.choice(['Some text. ', '\n\n# Heading\n\n', 'A [link](x.html) ', '![] ', '(x) ', '!']))
+        elif r < 0.8:
+            pieces.append('![%s](%s)' % (rnd.choice(captions), rnd.choice(media)))
+        else:
+            files = [rnd.choice(media) for i in range(rnd.randint(2, 4))]
+            pieces.append('![%s](%s)' % (rnd.choice(captions), '|'.join(files)))
+    return ''.join(pieces) or 'text'
+
+def test_matches_old_apply(tmp_path):
+    rnd = random.Random(25)
+    keys = list(templates.keys())
+    for n in range(900):
+        f = mdfilters.HTML_Filter(make_files(tmp_path, rnd.sample(keys, rnd.randint(0, len(keys)))))
+        page = random_page(rnd)
+        assert f.apply(page, 'page.md') == old_apply(f, page, 'page.md'), page
+
+def test_templates_are_read_again_when_changed(tmp_path):
+    files = make_files(tmp_path, ['html-img'])
+    assert mdfilters.HTML_Filter(files).apply('![x](a.png)', 'page.md').startswith('<img')
+    with open(files['html-img'], 'w') as stream:
+        stream.write('<figure>{{file}}</figure>')
+    os.utime(files['html-img'], ns=(0, 0))
+    assert mdfilters.HTML_Filter(files).apply('![x](a.png)', 'page.md') == '<figure>a.png</figure>'
+
+def test_missing_templates(tmp_path):
+    files = make_files(tmp_path, [])
+    files['html-img'] = str(tmp_path / 'missing.mustache')
+    f = mdfilters.HTML_Filter(files)
+    assert f.img_template == None
+    assert f.apply('![x](a.png) ![y](b.mp4|c.mp4)', 'page.md') == '![x](a.png) ![y](b.mp4|c.mp4)'
@@ -0,0 +1,75 @@
+import os
+import glob
+import json
+
+import pytest
+import nbformat
+
+import nbfile
+from conftest import root_dir
+
+def parsed_metadata(filepath):
+    """
+    The title and lesson plan read from the notebook parsed by nbformat.
+    """
+    nb_file = nbfile.JupyterNotebookfile(filepath, False)
+    nb_file.process_cells(nbformat.read(filepath, as_version=4).cells)
+    return nb_file.title, nb_file.lesson_plan
+
+def loaded_metadata(filepath):
+    nb_file = nbfile.JupyterNotebookfile(filepath, False)
+    assert nb_file.load()
+    return nb_file.title, nb_file.lesson_plan
+
+def notebooks():
+    return sorted(glob.glob(os.path.join(root_dir, '**', '*.ipynb'), recursive=True))
+
+def test_repo_notebooks():
+    files = notebooks()
+    assert len(files) > 0
+    for filepath in files:
+        assert loaded_metadata(filepath) == parsed_metadata(filepath), filepath
+
+def test_parsed_once(tmp_path, monkeypatch):
+    calls = []
+    reads = nbformat.reads
+    def counting_reads(*args, **kwargs):
+        calls.append(args)
+        return reads(*args, **kwargs)
+    monkeypatch.setattr(nbformat, 'reads', counting_reads)
+    monkeypatch.setattr(nbfile, 'notebook_cache', None)
+
+    filepath = str(tmp_path / 'a.ipynb')
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_markdown_cell('# Title'), nbformat.v4.new_code_cell('1 + 1')])
+    nbformat.write(nb, filepath)
+    nb_file = nbfile.JupyterNotebookfile(filepath, False)
+    assert nb_file.load()
+    assert nb_file.title == 'Title'
+    assert 'Title' in nb_file.get_html_buffer()
+    assert len(calls) == 1
+    # The notebook is not kept once converted
+    assert nb_file.nb == None
+
+def test_cell_source(tmp_path):
+    cells = [{'id': 'a', 'cell_type': 'code', 'source': '# Not a title', 'metadata': {}, 'outputs': [], 'execution_count': None},
+             {'id': 'b', 'cell_type': 'markdown', 'source': ['# Title\n', 'text'], 'metadata': {}},
+             {'id': 'c', 'cell_type': 'markdown', 'source': '## Lesson Plan\n- one\n- two\n', 'metadata': {}}]
+    filepath = str(tmp_path / 'a.ipynb')
+    with open(filepath, 'w') as stream:
+        json.dump({'nbformat': 4, 'nbformat_minor': 5, 'metadata': {}, 'cells': cells}, stream)
+    assert loaded_metadata(filepath) == ('Title', '- one\n- two\n')
+    assert parsed_metadata(filepath) == ('Title', '- one\n- two\n')
+
+def test_version3_notebook(tmp_path):
+    cells = [{'cell_type': 'markdown', 'source': ['# Old\n'], 'metadata': {}},
+             {'cell_type': 'markdown', 'source': ['## Lesson Plan\n', 'text\n'], 'metadata': {}}]
+    filepath = str(tmp_path / 'old.ipynb')
+    with open(filepath, 'w') as stream:
+        json.dump({'nbformat': 3, 'nbformat_minor': 0, 'metadata': {'name': 'old'}, 'worksheets': [{'cells': cells, 'metadata': {}}]}, stream)
+    assert loaded_metadata(filepath) == parsed_metadata(filepath) == ('Old', 'text\n')
+
+def test_invalid_notebook(tmp_path):
+    filepath = str(tmp_path / 'bad.ipynb')
+    with open(filepath, 'w') as stream:
+        stream.write('{"cells": [')
+    assert nbfile.JupyterNotebookfile(filepath, False).load() == False
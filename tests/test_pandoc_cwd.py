@@ -0,0 +1,67 @@
+"""
+Pandoc runs with the folder of each markdown file as its working directory
+(see util2.pandoc_convert_text), without changing the working directory of
+webify itself.  Converting many files at once, from many threads, must
+still resolve the relative css and include-in-header paths of each file
+against its own folder.
+"""
+import os
+import re
+import concurrent.futures
+
+import util2 as util
+from conftest import requires_pandoc, build
+
+num_dirs = 30
+pages_per_dir = 10
+
+def write(filepath, text):
+    with open(filepath, 'w') as stream:
+        stream.write(text)
+
+def make_site(srcdir):
+    for d in range(num_dirs):
+        dirpath = os.path.join(srcdir, 'd%02d' % d)
+        os.makedirs(os.path.join(dirpath, 'css'))
+        write(os.path.join(dirpath, 'header.html'), '<meta name="folder" content="d%02d">\n' % d)
+        write(os.path.join(dirpath, 'css', 'style.css'), 'body { margin: %dpx; }\n' % d)
+        for p in range(pages_per_dir):
+            write(os.path.join(dirpath, 'page%02d.md' % p),
+                  '---\ntitle: Page %d in d%02d\nstandalone-html: True\n'
+                  'include-in-header: header.html\ncss: css/style.css\n---\n\nText.\n' % (p, d))
+
+@requires_pandoc
+def test_many_conversions_in_threads(tmp_path):
+    srcdir = str(tmp_path / 'src')
+    make_site(srcdir)
+    # Paths relative to the folder of each file, as pandoc sees these
+    extra_args = ['--standalone', '--include-in-header=header.html', '--css=css/style.css', '--metadata=title:Page']
+
+    def convert(d, p):
+        dirpath = os.path.join(srcdir, 'd%02d' % d)
+        return util.pandoc_converter.convert('Page %d.' % p, to='html', format='md', extra_args=extra_args, cwd=dirpath)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        futures = {(d, p): executor.submit(convert, d, p) for d in range(num_dirs) for p in range(pages_per_dir)}
+    for (d, p), future in futures.items():
+        html = future.result()
+        assert '<meta name="folder" content="d%02d">' % d in html
+        assert '<p>Page %d.</p>' % p in html
+
+@requires_pandoc
+def test_many_files_in_threads(tmp_path):
+    srcdir = str(tmp_path / 'src')
+    destdir = str(tmp_path / 'dest')
+    make_site(srcdir)
+
+    build(srcdir, destdir, '--jobs', '16', '--threads')
+
+    for d in range(num_dirs):
+        dirpath = os.path.join(destdir, 'd%02d' % d)
+        for p in range(pages_per_dir):
+            with open(os.path.join(dirpath, 'page%02d.html' % p)) as stream:
+                html = stream.read()
+            assert '<meta name="folder" content="d%02d">' % d in html
+            hrefs = re.findall(r'<link rel="stylesheet" href="([^"]+)"', html)
+            assert hrefs == ['css/style.css']
+            assert os.path.isfile(os.path.join(dirpath, hrefs[0]))
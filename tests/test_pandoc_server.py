@@ -0,0 +1,39 @@
+import pytest
+
+import util2 as util
+from conftest import requires_pandoc
+
+@pytest.fixture
+def server():
+    server = util.PandocServer()
+    yield server
+    server.close()
+
+@requires_pandoc
+def test_close_stops_processes(server):
+    assert server.convert('*a*', to='html', format='md') == '<p><em>a</em></p>\n'
+    processes = list(server.processes)
+    assert len(processes) == 1
+    server.close()
+    assert server.processes == []
+    assert all([p.poll() != None for p in processes])
+    # A new process is started as needed
+    assert server.convert('*b*', to='html', format='md') == '<p><em>b</em></p>\n'
+    assert server.available
+
+@requires_pandoc
+def test_failed_process_is_restarted(server):
+    assert server.convert('*a*', to='html', format='md') == '<p><em>a</em></p>\n'
+    server.processes[0].kill()
+    server.processes[0].wait()
+    assert server.convert('*b*', to='html', format='md') == '<p><em>b</em></p>\n'
+    assert server.available
+    assert len(server.processes) == 1
+
+@requires_pandoc
+def test_gives_up_after_restart(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'script', str(tmp_path / 'missing.lua'))
+    # Falls back to running pandoc for the file
+    assert server.convert('*a*', to='html', format='md') == '<p><em>a</em></p>\n'
+    assert not server.available
+    assert server.processes == []
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import util2 as util
+from conftest import requires_pandoc, build
+
+class CountingConverter(util.PandocConverter):
+    """
+    Counts conversions.  Snippets are wrapped in <p> as pandoc would, unless
+    real pandoc is used.
+    """
+    def __init__(self, use_pandoc=False):
+        self.use_pandoc = use_pandoc
+        self.calls = []
+
+    def convert(self, source, to, format, extra_args=[], outputfile=None, cwd=None):
+        self.calls.append(source)
+        if self.use_pandoc:
+            return super().convert(source, to, format, extra_args=extra_args, outputfile=outputfile, cwd=cwd)
+        return '<p>%s</p>\n' % source.upper()
+
+@pytest.fixture
+def converter(tmp_path, monkeypatch):
+    converter = CountingConverter()
+    monkeypatch.setattr(util, 'pandoc_converter', converter)
+    monkeypatch.setattr(util, 'pandoc_snippet_cache', util.PandocSnippetCache(str(tmp_path / 'pandoc')))
+    return converter
+
+def test_filter_pandoc(converter):
+    assert util.filter_pandoc('_pandoc_*a*') == '*A*\n'
+    assert util.filter_pandoc('_pandoc_*a*') == '*A*\n'
+    assert util.filter_pandoc('plain') == 'plain'
+    assert converter.calls == ['*a*']
+
+def test_filter_pandoc_dict(converter):
+    data = {'title': '_pandoc_a', 'items': ['_pandoc_b', 'plain', {'x': '_pandoc_a'}], 'n': 1}
+    expected = {'title': 'A\n', 'items': ['B\n', 'plain', {'x': 'A\n'}], 'n': 1}
+    assert util.filter_pandoc_dict(data) == expected
+    assert sorted(converter.calls) == ['a', 'b']
+    # The second time around, everything is found in the cache
+    converter.calls.clear()
+    assert util.filter_pandoc_dict(data) == expected
+    assert converter.calls == []
+    # As it is by filter_pandoc
+    assert util.filter_pandoc('_pandoc_b') == 'B\n'
+    assert converter.calls == []
+
+def test_cache_key(tmp_path):
+    cache = util.PandocSnippetCache(str(tmp_path))
+    cache.set('a', ['--mathjax'], 'x')
+    assert cache.get('a', ['--mathjax']) == 'x'
+    assert cache.get('a', []) == None
+    assert cache.get('b', ['--mathjax']) == None
+
+@requires_pandoc
+def test_rebuild_runs_no_conversions(tmp_path, monkeypatch):
+    srcdir = str(tmp_path / 'src')
+    os.makedirs(srcdir)
+    with open(os.path.join(srcdir, 'data.yaml'), 'w') as stream:
+        stream.write('title: _pandoc_*Home*\nitems:\n  - _pandoc_**one**\n  - _pandoc_`two`\n')
+    with open(os.path.join(srcdir, 'index.html'), 'w') as stream:
+        stream.write('{{ title }} {{ items|join(" ") }}\n')
+
+    outputs = []
+    for run in range(2):
+        converter = CountingConverter(use_pandoc=True)
+        monkeypatch.setattr(util, 'pandoc_converter', converter)
+        build(srcdir, str(tmp_path / 'dest'), '--ignore-times')
+        with open(str(tmp_path / 'dest' / 'index.html')) as stream:
+            outputs.append(stream.read())
+        if run == 0:
+            assert sorted(converter.calls) == ['**one**', '*Home*', '`two`']
+        else:
+            assert converter.calls == []
+    assert outputs[0] == outputs[1]
+    assert outputs[0].split() == ['<em>Home</em>', '<strong>one</strong>', '<code>two</code>']
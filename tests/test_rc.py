@@ -0,0 +1,106 @@
+import copy
+import random
+
+import rc as RenderingContext
+
+class DiffStackContext:
+    """
+    The rendering context as it was before scope layers: each push()
+    recorded the keys added, modified and deleted since, along with deep
+    copies of the values these replaced.
+    """
+    def __init__(self):
+        self.rc = {}
+        self.diff_stack = [self.empty_diff()]
+
+    @staticmethod
+    def empty_diff():
+        return {'a': [], 'm': {}, 'd': {}}
+
+    def push(self):
+        self.diff_stack.append(self.empty_diff())
+
+    def remove(self, keys):
+        keys = [keys] if not isinstance(keys, list) else keys
+        diff = self.diff_stack[-1]
+        for k in keys:
+            if k in self.rc.keys():
+                if k in diff['a']:
+                    diff['a'].remove(k)
+                elif k in diff['m'].keys():
+                    diff['d'][k] = diff['m'][k]
+                    del diff['m'][k]
+                else:
+                    diff['d'][k] = copy.deepcopy(self.rc[k])
+                del self.rc[k]
+
+    def add(self, data):
+        diff = self.diff_stack[-1]
+        for k in data.keys():
+            if k in self.rc.keys():
+                if not k in diff['a'] and not k in diff['m'].keys():
+                    diff['m'][k] = copy.deepcopy(self.rc[k])
+            elif k in diff['d'].keys():
+                diff['m'][k] = diff['d'][k]
+                del diff['d'][k]
+            elif not k in diff['a']:
+                diff['a'].append(k)
+            self.rc[k] = data[k]
+
+    def pop(self):
+        diff = self.diff_stack.pop()
+        for k in diff['a']:
+            del self.rc[k]
+        for k in diff['d'].keys():
+            self.rc[k] = diff['d'][k]
+        for k in diff['m'].keys():
+            self.rc[k] = diff['m'][k]
+
+    def data(self):
+        return self.rc
+
+def test_matches_diff_stack():
+    rnd = random.Random(7)
+    keys = ['a', 'b', 'c', 'd', 'e']
+    for run in range(200):
+        new, old = RenderingContext.RenderingContext(), DiffStackContext()
+        depth = 0
+        for step in range(60):
+            op = rnd.choice(['push', 'pop', 'add', 'add', 'remove'])
+            if op == 'push':
+                new.push(); old.push()
+                depth += 1
+            elif op == 'pop' and depth > 0:
+                new.pop(); old.pop()
+                depth -= 1
+            elif op == 'add':
+                data = {k: {'v': rnd.randint(0, 9)} for k in rnd.sample(keys, rnd.randint(1, 3))}
+                new.add(data); old.add(data)
+            elif op == 'remove':
+                ks = rnd.sample(keys, rnd.randint(1, 2))
+                new.remove(ks); old.remove(ks)
+            assert new.data() == old.data()
+
+def test_pop_uncovers_values():
+    rc = RenderingContext.RenderingContext()
+    title = {'text': 'Home'}
+    rc.add({'title': title, 'author': 'A'})
+    rc.push()
+    rc.add({'title': 'Page'})
+    rc.remove('author')
+    assert rc.data() == {'title': 'Page'}
+    rc.pop()
+    assert rc.data() == {'title': title, 'author': 'A'}
+    # Values are shadowed, not copied
+    assert rc.value('title') is title
+
+def test_fingerprints_follow_scopes():
+    rc = RenderingContext.RenderingContext()
+    rc.add({'title': 'Home'})
+    home = rc.fingerprint('title')
+    rc.push()
+    rc.add({'title': 'Page'})
+    assert rc.fingerprint('title') != home
+    rc.pop()
+    assert rc.fingerprint('title') == home
+    assert rc.fingerprints(['title', '__time__']).keys() == {'title'}
@@ -0,0 +1,36 @@
+import pytest
+import jinja2
+
+import util2 as util
+
+@pytest.fixture(autouse=True)
+def templates(monkeypatch):
+    monkeypatch.setattr(util, 'jinja2_templates', util.Jinja2Templates())
+
+def render(template, data):
+    context = util.TrackingContext(data)
+    rendered = util.jinja2_renderer(template=template, render_filepath='page.html', context=context, src_filepath='page.html')
+    return rendered, context
+
+def test_accessed_keys():
+    template = '{{ title }}{% if draft %}draft{% endif %}{% for p in pages %}{{ p }}{% endfor %}{% set n = 2 %}{{ n }}'
+    rendered, context = render(template, {'title': 'T', 'pages': [1, 2], 'unused': 'x'})
+    assert rendered == 'T122'
+    # draft is not there, adding it later changes the output
+    assert {'title', 'draft', 'pages'} <= context.accessed
+    assert not 'unused' in context.accessed
+    # The rendering context is left as it was
+    assert dict(context) == {'title': 'T', 'pages': [1, 2], 'unused': 'x'}
+
+def test_macros_and_filters():
+    template = '{% macro item(x) %}<{{ x }}{{ sep }}>{% endmacro %}{{ item(name|upper) }}{{ range(2)|list|length }}'
+    rendered, context = render(template, {'name': 'a', 'sep': '-'})
+    assert rendered == '<A->2'
+    assert {'name', 'sep'} <= context.accessed
+
+def test_errors_are_raised_by_render():
+    with pytest.raises(jinja2.exceptions.UndefinedError):
+        render('{{ missing.attr.other }}', {})
+
+def test_plain_context():
+    assert util.jinja2_renderer(template='{{ a }}', render_filepath='p.html', context={'a': 1}, src_filepath='p.html') == '1'
@@ -1,6 +1,168 @@
 import util2 as util
 #import logging
 import os
+import time
+import pickle
+import shutil
+import atexit
+import tempfile
+import threading
+import concurrent.futures
+
+class FileListing(list):
+    """
+    List of the files found in a folder and all its descendent folders 
+    (this is __files__ in the rendering context).  Each folder only keeps its
+    own listing (see DirNode.listing), the list is filled from the folder and 
+    its descendent folders when it is first used.  Files found in descendent 
+    folders come first, with filenames made relative to this folder.
+
+    With a ListingStore, the list is pickled (in job snapshots, see 
+    jobs.snapshot_context) as a reference to the saved listings and is
+    filled in the worker, if the job reads it.
+    """
+    def __init__(self, dir_node, store=None):
+        super().__init__()
+        self.dir_node = dir_node
+        self.store = store
+        self.filled = False
+
+    def fill(self):
+        if not self.filled:
+            self.filled = True
+            list.extend(self, self.walk(self.dir_node, ''))
+
+    def walk(self, dir_node, prefix):
+        for child in dir_node.children:
+            if child.listing != None:
+                yield from self.walk(child, os.path.join(prefix, child.name) if prefix else child.name)
+        if prefix:
+            for entry in dir_node.listing:
+                yield dict(entry, filename=os.path.join(prefix, entry['filename']))
+        else:
+            yield from dir_node.listing
+
+    def count_files(self, dir_node):
+        return len(dir_node.listing) + sum([self.count_files(c) for c in dir_node.children if c.listing != None])
+
+    def __len__(self):
+        # Counted without filling the list (e.g., {% if __files__ %})
+        if self.filled:
+            return list.__len__(self)
+        return self.count_files(self.dir_node)
+
+    def __radd__(self, other):
+        self.fill()
+        return other + list(self)
+
+    def __reduce__(self):
+        if isinstance(self.dir_node, StoredDirNode):
+            return (FileListing.from_store, (self.store.dirpath, self.dir_node.record_id))
+        if self.store:
+            return (FileListing.from_store, (self.store.dirpath, self.store.save(self.dir_node)))
+        # Pickled as a plain list, without the directory tree and the file
+        # objects
+        self.fill()
+        return (list, ([dict(i, obj=None) for i in self],))
+
+    @staticmethod
+    def from_store(dirpath, record_id):
+        store = ListingStore.open(dirpath)
+        return FileListing(StoredDirNode(store, record_id), store)
+
+class ListingStore:
+    """
+    Folder listings saved to dirpath for jobs (see FileListing.__reduce__).
+    A folder's listing is saved, along with those of its descendent folders
+    that were not saved yet, the first time a job snapshot refers to it.
+    Records are not changed afterwards: a folder listed again (live runs) 
+    is saved under a new record.  Worker processes read records as these
+    are used, worker threads share the records of the main thread.
+    """
+    # Stores open in this process, {dirpath: store}
+    stores = {}
+    lock = threading.Lock()
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.records = {}
+        self.count = 0
+
+    @staticmethod
+    def create():
+        store = ListingStore(tempfile.mkdtemp(prefix='webify-listings-'))
+        with ListingStore.lock:
+            ListingStore.stores[store.dirpath] = store
+        atexit.register(store.close)
+        return store
+
+    @staticmethod
+    def open(dirpath):
+        with ListingStore.lock:
+            if not dirpath in ListingStore.stores:
+                ListingStore.stores[dirpath] = ListingStore(dirpath)
+            return ListingStore.stores[dirpath]
+
+    def close(self):
+        with ListingStore.lock:
+            ListingStore.stores.pop(self.dirpath, None)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+    def save(self, dir_node):
+        """
+        Returns the record of dir_node, saving it first if needed.  Called 
+        from the main thread only.
+        """
+        if dir_node.record_id in self.records:
+            return dir_node.record_id
+        children = [(c.name, self.save(c)) for c in dir_node.children if c.listing != None]
+        record = {'listing': [dict(i, obj=None) for i in dir_node.listing], 'children': children}
+        self.count += 1
+        record_id = str(self.count)
+        with open(os.path.join(self.dirpath, record_id), 'wb') as stream:
+            pickle.dump(record, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        self.records[record_id] = record
+        dir_node.record_id = record_id
+        return record_id
+
+    def get(self, record_id):
+        record = self.records.get(record_id)
+        if record == None:
+            with open(os.path.join(self.dirpath, record_id), 'rb') as stream:
+                record = pickle.load(stream)
+            self.records[record_id] = record
+        return record
+
+class StoredDirNode:
+    """
+    A folder saved in a ListingStore, as walked by FileListing.
+    """
+    def __init__(self, store, record_id, name=''):
+        self.store = store
+        self.record_id = record_id
+        self.name = name
+
+    @property
+    def listing(self):
+        return self.store.get(self.record_id)['listing']
+
+    @property
+    def children(self):
+        return [StoredDirNode(self.store, record_id, name) for name, record_id in self.store.get(self.record_id)['children']]
+
+def _fill_first(name):
+    method = getattr(list, name)
+    def wrapper(self, *args):
+        self.fill()
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+# List methods that read or modify the files fill the list first
+for _name in ['__iter__', '__getitem__', '__setitem__', '__delitem__', '__reversed__', '__contains__',
+              '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__add__', '__iadd__', '__mul__', '__rmul__', '__imul__',
+              '__repr__', 'append', 'extend', 'insert', 'remove', 'pop', 'clear', 'index', 'count', 'copy', 'sort', 'reverse']:
+    setattr(FileListing, _name, _fill_first(_name))
 
 class DirTree:
     class DirNode:
@@ -9,10 +171,19 @@ class DirTree:
             self.files = {'yaml': [], 'html': [], 'misc': [], 'md': [], 'ipynb': []}
             self.children = []
             self.partials = None
+            # Files captured when leaving this folder (see Webify.leave_dir),
+            # None if this folder was skipped
+            self.listing = None
+            # Record of listing in a ListingStore
+            self.record_id = None
             self.name = name
             self.path = path
             self.root = root
 
+        def clear_files(self):
+            for v in self.files.values():
+                v.clear()
+
         def add_file(self, name):
             _, ext = os.path.splitext(name)
             if ext.lower() == '.yaml':
@@ -42,34 +213,119 @@ class DirTree:
             s = "Path: " + self.path + ", Name: " + self.name
             return s
             
-    def __init__(self):
+    # Folders modified less than this many seconds before they are scanned
+    # are scanned again next time, since a change made within the same
+    # timestamp tick would go unnoticed
+    racy_seconds = 2
+
+    def __init__(self, num_threads=8):
         self.logger = util.WebifyLogger.get('db')
         self.rootdir = None
-        
+        self.nodes = {}
+        self.num_threads = num_threads
+        # Folder entries from the last collect, {fullpath: (mtime_ns, [(name, is_dir)])}
+        self.scans = {}
+
+    def scan_dir(self, fullpath):
+        """
+        Returns the modification time of folder fullpath and its entries.
+        Entries found last time are reused if the folder has not changed 
+        since.  Runs in the collect threads.
+        """
+        mtime = os.stat(fullpath).st_mtime_ns
+        scan = self.scans.get(fullpath)
+        if scan and scan[0] == mtime:
+            return scan
+        entries = [(entry.name, entry.is_dir()) for entry in os.scandir(fullpath)]
+        if time.time_ns() - mtime < self.racy_seconds * 1000000000:
+            mtime = None
+        return mtime, entries
+
     def collect(self, rootdir, ignore=None):
+        """
+        Collects the folders and files found in rootdir.  Folders are scanned
+        concurrently by num_threads threads.  Nodes are created here, in the
+        order in which os.scandir lists the entries of each folder.
+        """
         self.ignore = ignore
         self.rootdir = self.DirNode(root=rootdir, path='.', name='.')
+        self.nodes = {self.rootdir.get_fullpath(): self.rootdir}
 
-        dirs = [self.rootdir]
-        while len(dirs) > 0:
-            cur_dir_node = dirs.pop()
+        scans = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            pending = {executor.submit(self.scan_dir, self.rootdir.get_fullpath()): self.rootdir}
+            while len(pending) > 0:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    cur_dir_node = pending.pop(future)
+                    mtime, entries = future.result()
+                    if mtime != None:
+                        scans[cur_dir_node.get_fullpath()] = mtime, entries
 
-            self.logger.debug('Collecting directory %s' % cur_dir_node.get_fullpath())
-            for entry in os.scandir(cur_dir_node.get_fullpath()):
-                self.logger.debug('Found entry %s %s' % (cur_dir_node.get_fullpath(), entry.name))
+                    self.logger.debug('Collecting directory %s', cur_dir_node.get_fullpath())
+                    for name, is_dir in entries:
+                        self.logger.debug('Found entry %s %s', cur_dir_node.get_fullpath(), name)
 
-                if ignore and ignore.ignore(cur_dir_node.get_fullpath(), entry.name, entry.is_dir()):
-                    self.logger.debug('Ignoring          : %s' % entry.name)
-                    continue
-                
-                if entry.is_dir():
-                    sub_dir_node = self.DirNode(root=cur_dir_node.root, path=cur_dir_node.get_path(), name=entry.name)
-                    cur_dir_node.add_child(sub_dir_node)
-                    dirs.append(sub_dir_node)
-                    self.logger.debug('Added subdirectory: %s, %s, %s' % (cur_dir_node.root, cur_dir_node.get_path(), entry.name))
-                else:
-                    self.logger.debug('Added file        : %s' % entry.name)
-                    cur_dir_node.add_file(name=entry.name)
+                        if ignore and ignore.ignore(cur_dir_node.get_fullpath(), name, is_dir):
+                            self.logger.debug('Ignoring          : %s', name)
+                            continue
+
+                        if is_dir:
+                            sub_dir_node = self.DirNode(root=cur_dir_node.root, path=cur_dir_node.get_path(), name=name)
+                            cur_dir_node.add_child(sub_dir_node)
+                            self.nodes[sub_dir_node.get_fullpath()] = sub_dir_node
+                            pending[executor.submit(self.scan_dir, sub_dir_node.get_fullpath())] = sub_dir_node
+                            self.logger.debug('Added subdirectory: %s, %s, %s', cur_dir_node.root, cur_dir_node.get_path(), name)
+                        else:
+                            self.logger.debug('Added file        : %s', name)
+                            cur_dir_node.add_file(name=name)
+        self.scans = scans
+
+    def load_snapshot(self, filepath):
+        """
+        Loads the folder entries saved by save_snapshot, so that collect 
+        only scans the folders that changed since.
+        """
+        try:
+            with open(filepath, 'rb') as stream:
+                self.scans = pickle.load(stream)
+            self.logger.info('Loaded directory snapshot: %s' % filepath)
+        except:
+            self.logger.info('No directory snapshot found: %s' % filepath)
+            self.scans = {}
+
+    def save_snapshot(self, filepath):
+        tmp_filepath = '%s.%d.tmp' % (filepath, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(tmp_filepath, 'wb') as stream:
+                pickle.dump(self.scans, stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filepath, filepath)
+        except:
+            self.logger.warning('Cannot save directory snapshot: %s' % filepath)
+
+    def find(self, dirpath):
+        """
+        Returns the node for folder dirpath (a full path), or None if this 
+        folder was not collected.
+        """
+        return self.nodes.get(os.path.normpath(dirpath))
+
+    def rescan(self, dir_node):
+        """
+        Collects the files (not the sub-directories) of an already 
+        collected folder again.  Used when files are created or deleted 
+        during live runs.
+        """
+        self.logger.debug('Rescanning directory %s' % dir_node.get_fullpath())
+        dir_node.clear_files()
+        for entry in os.scandir(dir_node.get_fullpath()):
+            if entry.is_dir():
+                continue
+            if self.ignore and self.ignore.ignore(dir_node.get_fullpath(), entry.name, False):
+                self.logger.debug('Ignoring          : %s' % entry.name)
+                continue
+            dir_node.add_file(name=entry.name)
 
     def __traverse__(self, dir, enter_func, proc_func, leave_func):
         self.logger.debug('Entering %s' % dir.get_fullpath())
@@ -0,0 +1,212 @@
+import util2 as util
+import rc as RenderingContext
+import pickle
+import concurrent.futures
+import profiling
+import dirtree as dt
+from htmlfile import HTMLfile
+
+# Rendering context keys that hold directory listings.  Entries in these
+# lists carry the (unpicklable or simply large) file objects in the 'obj'
+# field.  These are stripped when taking a snapshot of the rendering context
+# (__files__ does so itself, see dirtree.FileListing).
+listing_keys = ['__md__', '__html__', '__misc__', '__ipynb__', '__files__']
+
+def snapshot_context(data):
+    """
+    Returns a pickled copy of the rendering context.  Directory listings
+    change from one folder to the next and __files__ is filled from the
+    directory tree (see dirtree.FileListing), so the snapshot must be taken
+    when the job is submitted and not when the job is sent to a worker.
+    """
+    snapshot = dict(data)
+    for k in listing_keys:
+        if k in snapshot.keys() and isinstance(snapshot[k], list) and not isinstance(snapshot[k], dt.FileListing):
+            snapshot[k] = [dict(i, obj=None) for i in snapshot[k]]
+    return pickle.dumps(snapshot)
+
+def restore_context(snapshot):
+    rc = RenderingContext.RenderingContext()
+    rc.add(pickle.loads(snapshot))
+    return rc
+
+def convert_md(md_file, filename, rc):
+    rc.push()
+    rc.add({'__me__': filename})
+    ret = md_file.convert(rc)
+    rc.pop()
+    return ret, md_file.get_build_record()
+
+def convert_html(filepath, output_filepath, filename, render, rc):
+    rc.push()
+    rc.add({'__me__': filename})
+    html_file = HTMLfile(filepath)
+    buffer = html_file.load().get_buffer()
+    context = rc.track()
+    with profiling.profiler.stage('render', filepath):
+        rendered_buf = render(template=buffer, render_filepath=filepath, context=context, src_filepath=filepath)
+    rc.pop()
+    context.accessed.discard('__me__')
+    with profiling.profiler.stage('write', filepath):
+        saved = util.save_to_file(output_filepath, rendered_buf)
+    return saved, rc.fingerprints(context.accessed)
+
+def convert_ipynb(nb_file, output_filepath, filename, rc):
+    rc.push()
+    rc.add({'__me__': filename})
+    with profiling.profiler.stage('notebook', nb_file.filepath):
+        buffer = nb_file.get_html_buffer()
+    rc.pop()
+    with profiling.profiler.stage('write', nb_file.filepath):
+        return util.save_to_file(output_filepath, buffer)
+
+def copy_asset(filepath, output_filepath, force_copy):
+    """
+    Copies filepath to output_filepath.  Also returns the content hash of
+    files that were copied, if it was computed while copying (see 
+    util2.copy_strategies), so that the build manifest can tell a touched
+    asset from a changed one.  force_copy skips comparing the files first.
+    """
+    with profiling.profiler.stage('copy', filepath):
+        return util.copy_file_with_hash(filepath, output_filepath, force_copy)
+
+def init_worker(registry, pandoc_converter, profile):
+    util.WebifyLogger.init_worker(registry)
+    util.pandoc_converter = pandoc_converter
+    profiling.profiler = profiling.Profiler(enabled=profile)
+
+def run_job(func, args, snapshot):
+    """
+    Entry point for worker processes.  Rebuilds the rendering context from
+    its snapshot and calls func(*args, rc).
+    """
+    return func(*args, restore_context(snapshot))
+
+def run_job_in_process(func, args, snapshot):
+    """
+    Same as run_job.  Profiling records made by the job (see --profile) are
+    sent back along with its result.
+    """
+    return run_job(func, args, snapshot), profiling.profiler.take()
+
+class JobPool:
+    """
+    Runs markdown, html and jupyter notebook conversions in a pool of
+    worker processes (or threads).  Each job gets a snapshot of the 
+    rendering context that it needs.  Results are reported in submission 
+    order when wait() is called, so that the log reads the same as a 
+    serial run.
+
+    Conversions spend most of their time waiting on pandoc, so threads
+    work just as well and avoid pickling file objects to worker processes.
+    """
+    def __init__(self, num_jobs, use_threads=False):
+        self.logger = util.WebifyLogger.get('jobs')
+        self.num_jobs = num_jobs
+        self.use_threads = use_threads
+        self.executor = None
+        self.pending = []
+        self.outputs = {}
+
+    def start(self):
+        if self.executor:
+            return
+        if self.use_threads:
+            self.logger.info('Starting %d worker threads' % self.num_jobs)
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_jobs)
+        else:
+            self.logger.info('Starting %d worker processes' % self.num_jobs)
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_jobs,
+                                                                   initializer=init_worker,
+                                                                   initargs=(util.WebifyLogger.registry, util.pandoc_converter, profiling.profiler.enabled))
+
+    def shutdown(self):
+        self.wait()
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+        # Worker processes take their pandoc processes with them, threads do not
+        util.pandoc_converter.close()
+
+    def submit(self, func, args, snapshot, output_filepath, done_func):
+        """
+        Jobs writing to the same output file are not allowed to run
+        concurrently.  A serial run processes these in order, the last
+        one wins.
+        """
+        self.wait_for(output_filepath)
+        self.start()
+        self.logger.debug('Submitting job: %s' % output_filepath)
+        future = self.executor.submit(run_job if self.use_threads else run_job_in_process, func, args, snapshot)
+        self.pending.append((future, done_func))
+        self.outputs[output_filepath] = future
+
+    def wait_for(self, output_filepath):
+        future = self.outputs.get(output_filepath)
+        if future:
+            self.logger.debug('Waiting for job: %s' % output_filepath)
+            concurrent.futures.wait([future])
+
+    def wait(self):
+        for future, done_func in self.pending:
+            try:
+                result = future.result()
+                if not self.use_threads:
+                    result, records = result
+                    profiling.profiler.merge(records)
+            except Exception as e:
+                self.logger.warning('Job failed: %s' % e)
+                result = None
+            done_func(result)
+        self.pending = []
+        self.outputs = {}
+
+class CopyPool(JobPool):
+    """
+    Copies assets (images, pdfs, videos, ...) to the destination folder in 
+    a pool of threads, so that disk i/o overlaps with conversions.  Copies 
+    need neither the rendering context nor a worker process.  As with
+    JobPool, results are reported in submission order by wait().
+    """
+    def __init__(self, num_threads):
+        super().__init__(num_threads, use_threads=True)
+
+    def start(self):
+        if self.executor:
+            return
+        self.logger.info('Starting %d copy threads' % self.num_jobs)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_jobs, thread_name_prefix='copy')
+
+    def submit(self, func, args, output_filepath, done_func):
+        self.wait_for(output_filepath)
+        self.start()
+        self.logger.debug('Submitting copy: %s' % output_filepath)
+        future = self.executor.submit(func, *args)
+        self.pending.append((future, done_func))
+        self.outputs[output_filepath] = future
+
+class NotebookPool(JobPool):
+    """
+    Executes and converts jupyter notebooks in a pool of threads, each 
+    driving one kernel (see nbfile.KernelPool), so that a long running
+    notebook does not hold up the rest of the build.  Timeouts and 
+    failures are reported by wait(), along with other results.
+    """
+    def __init__(self, num_kernels, kernel_pool):
+        super().__init__(num_kernels, use_threads=True)
+        self.kernel_pool = kernel_pool
+
+    def submit(self, func, args, snapshot, output_filepath, done_func):
+        # The kernel pool starts spare kernels for folders with queued notebooks
+        cwd = self.kernel_pool.expect(args[0].filepath)
+        super().submit(self.run, (func, args, cwd), snapshot, output_filepath, done_func)
+
+    def run(self, func, args, cwd, rc):
+        self.kernel_pool.begin(cwd)
+        return func(*args, rc)
+
+    def start(self):
+        if self.executor:
+            return
+        self.logger.info('Starting %d notebook threads' % self.num_jobs)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_jobs, thread_name_prefix='notebook')
@@ -0,0 +1,254 @@
+import util2 as util
+import os
+import json
+import hashlib
+import codecs
+import stat
+
+manifest_filename = '.webify-manifest.json'
+
+def default_cache_dir(destdir):
+    """
+    Returns the folder where webify keeps the build manifest and its caches
+    for destdir (see --cache-dir).  It lives in the user's cache folder,
+    outside the website, since the manifest and the caches hold absolute
+    source paths, executed notebooks and pickles.
+    """
+    destdir = os.path.abspath(destdir)
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.sha1(destdir.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(base, 'webify', '%s-%s' % (os.path.basename(destdir), key))
+
+def file_hash(filepath):
+    h = hashlib.sha1()
+    try:
+        with open(filepath, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(1 << 20), b''):
+                h.update(chunk)
+    except:
+        return None
+    return h.hexdigest()
+
+def fingerprint_default(o):
+    # Dates, markup, etc. are fingerprinted via their string value.  Objects
+    # that do not define one (e.g., MDfile objects stored in directory 
+    # listings) would give a different string on every run, these are skipped.
+    # Values computed on demand (see nbfile.LessonPlan) provide __fingerprint__,
+    # so that fingerprinting does not compute them.
+    if hasattr(o, '__fingerprint__'):
+        return o.__fingerprint__()
+    if type(o).__str__ is object.__str__:
+        return None
+    return str(o)
+
+def fingerprint(data):
+    """
+    Returns a hash of the (json-able) data.  Used to record the settings
+    and the rendering context that went into an output file.
+    """
+    s = json.dumps(data, sort_keys=True, default=fingerprint_default)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+class FileStats:
+    """
+    Memoized file (size, mtime) signatures and content hashes for the
+    duration of one build.  A template or a css file shared by hundreds of
+    pages is only looked at once.
+
+    The memo is not sent to worker processes (see jobs.py), workers
+    collect their own.
+    """
+    def __init__(self):
+        self.signatures = {}
+        self.hashes = {}
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def scan(self, rootdir):
+        """
+        Collects signatures of all files found in rootdir in a single
+        os.scandir pass.
+        """
+        dirs = [rootdir]
+        while len(dirs) > 0:
+            cur_dir = dirs.pop()
+            try:
+                for entry in os.scandir(cur_dir):
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        self.signatures[os.path.normpath(entry.path)] = [st.st_size, st.st_mtime_ns]
+            except OSError:
+                pass
+        return self
+
+    def signature(self, filepath):
+        """
+        Returns [size, mtime] for filepath, or None if it is not a file.
+        """
+        filepath = os.path.normpath(filepath)
+        if not filepath in self.signatures.keys():
+            try:
+                st = os.stat(filepath)
+                self.signatures[filepath] = [st.st_size, st.st_mtime_ns] if stat.S_ISREG(st.st_mode) else None
+            except OSError:
+                self.signatures[filepath] = None
+        return self.signatures[filepath]
+
+    def hash(self, filepath):
+        filepath = os.path.normpath(filepath)
+        if not filepath in self.hashes.keys():
+            self.hashes[filepath] = file_hash(filepath)
+        return self.hashes[filepath]
+
+    def set_hash(self, filepath, digest):
+        """
+        Records a hash computed elsewhere, e.g., by a copy thread.
+        """
+        self.hashes[os.path.normpath(filepath)] = digest
+
+    def invalidate(self, filepath):
+        filepath = os.path.normpath(filepath)
+        self.signatures.pop(filepath, None)
+        self.hashes.pop(filepath, None)
+
+def make_record(src_filepath, files, output_filepath, context, stats, with_hashes=True, context_keys=None):
+    """
+    Records how output_filepath was built: its source, the files it depends
+    upon and the rendering context fingerprint.  Hashes are optional, these
+    are skipped for large assets that are simply copied.  Dependencies that
+    do not exist (e.g., a css file named in the frontmatter that is not
+    there) are recorded as None.
+
+    context_keys maps the rendering context keys read while rendering
+    output_filepath to the fingerprints of their values (see 
+    RenderingContext.fingerprints).
+    """
+    stats.invalidate(output_filepath)
+    deps = {}
+    for f in files:
+        sig = stats.signature(f)
+        deps[os.path.normpath(f)] = sig + [stats.hash(f) if with_hashes else None] if sig else None
+    return {
+        'src': src_filepath,
+        'deps': deps,
+        'context': context,
+        'context_keys': context_keys,
+        'output': stats.signature(output_filepath)
+    }
+
+def check(record, files, output_filepath, context, stats, rc=None):
+    """
+    Returns True if output_filepath is up-to-date according to record,
+    False if it needs to be rebuilt and None if record cannot tell (no
+    record, or the output file was changed by someone else).  In the last
+    case the caller falls back to comparing timestamps.
+
+    Dependencies whose timestamps changed but whose contents didn't are
+    updated in place in the record.
+
+    If rc is given, the output is also checked against the values of the
+    rendering context keys that were read when it was last rendered.  A
+    record without these keys needs a rebuild, so that they get recorded.
+    """
+    logger = util.WebifyLogger.get('manifest')
+
+    if not record:
+        return None
+
+    output_sig = stats.signature(output_filepath)
+    if not output_sig:
+        logger.debug('Output missing: %s' % output_filepath)
+        return False
+    if output_sig != record['output']:
+        logger.debug('Output changed outside webify: %s' % output_filepath)
+        return None
+
+    if context != record['context']:
+        logger.debug('Context changed: %s' % output_filepath)
+        return False
+
+    if rc != None:
+        context_keys = record.get('context_keys')
+        if context_keys == None:
+            logger.debug('Rendering context keys not recorded: %s' % output_filepath)
+            return False
+        for k, v in context_keys.items():
+            if rc.fingerprint(k) != v:
+                logger.debug('Rendering context key "%s" changed: %s' % (k, output_filepath))
+                return False
+
+    files = set([os.path.normpath(f) for f in files])
+    if files != set(record['deps'].keys()):
+        logger.debug('Dependencies changed: %s' % output_filepath)
+        return False
+
+    for f in files:
+        sig = stats.signature(f)
+        dep = record['deps'][f]
+        if not sig or not dep:
+            if not sig and not dep:
+                continue
+            logger.debug('Dependency %s: %s (%s)' % ('removed' if dep else 'added', f, output_filepath))
+            return False
+        if sig == dep[:2]:
+            continue
+        if dep[2] == None or stats.hash(f) != dep[2]:
+            logger.debug('Dependency changed: %s (%s)' % (f, output_filepath))
+            return False
+        record['deps'][f] = sig + [dep[2]]
+
+    return True
+
+class BuildManifest:
+    """
+    On-disk record of every output file generated by webify.  It lives in
+    the cache folder (see default_cache_dir).  Each entry records the
+    source file, the files the output depends upon (size, mtime and content
+    hash) and a fingerprint of the rendering context used to generate the
+    output.
+    """
+    def __init__(self, destdir, cache_dir):
+        self.logger = util.WebifyLogger.get('manifest')
+        self.destdir = destdir
+        self.filepath = os.path.join(cache_dir, manifest_filename)
+        self.records = {}
+
+    def load(self):
+        try:
+            with codecs.open(self.filepath, 'r', 'utf-8') as stream:
+                self.records = json.load(stream)['outputs']
+            self.logger.debug('Loaded build manifest: %s' % self.filepath)
+        except:
+            self.logger.debug('Cannot load build manifest: %s' % self.filepath)
+            self.records = {}
+        return self
+
+    def save(self):
+        tmp_filepath = self.filepath + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            with codecs.open(tmp_filepath, 'w', 'utf-8') as stream:
+                json.dump({'outputs': self.records}, stream)
+            os.replace(tmp_filepath, self.filepath)
+            self.logger.debug('Saved build manifest: %s' % self.filepath)
+        except:
+            self.logger.warning('Cannot save build manifest: %s' % self.filepath)
+
+    def key(self, output_filepath):
+        return os.path.relpath(output_filepath, self.destdir).replace('\\','/')
+
+    def get(self, output_filepath):
+        return self.records.get(self.key(output_filepath))
+
+    def set(self, output_filepath, record):
+        if record:
+            self.records[self.key(output_filepath)] = record
+
+    def remove(self, output_filepath):
+        self.records.pop(self.key(output_filepath), None)
@@ -15,6 +15,8 @@ import datetime
 import rc as RenderingContext
 import dateutil.parser
 import time_util as tm
+import manifest as mf
+import profiling
 
 from globals import __version__
 __logfile__ = 'mdfile.log'
@@ -188,10 +190,18 @@ class MDfile:
         self.rootdir = os.path.split(filepath)[0]
         self.args = args
         self.output_format = None
+        self.manifest_record = None
+        self.file_stats = None
+        self.build_record = None
+        self.dependencies = []
+        self.context_keys = set()
+        self.buffer = None
+        self.loaded = False
+        self.metadata_only = False
 
         self.logger.debug('Processing: %s' % self.filepath)
         self.logger.debug('rootdir:    %s' % self.rootdir)
-        self.logger.debug(pp.pformat(self.args, indent=2))
+        self.logger.debug(util.WebifyLogger.pformat(self.args, indent=2))
         
         # if util.WebifyLogger.is_debug(self.logger):
         #     print('args:')
@@ -228,39 +238,86 @@ class MDfile:
 
     def set_default(self, key, value):
         self.defaults[key] = value
-        
-    def load(self, rc={}):
-        self.yaml = {}
 
-        logger_file = util.WebifyLogger.get('md-file')
-        logger_buffer = util.WebifyLogger.get('md-buffer')
+    def set_manifest_record(self, record, file_stats):
+        """
+        record is what the build manifest knows about the last time this
+        file was compiled (or None).  If set, it is used to decide whether
+        or not the file needs compilation.
+        """
+        self.manifest_record = record
+        self.file_stats = file_stats
+
+    def get_build_record(self):
+        return self.build_record
+
+    def get_fingerprint(self):
+        args = dict(self.args)
+        args.pop('ignore-times', None)
+        return mf.fingerprint({'yaml': self.get_yaml(), 'args': args, 'defaults': self.defaults})
+        
+    def load_buffer(self):
+        """
+        Reads the file in to a buffer, unless it is already there.
+        """
+        if self.buffer != None:
+            return True
 
-        # Read the file in to a buffer
         try:
             with codecs.open(self.filepath, 'r', 'utf-8') as stream:
                 self.buffer = stream.read()
-            logger_file.info('Loaded markdown file: %s' % self.filepath)
-            logger_buffer.debug(pp.pformat(self.buffer))
+            util.WebifyLogger.get('md-file').info('Loaded markdown file: %s' % self.filepath)
+            util.WebifyLogger.get('md-buffer').debug(util.WebifyLogger.pformat(self.buffer))
         except:
             self.logger.warning('Cannot load: %s' % self.filepath)
             self.buffer = None
             return False
+        return True
+
+    def load(self, rc={}, metadata_only=False):
+        """
+        Loads the yaml frontmatter.  If metadata_only is True, the file is
+        only read up to the end of the frontmatter.  The rest is read in by
+        convert, once it is known that the file needs compilation, and
+        dropped again afterwards.
+        """
+        self.yaml = {}
+        self.buffer = None
+        self.loaded = False
+        self.metadata_only = metadata_only
+
+        logger_file = util.WebifyLogger.get('md-file')
+
+        # Try to get the first yaml section from the file.  Only the first
+        # yaml section is read in, so there is no need to scan the rest of
+        # the file.
+        if metadata_only:
+            try:
+                with open(self.filepath, 'r', encoding='utf-8', newline='\n') as stream:
+                    frontmatter = yamlfile.read_frontmatter(stream)
+                logger_file.info('Loaded markdown frontmatter: %s' % self.filepath)
+            except:
+                self.logger.warning('Cannot load: %s' % self.filepath)
+                return False
+        else:
+            if not self.load_buffer():
+                return False
+            frontmatter = yamlfile.split_frontmatter(self.buffer)
+        self.loaded = True
 
-        # Try to get the first yaml section from the file
         try:
-            yamlsections = yaml.safe_load_all(self.buffer)
-            for section in yamlsections:
-                self.yaml = section
-                logger_file.info('YAML section found')
-                logger_file.debug(pp.pformat(self.yaml))
-                break # Only the first yaml section is read in
+            self.yaml = yamlfile.frontmatter_cache.load(frontmatter, default={})
+            logger_file.info('YAML section found')
+            logger_file.debug(util.WebifyLogger.pformat(self.yaml))
         except:
             self.logger.warning('YAML loader problems: %s' % self.filepath)
+            frontmatter = None
             
         # If yaml section found, good.  If not create a {} yaml section.
         if not isinstance(self.yaml, dict):
             self.logger.warning('YAML section not found in md file: %s' % self.filepath)
             self.yaml = {}
+            frontmatter = None
         elif len(self.get_yaml().keys()) == 0:
             self.logger.warning('Loaded an empty YAML section (check for missing "" around yaml values or other syntax errors): %s' % self.filepath)
         else:
@@ -275,18 +332,25 @@ class MDfile:
         if self.get_preprocess_frontmatter():
             logger_file.info('Preprocessing YAML front matter via mustache')
             try:
-                yaml_str = yaml.dump(self.get_yaml())
+                yaml_str = yamlfile.frontmatter_cache.dump(frontmatter) if frontmatter else yaml.dump(self.get_yaml())
                 s = util.mustache_renderer(template=yaml_str, render_filepath=self.filepath, context=rc.data(), src_filepath=self.filepath)
-                self.set_yaml(yaml.safe_load(s))
+                self.set_yaml(yamlfile.frontmatter_cache.load(s))
             except:
                 self.logger.warning('Failed: preprocessing YAML front matter via mustache')
             logger_file.debug('YAML frontmatter after preprocessing')
-            logger_file.debug(pp.pformat(self.get_yaml()))
+            logger_file.debug(util.WebifyLogger.pformat(self.get_yaml()))
 
         return True
 
     def convert(self, rc={}):
-        if not self.buffer:
+        try:
+            return self.convert_(rc)
+        finally:
+            if self.metadata_only:
+                self.buffer = None
+
+    def convert_(self, rc):
+        if not self.loaded:
             return 'error', 'Load error', self.filepath
 
         # This allow load and convert to be separated by 
@@ -304,7 +368,7 @@ class MDfile:
         # rc.pop()
         rc.add(self.get_yaml())
         util.WebifyLogger.get('md-rc').debug('rendering context for %s' % self.filepath)
-        util.WebifyLogger.get('md-rc').debug(pp.pformat(rc.data()))
+        util.WebifyLogger.get('md-rc').debug(util.WebifyLogger.pformat(rc.data()))
 
         output_format = self.get_output_format()
 
@@ -325,7 +389,12 @@ class MDfile:
             util.WebifyLogger.get('md-file').info('Output format: "%s":' % output_format)
         
         convertor = self.formats[output_format]['fn']
-        return convertor(rc)
+        ret = convertor(rc)
+        if ret[0] == 'file' and self.file_stats:
+            # Keys defined by this file are covered by the file itself
+            keys = self.context_keys - set(self.get_yaml().keys()) - set(['body'])
+            self.build_record = mf.make_record(self.filepath, self.dependencies, ret[1], self.get_fingerprint(), self.file_stats, context_keys=rc.fingerprints(keys))
+        return ret
 
     def latexify(self, rc):
         files = [self.filepath]
@@ -373,7 +442,7 @@ class MDfile:
         pdoc_args.add('include-before-body', include_files['include-before-body'])
         pdoc_args.add('include-after-body',  include_files['include-after-body'])
         logger_file.debug('Pandoc include files:')
-        logger_file.debug(pp.pformat(include_files, indent=2))
+        logger_file.debug(util.WebifyLogger.pformat(include_files, indent=2))
         # if util.WebifyLogger.is_debug(self.logger):
         #     print('Pandoc include files:')
         #     pp.pprint(include_files, indent=2)
@@ -384,7 +453,7 @@ class MDfile:
         output_filepath = self.make_output_filepath()
         logger_file.debug('Output file: %s' % output_filepath)
 
-        if self.needs_compilation(files, output_filepath):
+        if self.needs_compilation(files, output_filepath, rc):
             logger_file.debug('Needs compilation YES')
         else:
             logger_file.debug('Needs compilation NO')
@@ -393,6 +462,9 @@ class MDfile:
 
         logger_file.info('Compiling')
 
+        if not self.load_buffer() or not self.buffer:
+            return 'error', 'Load error', self.filepath
+
         hf, hf_file_list = self.get_html_filters()
         if len(hf_file_list) > 0:
             self.logger.warning('HTML medial filters are only available when converting to html: %s' % self.filepath)
@@ -447,7 +519,7 @@ class MDfile:
         pdoc_args.add('include-before-body', include_files['include-before-body'])
         pdoc_args.add('include-after-body',  include_files['include-after-body'])
         logger_file.debug('Pandoc include files:')
-        logger_file.debug(pp.pformat(include_files, indent=2))
+        logger_file.debug(util.WebifyLogger.pformat(include_files, indent=2))
         files.extend(include_files['include-in-header'])
         files.extend(include_files['include-before-body'])
         files.extend(include_files['include-after-body'])
@@ -463,7 +535,7 @@ class MDfile:
             output_filepath = None
             logger_file.info('Not creating output file: %s' % self.filepath)
 
-        if self.needs_compilation(files, output_filepath):
+        if self.needs_compilation(files, output_filepath, rc):
             logger_file.debug('Needs compilation YES')
         else:
             logger_file.debug('Needs compilation NO')
@@ -472,14 +544,21 @@ class MDfile:
 
         logger_file.info('Compiling')
 
+        if not self.load_buffer() or not self.buffer:
+            return 'error', 'Load error', self.filepath
+
         if len(hf_file_list) > 0:
             logger_file.info('Applying HTML filter')
             f = HTML_Filter(hf)
-            self.buffer = f.apply(self.buffer, self.filepath)                    
+            with profiling.profiler.stage('html-filter', self.filepath):
+                self.buffer = f.apply(self.buffer, self.filepath)
 
         if self.get_preprocess_buffer(): 
             logger_file.info('Preprocessing markdown buffer using mustache')
-            self.buffer = util.mustache_renderer(template=self.buffer, render_filepath=self.filepath, context=rc.data(), src_filepath=self.filepath)
+            context = rc.track()
+            with profiling.profiler.stage('render', self.filepath):
+                self.buffer = util.mustache_renderer(template=self.buffer, render_filepath=self.filepath, context=context, src_filepath=self.filepath)
+            self.context_keys.update(context.accessed)
         
         pdoc_args.add('highlight-style', self.get_highlight_style())
         pdoc_args.add_flag('mathjax')
@@ -497,13 +576,18 @@ class MDfile:
             rc.add({'body': markupsafe.Markup(r[1])})
             renderer_name, render_engine = self.get_renderer()
             logger_file.info('Using renderer: %s' % renderer_name)
-            buffer = util.render(render_engine, render_file, rc.data(), self.filepath)
+            context = rc.track()
+            with profiling.profiler.stage('render', self.filepath):
+                buffer = util.render(render_engine, render_file, context, self.filepath)
+            self.context_keys.update(context.accessed)
         else:
             buffer = markupsafe.Markup(r[1])
 
         if output_filepath:
             logger_file.info('Writing to: %s' % output_filepath)
-            if util.save_to_file(output_filepath, buffer):
+            with profiling.profiler.stage('write', self.filepath):
+                saved = util.save_to_file(output_filepath, buffer)
+            if saved:
                 return 'file', output_filepath, self.filepath
             else:
                 logger_file.warning('Error saving to output file: %s' % output_filepath)
@@ -517,16 +601,17 @@ class MDfile:
         ret_type = 'file' if output_filepath else 'buffer'
         # ret_val = output_filepath
 
-        cwd = os.getcwd()
-        os.chdir(self.rootdir)
-    
         logger_pandoc = util.WebifyLogger.get('pandoc')
         logger_pandoc.debug("output format: %s" % output_format)
         logger_pandoc.debug("pandoc args:")
-        logger_pandoc.debug(pp.pformat(pandoc_args))
+        logger_pandoc.debug(util.WebifyLogger.pformat(pandoc_args))
 
+        # Pandoc runs in the folder containing the markdown file, so relative
+        # paths found in the frontmatter resolve as expected.  We do not
+        # os.chdir() here, so that multiple files can be compiled concurrently.
         try:
-            ret_val = pypandoc.convert_text(self.buffer, to=output_format, format='md', outputfile=output_filepath, extra_args=pandoc_args)
+            with profiling.profiler.stage('pandoc', self.filepath):
+                ret_val = util.pandoc_converter.convert(self.buffer, to=output_format, format='md', outputfile=output_filepath, extra_args=pandoc_args, cwd=self.rootdir)
             ret_val = output_filepath if output_filepath else ret_val
             self.logger.debug('Converted to "%s": %s' % (output_format, output_filepath))
             ret = ret_type, ret_val, self.filepath
@@ -539,8 +624,6 @@ class MDfile:
             self.logger.error('--- Pandoc says ---\n\n%s\n---' % e)
             ret = 'error', '', self.filepath
 
-        os.chdir(cwd)
-
         return ret
 
     def make_output_filepath(self):
@@ -553,10 +636,12 @@ class MDfile:
         output_format = self.get_output_format()
         return self.formats[output_format]['ext']
 
-    def needs_compilation(self, files, output_filepath):
+    def needs_compilation(self, files, output_filepath, rc=None):
         logger_timestamps = util.WebifyLogger.get('md-timestamps')
         logger_timestamps.debug('Checking timestamps.')
 
+        self.dependencies = files
+
         if not output_filepath:
             logger_timestamps.debug('\tOutput filepath not specified.')
             logger_timestamps.debug('\tCompilation needed.')
@@ -566,6 +651,13 @@ class MDfile:
             logger_timestamps.debug('\tIgnore times flag is True')
             logger_timestamps.debug('\tCompilation needed.')
             return True
+
+        if self.file_stats:
+            up_to_date = mf.check(self.manifest_record, files, output_filepath, self.get_fingerprint(), self.file_stats, rc)
+            if up_to_date != None:
+                logger_timestamps.debug('\tBuild manifest says up-to-date: %s' % up_to_date)
+                self.build_record = self.manifest_record
+                return not up_to_date
         
         if output_filepath and not os.path.isfile(output_filepath): 
             logger_timestamps.debug('\tOutput filepath is not a file %s' % output_filepath)
@@ -586,6 +678,8 @@ class MDfile:
                 logger_timestamps.debug('\tIgnoring %s.  Not a file.' % f)
 
         logger_timestamps.debug('\tCompilation not needed.')
+        if self.file_stats:
+            self.build_record = mf.make_record(self.filepath, files, output_filepath, self.get_fingerprint(), self.file_stats)
         return False
 
     def get_availability(self):
@@ -890,7 +984,7 @@ if __name__ == '__main__':
     logger.debug('Prog name:    %s' % prog_name)
     logger.debug('Prog dir:     %s' % prog_dir)
     logger.debug('Current dir:  %s' % cur_dir)
-    logger.debug(pp.pformat(cmdline_args))
+    logger.debug(util.WebifyLogger.pformat(cmdline_args))
 
 
     # if util.WebifyLogger.is_debug(logger):
@@ -974,7 +1068,7 @@ if __name__ == '__main__':
                'pandoc-meta': cmdline_args.pandoc_meta}
 
     logger.debug('args:')
-    logger.debug(pp.pformat(args))    
+    logger.debug(util.WebifyLogger.pformat(args))    
 
     meta_data = {
         '__version__': __version__,
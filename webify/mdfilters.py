@@ -4,6 +4,8 @@ import os
 import re
 import util2 as util
 import ast
+import functools
+import threading
 
 # We have four options here.  A single image, a series of images, a single video, a series of videos.
 #
@@ -15,45 +17,65 @@ import ast
 #
 # The user can provide up to four mustache templates, one corresponding to each of the four cases.
 
+# ![caption](file), where the caption may embed a python dict of extra
+# template values: ![caption !{'width': '50%'}](file)
+media_re = re.compile('(\\!\\[.*?\\])(\\(.+?\\))', flags=re.DOTALL)
+caption_info_re = re.compile('!\\{.+?\\}')
+
+img_ext = ('.gif','.png','.jpg','.jpeg')
+vid_ext = ('.mp4')
+
+@functools.lru_cache(maxsize=1024)
+def parse_caption_info(info):
+    return ast.literal_eval(info)
+
+class MediaTemplates:
+    """
+    Media template files, read once and cached by path.  These are shared 
+    by every markdown file that uses them.  A template that changed on disk
+    (e.g., in --live mode) is read again.
+    """
+    def __init__(self):
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def get(self, filepath):
+        st = os.stat(filepath)
+        signature = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.templates.get(filepath)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        with codecs.open(filepath, 'r', 'utf-8') as stream:
+            template = stream.read()
+        with self.lock:
+            self.templates[filepath] = (signature, template)
+        return template
+
+media_templates = MediaTemplates()
+
 class HTML_Filter:
 
     def __init__(self, files):
         self.logger = util.WebifyLogger.get('mdfile')
-        
-        try:
-            if files['html-img']:
-                with codecs.open(files['html-img'], 'r', 'utf-8') as stream:
-                    self.img_template = stream.read()
-        except:
-            self.img_template = None
-            self.logger.warning('Cannot load %s' % files['html-img'])
 
-        try:
-            if files['html-imgs']:
-                with codecs.open(files['html-imgs'], 'r', 'utf-8') as stream:
-                    self.img_grid_template = stream.read()
-        except:
-            self.img_grid_template = None
-            self.logger.warning('Cannot load %s' % files['html-imgs'])
+        self.img_template = self.load_template(files, 'html-img')
+        self.img_grid_template = self.load_template(files, 'html-imgs')
+        self.vid_template = self.load_template(files, 'html-vid')
+        self.vid_grid_template = self.load_template(files, 'html-vids')
 
-        try:
-            if files['html-vid']:
-                with codecs.open(files['html-vid'], 'r', 'utf-8') as stream:
-                    self.vid_template = stream.read()
-        except:
-            self.vid_template = None
-            self.logger.warning('Cannot load %s' % files['html-vid'])
+        self.img_ext = img_ext
+        self.vid_ext = vid_ext
 
+    def load_template(self, files, key):
+        if not files[key]:
+            return None
         try:
-            if files['html-vids']:
-                with codecs.open(files['html-vids'], 'r', 'utf-8') as stream:
-                    self.vid_grid_template = stream.read()
+            return media_templates.get(files[key])
         except:
-            self.vid_template = None
-            self.logger.warning('Cannot load %s' % files['html-vids'])
-
-        self.img_ext = ('.gif','.png','.jpg','.jpeg')
-        self.vid_ext = ('.mp4')
+            self.logger.warning('Cannot load %s' % files[key])
+            return None
 
     def is_image(self, filename):
         return filename.lower().endswith(self.img_ext)
@@ -65,11 +87,9 @@ class HTML_Filter:
         assert(buffer)
 
         i = 0
-        tmp_buffer = ''
+        parts = []
 
-        img_re = '(\\!\\[.*?\\])(\\(.+?\\))'
-        imgs = re.finditer(img_re, buffer, flags=re.DOTALL)
-        for img in imgs:
+        for img in media_re.finditer(buffer):
             s = img.start()
             e = img.end()
             caption = img.group(1)[2:-1]
@@ -77,20 +97,15 @@ class HTML_Filter:
 
             context = {}
             if len(caption) > 0:
-                caption_re = '!\\{.+?\\}'
-                caption_embedded_info = re.search(caption_re, caption)
+                caption_embedded_info = caption_info_re.search(caption) if '!{' in caption else None
                 if caption_embedded_info:
                     info = caption_embedded_info.group(0)[1:] 
                     try:
-                        info_dict = ast.literal_eval(info)
-                        context.update(info_dict)
-                        stripped_caption = caption[:caption_embedded_info.start()]
-                        stripped_caption += caption[caption_embedded_info.end():]
-                        caption = stripped_caption
+                        context.update(parse_caption_info(info))
+                        caption = caption[:caption_embedded_info.start()] + caption[caption_embedded_info.end():]
                     except:
                         self.logger.warning('Invalid caption info: "%s" in %s. \n\tExpecting items of the form "!{\'x\':\'a\', \'y\':\'b\'}".' % (info, src_filepath))
                 context['caption'] = caption.strip()
-#                print(context)
 
             mm = mediafile.split('|')
             if len(mm) == 1:
@@ -130,16 +145,16 @@ class HTML_Filter:
                     self.logger.debug('Applying HTML Media Filter to object %s' % buffer[s:e])
                 except:
                     self.logger.warning('Cannot apply HTML Media Filter to object %s' % buffer[s:e])
-                    r = buffer[s:img.end()]
+                    r = buffer[s:e]
 
-                tmp_buffer += buffer[i:s]
-                tmp_buffer += r
+                parts.append(buffer[i:s])
+                parts.append(r)
             else:
-                tmp_buffer += buffer[i:e]
+                parts.append(buffer[i:e])
             i = e
 
         if i > 0:
-            tmp_buffer += buffer[i:]
-            buffer = tmp_buffer
+            parts.append(buffer[i:])
+            buffer = ''.join(parts)
 
         return buffer
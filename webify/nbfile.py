@@ -9,6 +9,299 @@ import re
 import pypandoc
 import subprocess
 import pathlib
+import hashlib
+import threading
+import concurrent.futures
+import nbconvert
+from nbclient.exceptions import CellTimeoutError
+from jupyter_core.utils import run_sync
+from jupyter_client import AsyncKernelManager
+
+# Kernel and timeout (in seconds) used to execute notebooks
+kernel_name = 'python3'
+execute_timeout = 600
+
+class KernelPool:
+    """
+    Hands out started kernels for executing notebooks.  A kernel runs
+    a single notebook, since a notebook leaves state behind (variables, 
+    imported modules, its working folder) that the next one must not see.
+    What is reused is kernel startup: whenever a kernel is handed out, a 
+    spare one is started in the background for the same folder, if more 
+    notebooks are queued there (see expect and begin).  Spares left in 
+    folders without queued notebooks are shut down.  At most max_spares 
+    kernels are kept waiting or starting.
+    """
+    def __init__(self, max_spares=1):
+        self.logger = util.WebifyLogger.get('nb')
+        self.max_spares = max_spares
+        # Started kernels, {cwd: [km]}
+        self.spares = {}
+        # Kernels being started, {cwd: count}
+        self.starting = {}
+        # Notebooks queued for execution, {cwd: count}
+        self.queued = {}
+        self.num_spares = 0
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='kernel')
+
+    def start_kernel(self, cwd):
+        km = AsyncKernelManager(kernel_name=kernel_name)
+        run_sync(km.start_kernel)(cwd=cwd)
+        return km
+
+    def expect(self, filepath):
+        """
+        Called when a notebook is queued for execution, returns its folder.
+        """
+        cwd = str(pathlib.Path(filepath).parent)
+        with self.lock:
+            self.queued[cwd] = self.queued.get(cwd, 0) + 1
+        return cwd
+
+    def begin(self, cwd):
+        """
+        Called when the execution of a notebook queued by expect starts.
+        """
+        with self.lock:
+            self.queued[cwd] -= 1
+            if self.queued[cwd] == 0:
+                del self.queued[cwd]
+
+    def prestart(self, cwd):
+        with self.lock:
+            if self.num_spares >= self.max_spares:
+                return
+            if self.queued.get(cwd, 0) <= len(self.spares.get(cwd, [])) + self.starting.get(cwd, 0):
+                return
+            self.num_spares += 1
+            self.starting[cwd] = self.starting.get(cwd, 0) + 1
+        self.executor.submit(self.prestart_, cwd)
+
+    def prestart_(self, cwd):
+        try:
+            km = self.start_kernel(cwd)
+        except Exception as e:
+            self.logger.debug('Cannot start spare kernel in %s: %s' % (cwd, e))
+            km = None
+        with self.lock:
+            self.starting[cwd] -= 1
+            if km and cwd in self.queued:
+                self.spares.setdefault(cwd, []).append(km)
+                return
+            self.num_spares -= 1
+        if km:
+            self.logger.debug('No notebooks left for spare kernel in %s' % cwd)
+            self.release(km)
+
+    def acquire(self, cwd):
+        km = None
+        unused = []
+        with self.lock:
+            if len(self.spares.get(cwd, [])) > 0:
+                km = self.spares[cwd].pop()
+                self.num_spares -= 1
+            for d in [d for d in self.spares.keys() if not d in self.queued]:
+                unused.extend(self.spares.pop(d))
+            self.num_spares -= len(unused)
+        for k in unused:
+            self.release(k)
+        if km:
+            self.logger.debug('Using spare kernel in %s' % cwd)
+        else:
+            km = self.start_kernel(cwd)
+        self.prestart(cwd)
+        return km
+
+    def release(self, km):
+        try:
+            run_sync(km.shutdown_kernel)(now=True)
+        except Exception as e:
+            self.logger.debug('Cannot shut down kernel: %s' % e)
+
+    def shutdown(self):
+        """
+        Shuts down the spare kernels.
+        """
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            spares, self.spares, self.num_spares = self.spares, {}, 0
+            self.starting, self.queued = {}, {}
+        for kms in spares.values():
+            for km in kms:
+                self.release(km)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='kernel')
+
+# Set up by Webify when notebooks are executed in parallel (see --notebook-kernels)
+kernel_pool = None
+
+class LessonPlan:
+    """
+    The lesson plan of a notebook, converted from markdown to html when a
+    template first uses it.  Templates see it as markup (see __html__): it
+    renders as is, compares equal to its html and has the string methods.
+    """
+    def __init__(self, batch, text, filepath):
+        self.batch = batch
+        self.text = text
+        self.filepath = filepath
+        self.html = None
+
+    def get_html(self):
+        if self.html == None:
+            self.batch.convert()
+        return self.html
+
+    def __str__(self):
+        return self.get_html()
+
+    def __html__(self):
+        return self.get_html()
+
+    def __bool__(self):
+        return len(self.get_html()) > 0
+
+    def __len__(self):
+        return len(self.get_html())
+
+    def __eq__(self, other):
+        if isinstance(other, LessonPlan):
+            other = other.get_html()
+        return self.get_html() == other
+
+    def __hash__(self):
+        return hash(self.get_html())
+
+    def __contains__(self, s):
+        return s in self.get_html()
+
+    def __getitem__(self, key):
+        return self.get_html()[key]
+
+    # Not a list of characters (pystache sections iterate over lists)
+    __iter__ = None
+
+    def __add__(self, other):
+        return self.get_html() + str(other)
+
+    def __radd__(self, other):
+        return str(other) + self.get_html()
+
+    def __getattr__(self, name):
+        # String methods (strip, startswith, ...)
+        if name.startswith('__') or not hasattr(str, name):
+            raise AttributeError(name)
+        return getattr(self.get_html(), name)
+
+    def __repr__(self):
+        return 'LessonPlan(%s)' % self.filepath
+
+    def __fingerprint__(self):
+        # The html follows from the text, see manifest.fingerprint
+        return self.text
+
+class LessonPlanBatch:
+    """
+    The lesson plans of the notebooks in a folder.  The first one used
+    converts all of them: conversions are looked up in the pandoc snippet
+    cache by text, and the rest go to pandoc_converter.convert_batch 
+    together.  A batch sent to a worker process (see jobs.snapshot_context)
+    is converted first, so that workers do not convert it again.
+    """
+    def __init__(self):
+        self.logger = util.WebifyLogger.get('nb')
+        self.lesson_plans = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        self.convert()
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add(self, text, filepath):
+        lesson_plan = LessonPlan(self, text, filepath)
+        self.lesson_plans.append(lesson_plan)
+        return lesson_plan
+
+    def convert(self):
+        with self.lock:
+            pending = [lp for lp in self.lesson_plans if lp.html == None]
+            if len(pending) == 0:
+                return
+
+            converted = {}
+            cache = util.pandoc_snippet_cache
+            texts = []
+            for text in dict.fromkeys([lp.text for lp in pending]):
+                html = cache.get(text, util.pandoc_filter_args) if cache else None
+                if html != None:
+                    converted[text] = html
+                else:
+                    texts.append(text)
+
+            if len(texts) > 0:
+                self.logger.debug('Converting %d lesson plans' % len(texts))
+                conversions = [{'source': text, 'to': 'html', 'format': 'md', 'extra_args': util.pandoc_filter_args} for text in texts]
+                for text, r in zip(texts, util.pandoc_converter.convert_batch(conversions)):
+                    if not isinstance(r, Exception):
+                        converted[text] = r
+                        if cache:
+                            cache.set(text, util.pandoc_filter_args, r)
+
+            for lp in pending:
+                if lp.text in converted:
+                    lp.html = converted[lp.text]
+                else:
+                    self.logger.warning('Failed converting lesson plan to html using pandoc: %s' % lp.filepath)
+                    lp.html = lp.text
+
+class NotebookCache(util.DiskCache):
+    """
+    On-disk cache of executed notebooks and of their html.  Entries are 
+    keyed on the hash of the notebook json, the kernel name (if executed)
+    and the exporter settings, so that -i or a change elsewhere in the 
+    folder does not execute and convert the notebook again.
+
+    Executed notebooks are cached separately from their html.  An
+    nbconvert upgrade re-exports these, but does not re-execute these.
+    Note that execution results are assumed to depend upon the notebook
+    alone, not upon the data files next to it.
+    """
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self.exporter_settings = None
+
+    def get_exporter_settings(self, exporter):
+        if self.exporter_settings == None:
+            self.exporter_settings = json.dumps([nbconvert.__version__, exporter.template_name, exporter.config], sort_keys=True, default=str)
+        return self.exporter_settings
+
+    def executed_key(self, nb_hash):
+        return self.make_key('executed', nb_hash, kernel_name)
+
+    def html_key(self, nb_hash, execute_notebook, exporter):
+        return self.make_key('html', nb_hash, kernel_name if execute_notebook else None, self.get_exporter_settings(exporter))
+
+# Webify sets this up in the destination folder (see Webify.set_dest)
+notebook_cache = None
+
+exporters = threading.local()
+
+def get_exporter():
+    """
+    Returns the HTMLExporter of the calling thread.  Setting up an exporter
+    loads its templates and config, so it is done once per thread rather
+    than once per notebook.
+    """
+    exporter = getattr(exporters, 'html', None)
+    if exporter == None:
+        exporter = exporters.html = HTMLExporter()
+    return exporter
 
 class JupyterNotebookSettings:
     def __init__(self, dir, rc):
@@ -75,13 +368,26 @@ class JupyterNotebookfile:
         self.lesson_plan = None
         self.loaded = False
         self.execute_notebook = execute_notebook
+        self.nb = None
+        self.nb_hash = None
+
+    def read(self):
+        with open(self.filepath, 'rb') as f:
+            raw = f.read()
+        self.nb_hash = hashlib.sha1(raw).hexdigest()
+        self.nb = nbformat.reads(raw.decode('utf-8'), as_version=4)
 
     def load(self):
+        """
+        Parses the notebook and picks its title and lesson plan.  The parsed
+        notebook is kept for get_html_buffer, which drops it once converted.
+        Webify drops notebooks that are up to date as it goes through the
+        folder listing.
+        """
         try:
             self.logger.debug('Loading ipynb: %s' % self.filepath)
-            f = open(self.filepath, encoding='utf-8')
-            data = json.load(f)
-            self.process_cells(data['cells'])
+            self.read()
+            self.process_cells(self.nb.cells)
             self.loaded = True
         except ValueError as err:
             print('JSON parsing error:')
@@ -92,17 +398,17 @@ class JupyterNotebookfile:
         
         return self.loaded
 
-    def get_metadata(self):
+    def get_metadata(self, batch=None):
+        """
+        The lesson plan is converted to html when first used (see 
+        LessonPlan).  Notebooks that share batch have their lesson plans
+        converted together.
+        """
         assert(self.loaded)
 
-        pdoc_args =  ['--mathjax','--highlight-style=pygments']
-        try:
-            if isinstance(self.lesson_plan, str):
-                lesson_plan = pypandoc.convert_text(self.lesson_plan, to='html', format='md', extra_args=pdoc_args)
-            else:
-                lesson_plan = self.lesson_plan
-        except:
-            self.logger.warning('Failed converting lesson plan to html using pandoc: %s' % self.filepath)
+        if isinstance(self.lesson_plan, str):
+            lesson_plan = (batch or LessonPlanBatch()).add(self.lesson_plan, self.filepath)
+        else:
             lesson_plan = self.lesson_plan
 
         # print(self.title)
@@ -116,29 +422,74 @@ class JupyterNotebookfile:
     def get_html_buffer(self):
         self.logger.debug('')
         try:
-            with open(self.filepath) as f:
-                nb = nbformat.read(f, as_version=4)
+            if self.nb == None:
+                self.read()
         except:
             self.logger.warning('Jupyter Notebook read failed: %s' % self.filepath)
             return ''
-
+        nb, nb_hash = self.nb, self.nb_hash
+        self.nb = None
+
+        exporter = get_exporter()
+        if notebook_cache:
+            html_key = notebook_cache.html_key(nb_hash, self.execute_notebook, exporter)
+            buffer = notebook_cache.read(html_key)
+            if buffer != None:
+                self.logger.debug('Jupyter Notebook html found in cache: %s' % self.filepath)
+                return buffer
+
+        cacheable = True
         if self.execute_notebook:
             self.logger.info(' - execute-notebook: True')
-            try:
-                ep = ExecutePreprocessor(timeout=600, kernel_name='python3')
-                ep.preprocess(nb, {'metadata': {'path': pathlib.Path(self.filepath).parent}})
-            except:
-                self.logger.warning('Jupyter Notebook execution failed: %s' % self.filepath)
+            cacheable = self.execute(nb, nb_hash)
 
         try:
-            exporter = HTMLExporter()
             buffer, _ = exporter.from_notebook_node(nb)
         except:
             self.logger.warning('Jupyter Notebook conversion failed: %s' % self.filepath)
             return ''
 
+        if notebook_cache and cacheable:
+            notebook_cache.write(html_key, buffer)
         return buffer
 
+    def execute(self, nb, nb_hash):
+        """
+        Executes nb in place, or fills it in from the cache.  Returns False 
+        if execution failed.
+        """
+        if notebook_cache:
+            executed = notebook_cache.read(notebook_cache.executed_key(nb_hash))
+            if executed != None:
+                self.logger.debug('Executed Jupyter Notebook found in cache: %s' % self.filepath)
+                try:
+                    nb.update(nbformat.reads(executed, as_version=4))
+                    return True
+                except:
+                    pass
+
+        cwd = str(pathlib.Path(self.filepath).parent)
+        km, ep = None, None
+        try:
+            km = kernel_pool.acquire(cwd) if kernel_pool else None
+            ep = ExecutePreprocessor(timeout=execute_timeout, kernel_name=kernel_name)
+            ep.preprocess(nb, {'metadata': {'path': cwd}}, km=km)
+        except CellTimeoutError:
+            self.logger.warning('Jupyter Notebook execution timed out (%d seconds): %s' % (execute_timeout, self.filepath))
+            return False
+        except:
+            self.logger.warning('Jupyter Notebook execution failed: %s' % self.filepath)
+            return False
+        finally:
+            if km:
+                if ep and ep.kc:
+                    ep.kc.stop_channels()
+                kernel_pool.release(km)
+
+        if notebook_cache:
+            notebook_cache.write(notebook_cache.executed_key(nb_hash), nbformat.writes(nb))
+        return True
+
     def process_cell(self, source, cell_id):
         """
         Picks the first level-1 heading.  All subsequent headings are ignored.
@@ -176,7 +527,8 @@ class JupyterNotebookfile:
             if not cell['cell_type'] == 'markdown':
                 continue
 
-            title, lesson_plan = self.process_cell(cell['source'], i)
+            # nbformat joins the lines of a cell
+            title, lesson_plan = self.process_cell(cell['source'].splitlines(True), i)
             if isinstance(title, str):
                 self.title = title
             if isinstance(lesson_plan, str):
@@ -0,0 +1,53 @@
+-- Long-lived pandoc converter used by util2.PandocServer.
+--
+-- Run as "pandoc lua pandoc_server.lua".  Reads one JSON request per line
+-- from stdin and writes one JSON response per line to stdout.  A request is
+-- either a single conversion or a list of conversions (a batch):
+--
+--   {"text": "...", "from": "markdown", "to": "html", "mathjax": true, "cwd": "..."}
+--
+-- The response is {"output": "..."} or {"error": "..."}, or a list of these
+-- for a batch.  Output matches that of the pandoc command line, which ends
+-- non-standalone documents with a newline.
+
+local json = pandoc.json
+
+local function convert(req)
+  local ok, result = pcall(function()
+    local opts = {}
+    if req.mathjax then
+      opts.html_math_method = 'mathjax'
+    end
+    local function run()
+      local doc = pandoc.read(req.text, req.from)
+      return pandoc.write(doc, req.to, pandoc.WriterOptions(opts)) .. '\n'
+    end
+    if req.cwd then
+      return pandoc.system.with_working_directory(req.cwd, run)
+    end
+    return run()
+  end)
+  if ok then
+    return {output = result}
+  end
+  return {error = tostring(result)}
+end
+
+while true do
+  local line = io.read('l')
+  if not line then
+    break
+  end
+  local req = json.decode(line, false)
+  local res
+  if req[1] ~= nil then
+    res = {}
+    for i, r in ipairs(req) do
+      res[i] = convert(r)
+    end
+  else
+    res = convert(req)
+  end
+  io.write(json.encode(res), '\n')
+  io.stdout:flush()
+end
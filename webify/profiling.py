@@ -0,0 +1,129 @@
+"""
+Build profiler (see --profile).  Records the wall and cpu time that each
+source file spends in each build stage:
+
+  collect      scanning the source folder
+  yaml         loading yaml files
+  partials     processing a _partials folder
+  frontmatter  reading (and preprocessing) markdown frontmatter
+  html-filter  applying html media filters to markdown
+  pandoc       pandoc conversions
+  render       template rendering (mustache or jinja2)
+  notebook     converting jupyter notebooks to html
+  write        writing output files
+  copy         copying files to the destination folder
+
+Stages may nest, e.g., partials includes the yaml and markdown files in
+_partials.  CPU time is that of the calling thread, so it does not include
+child processes.  A stage whose wall time is much larger than its cpu time
+is mostly waiting on pandoc or jupyter.
+"""
+import os
+import csv
+import json
+import time
+import threading
+import collections
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_stage = NullStage()
+
+class Stage:
+    def __init__(self, profiler, stage, filepath):
+        self.profiler = profiler
+        self.stage = stage
+        self.filepath = filepath
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.stage, self.filepath, time.perf_counter() - self.wall, time.thread_time() - self.cpu)
+        return False
+
+class Profiler:
+    """
+    Collects (stage, filepath, wall, cpu) records.  Use as
+
+      with profiler.stage('pandoc', filepath):
+          ...
+
+    A disabled profiler hands out a shared no-op context manager, so
+    the hooks cost next to nothing when --profile is not set.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        self.lock = threading.Lock()
+
+    def stage(self, stage, filepath):
+        if not self.enabled:
+            return null_stage
+        return Stage(self, stage, filepath)
+
+    def add(self, stage, filepath, wall, cpu):
+        with self.lock:
+            self.records.append((stage, filepath, wall, cpu))
+
+    def take(self):
+        """
+        Returns the records collected so far and starts afresh.
+        """
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+    def merge(self, records):
+        with self.lock:
+            self.records.extend(records)
+
+def save_report(records, filepath):
+    """
+    Writes records to filepath, as csv if filepath ends in .csv, and as
+    json otherwise.
+    """
+    fields = ['stage', 'filepath', 'wall', 'cpu']
+    if os.path.splitext(filepath)[1].lower() == '.csv':
+        with open(filepath, 'w', newline='', encoding='utf-8') as stream:
+            writer = csv.writer(stream)
+            writer.writerow(fields)
+            for r in records:
+                writer.writerow([r[0], r[1], '%.6f' % r[2], '%.6f' % r[3]])
+    else:
+        with open(filepath, 'w', encoding='utf-8') as stream:
+            json.dump([dict(zip(fields, r)) for r in records], stream, indent=1)
+
+def summarize(records, top=10):
+    """
+    Returns the time spent in each stage, and the top slowest files along
+    with their slowest stages, as a list of lines.
+    """
+    stages = collections.OrderedDict()
+    files = collections.defaultdict(lambda: collections.defaultdict(float))
+    for stage, filepath, wall, cpu in records:
+        s = stages.setdefault(stage, [0, 0.0, 0.0])
+        s[0] += 1
+        s[1] += wall
+        s[2] += cpu
+        files[filepath][stage] += wall
+
+    lines = ['%-12s %8s %10s %10s' % ('Stage', 'Count', 'Wall (s)', 'CPU (s)')]
+    for stage, s in sorted(stages.items(), key=lambda x: -x[1][1]):
+        lines.append('%-12s %8d %10.3f %10.3f' % (stage, s[0], s[1], s[2]))
+
+    lines.append('Slowest %d files:' % top)
+    totals = sorted(files.items(), key=lambda x: -sum(x[1].values()))
+    for filepath, by_stage in totals[:top]:
+        slowest = sorted(by_stage.items(), key=lambda x: -x[1])[:3]
+        lines.append('%10.3f  %s (%s)' % (sum(by_stage.values()), filepath, ', '.join(['%s %.3f' % x for x in slowest])))
+    return lines
+
+profiler = Profiler()
@@ -1,72 +1,70 @@
 import util2 as util
+import manifest as mf
 import pprint as pp
-import copy
+
+# Keys that change on every run.  Pages that read these are not rebuilt
+# just because the clock moved.
+untracked_keys = ['__time__', '__last_updated__']
+
+# Marks a key removed in a scope layer
+removed = object()
 
 class RenderingContext:
+    """
+    The rendering context is a stack of scope layers.  Each layer holds 
+    the keys added (or removed) since the matching push().  Values are 
+    never copied: overriding a key simply shadows the value found in the
+    layers below, and pop() uncovers it again.  self.rc is the flattened 
+    view of all layers, which is what gets handed over to the renderers.
+    """
     def __init__(self):
         self.logger = util.WebifyLogger.get('rc')
         self.reset()
 
     def reset(self):
         self.rc = {}
-        self.diff_stack = [RenderingContext.empty_diff()]
-
-    @staticmethod
-    def empty_diff():
-        return {'a': [], 'm': {}, 'd': {}}
+        self.scopes = [{}]
+        self.fingerprint_cache = {}
 
     def push(self):
-        self.diff_stack.append(RenderingContext.empty_diff())
+        self.scopes.append({})
 
     def remove(self, keys):
         keys = [keys] if not isinstance(keys, list) else keys
-        diff = self.diff_stack[-1]
+        scope = self.scopes[-1]
 
         for k in keys:
+            self.fingerprint_cache.pop(k, None)
             if k in self.rc.keys():
-                if k in diff['a']:
-                    diff['a'].remove(k)
-                    del self.rc[k]
-                elif k in diff['m'].keys():
-                    diff['d'][k] = diff['m'][k]
-                    del diff['m'][k]
-                    del self.rc[k]
-                else:
-                    diff['d'][k] = copy.deepcopy(self.rc[k])
-                    del self.rc[k]
+                scope[k] = removed
+                del self.rc[k]
 
     def add(self, data):
-        diff = self.diff_stack[-1]
+        scope = self.scopes[-1]
 
         for k in data.keys():
-            if k in self.rc.keys():
-                if k in diff['a']:
-                    self.rc[k] = data[k]
-                elif k in diff['m'].keys():
-                    self.rc[k] = data[k]
-                else:
-                    diff['m'][k] = copy.deepcopy(self.rc[k])
-                    self.rc[k] = data[k]
-            else:
-                if k in diff['d'].keys():
-                    diff['m'][k] = diff['d'][k]
-                    del diff['d'][k]
-                    self.rc[k] = data[k]
-                else:
-                    kv = {k: data[k]}
-                    if not k in diff['a']:
-                        diff['a'].append(k)
-                    self.rc.update(kv)
-                
+            self.fingerprint_cache.pop(k, None)
+            scope[k] = data[k]
+            self.rc[k] = data[k]
+
+    def lookup(self, key):
+        """
+        Returns the value of key found in the scope layers, or removed.
+        """
+        for scope in reversed(self.scopes):
+            if key in scope.keys():
+                return scope[key]
+        return removed
+
     def pop(self):
-        diff = self.diff_stack.pop()
-        for k in diff['a']:
-            del self.rc[k]
-        for k in diff['d'].keys():
-            self.rc[k] = diff['d'][k]    
-        for k in diff['m'].keys():
-            # print('R', k, diff['m'][k])
-            self.rc[k] = diff['m'][k]
+        scope = self.scopes.pop()
+        for k in scope.keys():
+            self.fingerprint_cache.pop(k, None)
+            v = self.lookup(k)
+            if v is removed:
+                self.rc.pop(k, None)
+            else:
+                self.rc[k] = v
 
     def data(self):
         return self.rc
@@ -74,6 +72,21 @@ class RenderingContext:
     def keys(self):
         return self.rc.keys()
 
+    def track(self):
+        """
+        Returns a copy of the rendering context that remembers which keys
+        are read during rendering.
+        """
+        return util.TrackingContext(self.rc)
+
+    def fingerprint(self, key):
+        if not key in self.fingerprint_cache.keys():
+            self.fingerprint_cache[key] = mf.fingerprint(self.rc[key]) if key in self.rc.keys() else None
+        return self.fingerprint_cache[key]
+
+    def fingerprints(self, keys):
+        return {k: self.fingerprint(k) for k in keys if not k in untracked_keys}
+
     def value(self, key):
         try:
             return self.rc[key]
@@ -90,36 +103,36 @@ if __name__ == '__main__':
     y4 = {'remove': 'this'}
 
     rc = RenderingContext()
-    pp.pprint(rc.diff_stack)
+    pp.pprint(rc.scopes)
     pp.pprint(rc.data())
 
     # Case 1
     # rc.push()
     # rc.add(y1)
-    # pp.pprint(rc.diff_stack)
+    # pp.pprint(rc.scopes)
     # pp.pprint(rc.data())
     # rc.pop()
-    # pp.pprint(rc.diff_stack)
+    # pp.pprint(rc.scopes)
     # pp.pprint(rc.data())
 
     # Case 2
     # rc.push()
     # rc.add(y1)
     # print('Push and add y1')
-    # pp.pprint(rc.diff_stack[-1])
+    # pp.pprint(rc.scopes[-1])
     # pp.pprint(rc.data())
     # rc.push()
     # print('Push and add y2')
     # rc.add(y2)
-    # pp.pprint(rc.diff_stack[-1])
+    # pp.pprint(rc.scopes[-1])
     # pp.pprint(rc.data())
     # rc.pop()
     # print('Pop')
-    # pp.pprint(rc.diff_stack[-1])
+    # pp.pprint(rc.scopes[-1])
     # pp.pprint(rc.data())
     # rc.pop()
     # print('Pop')
-    # pp.pprint(rc.diff_stack[-1])
+    # pp.pprint(rc.scopes[-1])
     # pp.pprint(rc.data())
 
     # Case 3
@@ -127,72 +140,72 @@ if __name__ == '__main__':
     rc.add({'name': 'John'})
     rc.add({'name': 'Polyani'})
     print('Push and add y1')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     pp.pprint(rc.data())
 
     # rc.remove('fname')
     # print('Remove fname')
-    # pp.pprint(rc.diff_stack[-1])
+    # pp.pprint(rc.scopes[-1])
     # pp.pprint(rc.data())
 
     rc.push()
     rc.add({'name': 'George'})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.add({'name': 'Grisham'})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.add({'age': 22})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.add({'age': 23})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.add({'age': 34})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.remove('age')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.remove('age')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.remove('name')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.add({'age': 25})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     rc.add({'name': 'Newton'})
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
 
 #    rc.remove('name')
 #    rc.remove('age')
 #    rc.remove('name')
     print('Push and add y2')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     pp.pprint(rc.data())
 
     rc.pop()
     print('Pop')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     pp.pprint(rc.data())
 
     rc.pop()
     print('Pop')
-    pp.pprint(rc.diff_stack[-1])
+    pp.pprint(rc.scopes[-1])
     pp.pprint(rc.data())
 
 
 
     # rc = RenderingContext()
-    # print(rc.diff_stack)
+    # print(rc.scopes)
     # rc.add(y1)
     # rc.print()
-    # print(rc.diff_stack)
+    # print(rc.scopes)
     # print('XXXX')
     # rc.push()
     # rc.add(y2)
-    # print('DIFF', rc.diff_stack)
+    # print('DIFF', rc.scopes)
     # rc.add(y3)
-    # print('DIFF', rc.diff_stack)
+    # print('DIFF', rc.scopes)
     # rc.add(y3)
-    # print('DIFF', rc.diff_stack)
+    # print('DIFF', rc.scopes)
     # rc.print()
     # rc.push()
     # rc.remove({'fname': 'John'})
-    # print('DIFF', rc.diff_stack)
+    # print('DIFF', rc.scopes)
     # rc.print()
     # rc.pop()
     # rc.print()
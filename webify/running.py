@@ -125,25 +125,36 @@ class DirChangeHandler(FileSystemEventHandler):
         self.run_webify = run_webify
 
         self.last_time = time.time()
-        self.time_resolution = 5 # second
+        # Events arriving within this many seconds are handled in one run
+        self.time_resolution = 0.5 # second
+
+    def schedule(self, paths):
+        """
+        Only the changed paths are webified again, see Webify.traverse.  
+        paths == None asks for a full run, e.g., when a folder is created.
+        """
+        self.run_webify.add_changes(paths)
+        ignore_times = self.run_webify.webify.meta_data['__ignore_times__']
+        self.run_webify.run(when='after', ignore_times=ignore_times, force_copy=False, time_or_duration=self.time_resolution, incremental=True)
 
     def on_moved(self, event):
         super(DirChangeHandler, self).on_moved(event)
         what = 'directory' if event.is_directory else 'file'
         self.logger.debug('Moved %s: from %s to %s' % (what, event.src_path, event.dest_path))
+        self.schedule(None if event.is_directory else [event.src_path, event.dest_path])
 
     def on_created(self, event):
         super(DirChangeHandler, self).on_created(event)
         what = 'directory' if event.is_directory else 'file'
         self.logger.debug('Created %s: %s' % (what, event.src_path))
         if os.stat(event.src_path).st_size > 0:
-            ignore_times = self.run_webify.webify.meta_data['__ignore_times__']
-            self.run_webify.run(when='after', ignore_times=ignore_times, force_copy=False, time_or_duration=5)
+            self.schedule(None if event.is_directory else [event.src_path])
 
     def on_deleted(self, event):
         super(DirChangeHandler, self).on_deleted(event)
         what = 'directory' if event.is_directory else 'file'
         self.logger.debug('Deleted %s: %s' % (what, event.src_path))
+        self.schedule(None if event.is_directory else [event.src_path])
 
     def on_modified(self, event):
         super(DirChangeHandler, self).on_modified(event)
@@ -152,8 +163,7 @@ class DirChangeHandler(FileSystemEventHandler):
         
         if not event.is_directory:
             if os.path.splitext(event.src_path)[1] in ['.md', '.html', '.yaml', '.css', '.mustache', '.jinja']:
-                ignore_times = self.run_webify.webify.meta_data['__ignore_times__']
-                self.run_webify.run(when='after', ignore_times=ignore_times, force_copy=False, time_or_duration=5)
+                self.schedule([event.src_path])
 
 class RunWebify:
     def __init__(self, webify, browser_controller):
@@ -164,15 +174,32 @@ class RunWebify:
         self.timer_thread = None
         self.time_for_next_run = None
 
+        # Source files changed since the last run, None calls for a full run
+        self.changed_paths = set()
+        self.changes_lock = threading.Lock()
+
         self.time_padding = datetime.timedelta(seconds=1)
 
+    def add_changes(self, paths):
+        with self.changes_lock:
+            if paths == None or self.changed_paths == None:
+                self.changed_paths = None
+            else:
+                self.changed_paths.update(paths)
+
+    def take_changes(self):
+        with self.changes_lock:
+            changed_paths = self.changed_paths
+            self.changed_paths = set()
+        return changed_paths
+
     def stop(self):
         with lock:
             if self.timer_thread:
                 self.logger.warning('Canceling a scheduled run at %s' % self.time_for_next_run)
                 self.timer_thread.cancel()
 
-    def run(self, when, ignore_times, force_copy, time_or_duration=None):
+    def run(self, when, ignore_times, force_copy, time_or_duration=None, incremental=False):
         with lock:
             self.logger.debug('RunWebify signal: %s, tm_or_dur: %s' % (when, time_or_duration))
 
@@ -202,20 +229,22 @@ class RunWebify:
 
             if requested_time == cur_time:
                 self.logger.info('Running webify "now" as requested')
-                self.run_(ignore_times, force_copy)
+                self.run_(ignore_times, force_copy, incremental)
                 self.schedule_next_run(ignore_times, force_copy)
             else:
                 self.time_for_next_run = requested_time
                 self.logger.info('Scheduling a run at %s' % self.time_for_next_run)
-                delay = ((self.time_for_next_run - cur_time) + self.time_padding).total_seconds()
-                self.timer_thread = threading.Timer(delay, self.run_with_lock_, [ignore_times, force_copy])
+                # Runs triggered by file changes need no padding
+                padding = self.time_padding if not incremental else datetime.timedelta(0)
+                delay = ((self.time_for_next_run - cur_time) + padding).total_seconds()
+                self.timer_thread = threading.Timer(delay, self.run_with_lock_, [ignore_times, force_copy, incremental])
                 self.timer_thread.start()
                 print('Enter choice: ', )
 
-    def run_with_lock_(self, ignore_times, force_copy):
+    def run_with_lock_(self, ignore_times, force_copy, incremental=False):
         with lock:
             self.logger.info('Running webify at %s as scheduled' % self.time_for_next_run)
-            self.run_(ignore_times, force_copy)
+            self.run_(ignore_times, force_copy, incremental)
             self.schedule_next_run(ignore_times, force_copy)
             print('Enter choice: ', )
 
@@ -242,14 +271,17 @@ class RunWebify:
         self.timer_thread.start()
         self.logger.info('Next run is scheduled at {}'.format(self.time_for_next_run))
 
-    def run_(self, ignore_times, force_copy):
+    def run_(self, ignore_times, force_copy, incremental=False):
         self.logger.debug('Executing webify.traverse()')
         cur_time = datetime.datetime.now()
         self.webify.meta_data['__ignore_times__'] = ignore_times
         self.webify.meta_data['__force_copy__'] = force_copy
         self.webify.meta_data['__last_updated__'] = cur_time.strftime('%Y-%m-%d %H:%M')
         self.webify.meta_data['__time__'] = cur_time
-        self.webify.traverse()
+        # Any run picks up the pending changes, only runs triggered by file
+        # changes are incremental
+        changed_paths = self.take_changes()
+        self.webify.traverse(changed_paths=changed_paths if incremental else None)
         self.browser_controller.refresh()
         self.time_for_next_run = None
 
@@ -5,7 +5,6 @@ import subprocess
 import pprint as pp
 import pystache
 import sys
-import pathspec
 import codecs
 import copy
 import shutil
@@ -14,23 +13,353 @@ import pypandoc
 import jinja2
 import fnmatch 
 import file_processor 
+import hashlib
+import threading
+import atexit
+import collections
+import json
+import re
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+pandoc_filter_args = ['--mathjax','--highlight-style=pygments']
+
+def strip_paragraph(s):
+    s = s.replace('<p>', '', 1)                
+    return ''.join(s.rsplit('</p>', 1))
+
+class DiskCache:
+    """
+    On-disk key-value store for text.  Entries are stored one per file, in 
+    sub-folders named after the first two characters of the key, and 
+    written atomically, so that concurrent builds can share the cache.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def make_key(self, *parts):
+        s = json.dumps(parts)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    def get_filepath(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def read(self, key):
+        try:
+            with codecs.open(self.get_filepath(key), 'r', 'utf-8') as stream:
+                return stream.read()
+        except:
+            return None
+
+    def write(self, key, value):
+        filepath = self.get_filepath(key)
+        tmp_filepath = '%s.%d.%d.tmp' % (filepath, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with codecs.open(tmp_filepath, 'w', 'utf-8') as stream:
+                stream.write(value)
+            os.replace(tmp_filepath, filepath)
+            return True
+        except:
+            return False
+
+class PandocSnippetCache(DiskCache):
+    """
+    On-disk cache of _pandoc_ snippet conversions (see filter_pandoc), so 
+    that yaml files are not converted again on every build.  Entries are 
+    keyed on the hash of the snippet text, the pandoc version and the pandoc
+    arguments.
+    """
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self.pandoc_version = None
+
+    def key(self, text, args):
+        if self.pandoc_version == None:
+            try:
+                self.pandoc_version = pypandoc.get_pandoc_version()
+            except:
+                self.pandoc_version = ''
+        return self.make_key(self.pandoc_version, args, text)
+
+    def get(self, text, args):
+        return self.read(self.key(text, args))
+
+    def set(self, text, args, value):
+        key = self.key(text, args)
+        if not self.write(key, value):
+            WebifyLogger.get('pandoc').debug('Cannot write pandoc snippet cache entry: %s' % self.get_filepath(key))
+
+# Webify sets this up in the destination folder (see Webify.set_dest)
+pandoc_snippet_cache = None
+
+def convert_pandoc_snippet(text):
+    s = pandoc_snippet_cache.get(text, pandoc_filter_args) if pandoc_snippet_cache else None
+    if s == None:
+        s = pandoc_converter.convert(text, to='html', format='md', extra_args=pandoc_filter_args)
+        if pandoc_snippet_cache:
+            pandoc_snippet_cache.set(text, pandoc_filter_args, s)
+    return s
 
 def filter_pandoc(str):
     logger = WebifyLogger.get('mdfile')
     try:
         s = str.strip(' ')
         if s[0:8] == '_pandoc_':
-            pdoc_args = ['--mathjax','--highlight-style=pygments']
-            s = pypandoc.convert_text(s[8:], to='html', format='md', extra_args=pdoc_args)
-            s = s.replace('<p>', '', 1)                
-            s = ''.join(s.rsplit('</p>', 1))
-            return s
+            return strip_paragraph(convert_pandoc_snippet(s[8:]))
         else:
             pass
     except:
         logger.warning('Error applying pandoc filter on key %s' % str[7:])
     return str
 
+def filter_pandoc_dict(data):
+    """
+    Same as filter_dict(filter_pandoc, data), except that the _pandoc_
+    strings found in data that are not in the snippet cache are converted 
+    in one batch (see PandocConverter.convert_batch).
+    """
+    logger = WebifyLogger.get('mdfile')
+
+    converted = {}
+    snippets = []
+    def collect(str):
+        text = str.strip(' ')[8:]
+        if str.strip(' ')[0:8] == '_pandoc_' and not str in converted.keys() and not str in snippets:
+            s = pandoc_snippet_cache.get(text, pandoc_filter_args) if pandoc_snippet_cache else None
+            if s == None:
+                snippets.append(str)
+            else:
+                converted[str] = strip_paragraph(s)
+        return str
+    filter_dict(collect, data)
+
+    if len(snippets) > 0:
+        conversions = [{'source': str.strip(' ')[8:], 'to': 'html', 'format': 'md', 'extra_args': pandoc_filter_args} for str in snippets]
+        for str, r in zip(snippets, pandoc_converter.convert_batch(conversions)):
+            if isinstance(r, Exception):
+                logger.warning('Error applying pandoc filter on key %s' % str[7:])
+            else:
+                if pandoc_snippet_cache:
+                    pandoc_snippet_cache.set(str.strip(' ')[8:], pandoc_filter_args, r)
+                converted[str] = strip_paragraph(r)
+
+    if len(converted) == 0:
+        return data
+    return filter_dict(lambda str: converted.get(str, str), data)
+
+def pandoc_convert_text(source, to, format, extra_args=[], outputfile=None, cwd=None):
+    """
+    Converts source using pandoc.  Similar to pypandoc.convert_text, except
+    that pandoc is launched with cwd as its working directory.  The working
+    directory of this process is never changed, so it is safe to call this 
+    function from multiple threads.
+    """
+    pandoc_path = pypandoc.get_pandoc_path()
+    format = 'markdown' if format == 'md' else format
+    to = 'latex' if to == 'pdf' else to # pandoc picks pdf output from the outputfile extension
+
+    args = [pandoc_path, '--from=%s' % format, '--to=%s' % to]
+    if outputfile:
+        args.append('--output=%s' % outputfile)
+    args.extend(extra_args)
+
+    env = os.environ.copy()
+    env['PATH'] = env.get('PATH', '') + os.pathsep + os.path.dirname(pandoc_path)
+
+    p = subprocess.run(args, input=source.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env)
+    stderr = p.stderr.decode('utf-8', errors='replace').strip()
+    if p.returncode != 0:
+        raise RuntimeError('Pandoc died with exitcode "%s" during conversion: %s' % (p.returncode, stderr))
+    if stderr:
+        WebifyLogger.get('pandoc').warning(stderr)
+    return p.stdout.decode('utf-8', errors='replace')
+
+class PandocConverter:
+    """
+    Runs one pandoc process per conversion (see pandoc_convert_text).  This
+    is the default converter, and the fallback for conversions that
+    PandocServer does not handle.
+    """
+    def convert(self, source, to, format, extra_args=[], outputfile=None, cwd=None):
+        return pandoc_convert_text(source, to=to, format=format, extra_args=extra_args, outputfile=outputfile, cwd=cwd)
+
+    def convert_batch(self, conversions):
+        """
+        conversions is a list of convert() keyword arguments.  Returns the
+        list of results, or of exceptions for conversions that failed.
+        """
+        results = []
+        for c in conversions:
+            try:
+                results.append(self.convert(**c))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        pass
+
+class PandocServer(PandocConverter):
+    """
+    Sends conversions to a long-lived pandoc process (pandoc lua 
+    pandoc_server.lua), so that pandoc startup is paid once per thread
+    rather than once per file or per yaml snippet.  Batches are sent in a
+    single request.
+
+    Only markdown to html conversions, with the options in supported_args,
+    written to a buffer or to an html file are handled here.  Everything
+    else (pdf, beamer, templates, filters, ...) goes through
+    PandocConverter.  Highlight style only matters for standalone output,
+    so it is accepted and ignored.
+
+    The pandoc server mode (pandoc server) would do as well, except that it 
+    requires a pandoc binary linked against the threaded runtime, which 
+    is not always the case.
+    """
+    supported_args = ['--mathjax', '--highlight-style', '--syntax-highlighting']
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pandoc_server.lua')
+
+    def __init__(self):
+        self.local = threading.local()
+        self.available = True
+        # Every pandoc process started, from any thread (see close)
+        self.processes = []
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def __getstate__(self):
+        # Worker processes start their own pandoc processes
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def make_request(self, source, to, format, extra_args=[], outputfile=None, cwd=None):
+        """
+        Returns the request for pandoc_server.lua, or None if this conversion
+        is not supported.
+        """
+        if not format in ['md', 'markdown'] or to != 'html':
+            return None
+        if outputfile and os.path.splitext(outputfile)[1].lower() not in ['.html', '.htm']:
+            return None
+        for arg in extra_args:
+            if arg.split('=')[0] not in self.supported_args:
+                return None
+        # The pandoc command line expands tabs before parsing (--tab-stop=4)
+        request = {'text': source.expandtabs(4), 'from': 'markdown', 'to': 'html', 'mathjax': '--mathjax' in extra_args}
+        if cwd:
+            request['cwd'] = cwd
+        return request
+
+    def get_process(self):
+        p = getattr(self.local, 'process', None)
+        if p == None or p.poll() != None:
+            WebifyLogger.get('pandoc').debug('Starting pandoc server: %s' % self.script)
+            p = subprocess.Popen([pypandoc.get_pandoc_path(), 'lua', self.script], 
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, 
+                                 encoding='utf-8')
+            self.local.process = p
+            with self.lock:
+                self.processes = [x for x in self.processes if x.poll() == None] + [p]
+        return p
+
+    @staticmethod
+    def stop_process(p):
+        """
+        Closes the input of pandoc process p, which makes pandoc_server.lua
+        exit, and kills it if it does not.
+        """
+        try:
+            p.stdin.close()
+            p.wait(timeout=5)
+        except Exception:
+            p.kill()
+            p.wait()
+        p.stdout.close()
+
+    def close(self):
+        """
+        Stops the pandoc processes started so far.  Called when a job pool
+        shuts down and at exit.  New ones are started as needed.
+        """
+        with self.lock:
+            processes, self.processes = self.processes, []
+        self.local = threading.local()
+        for p in processes:
+            self.stop_process(p)
+
+    def send(self, request):
+        """
+        Returns the response to request, or None if the pandoc server is not
+        available (e.g., pandoc older than 3.1 does not support pandoc lua 
+        or pandoc.json).  A pandoc process that fails is restarted once 
+        before giving up on the pandoc server.
+        """
+        for attempt in range(2):
+            if not self.available:
+                return None
+            p = None
+            try:
+                p = self.get_process()
+                p.stdin.write(json.dumps(request) + '\n')
+                p.stdin.flush()
+                return json.loads(p.stdout.readline())
+            except Exception as e:
+                error = e
+            if p:
+                self.local.process = None
+                with self.lock:
+                    if p in self.processes:
+                        self.processes.remove(p)
+                self.stop_process(p)
+            WebifyLogger.get('pandoc').debug('Pandoc server failed (%s)' % error)
+        WebifyLogger.get('pandoc').warning('Pandoc server is not available, running pandoc for each file instead (%s)' % error)
+        self.available = False
+        return None
+
+    def response_to_result(self, response, outputfile):
+        if 'error' in response.keys():
+            raise RuntimeError('Pandoc server failed during conversion: %s' % response['error'])
+        if outputfile:
+            with open(outputfile, 'wb') as stream:
+                stream.write(response['output'].encode('utf-8'))
+            return ''
+        return response['output']
+
+    def convert(self, source, to, format, extra_args=[], outputfile=None, cwd=None):
+        request = self.make_request(source, to, format, extra_args, outputfile, cwd)
+        response = self.send(request) if request else None
+        if response == None:
+            return super().convert(source, to, format, extra_args, outputfile, cwd)
+        return self.response_to_result(response, outputfile)
+
+    def convert_batch(self, conversions):
+        requests = [self.make_request(**c) for c in conversions]
+        batch = [r for r in requests if r]
+        responses = self.send(batch) if len(batch) > 0 else None
+        if responses == None:
+            return super().convert_batch(conversions)
+
+        results = []
+        responses = iter(responses)
+        for c, r in zip(conversions, requests):
+            try:
+                if r:
+                    results.append(self.response_to_result(next(responses), c.get('outputfile')))
+                else:
+                    results.append(super().convert(**c))
+            except Exception as e:
+                results.append(e)
+        return results
+
+# Selected via --pandoc-server
+pandoc_converter = PandocConverter()
+
 def filter_dict(filter, data):
     if not data:
         return None
@@ -68,20 +397,151 @@ def make_directory(dirpath):
             return None
     return 'Created'
 
+# FICLONE ioctl (linux/fs.h).  Clones a file on copy-on-write file systems
+# (btrfs, xfs, overlayfs on these).
+FICLONE = 0x40049409
+
+def replace_file(dest, write):
+    """
+    Calls write(tmp_dest) for a temporary file next to dest, then moves it
+    over dest, and returns what write returned.  Outputs are never written
+    in place: after --copy-mode hardlink, dest is the source file itself.
+    """
+    tmp_dest = '%s.%d.tmp' % (dest, threading.get_ident())
+    try:
+        # Left over from an interrupted run, and possibly a link
+        if os.path.lexists(tmp_dest):
+            os.remove(tmp_dest)
+        r = write(tmp_dest)
+        os.replace(tmp_dest, dest)
+        return r
+    except:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+        raise
+
+def copy_data(src, dest):
+    """
+    Same as shutil.copy2, except that the contents of src are not passed 
+    through python buffers where the os allows it: a reflink (FICLONE) if
+    the file system supports it, else copy_file_range or sendfile.  Falls
+    back to a plain buffered copy.  Returns the method used.
+    """
+    def write(tmp_dest):
+        with open(src, 'rb') as fsrc, open(tmp_dest, 'wb') as fdest:
+            method = copy_contents(fsrc, fdest)
+        shutil.copystat(src, tmp_dest)
+        return method
+    return replace_file(dest, write)
+
+def copy_contents(fsrc, fdest):
+    if fcntl:
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+            return 'reflink'
+        except OSError:
+            pass
+
+    size = os.fstat(fsrc.fileno()).st_size
+    for name in ['copy_file_range', 'sendfile']:
+        func = getattr(os, name, None)
+        if not func:
+            continue
+        try:
+            offset = 0
+            while offset < size:
+                if name == 'sendfile':
+                    n = func(fdest.fileno(), fsrc.fileno(), offset, size - offset)
+                else:
+                    n = func(fsrc.fileno(), fdest.fileno(), size - offset, offset, offset)
+                if n == 0:
+                    break
+                offset += n
+            if offset == size:
+                return name
+        except OSError:
+            pass
+        fdest.seek(0)
+        fdest.truncate()
+
+    fsrc.seek(0)
+    shutil.copyfileobj(fsrc, fdest, 1 << 20)
+    return 'copy'
+
+def copy_file_reflink(src, dest):
+    copy_data(src, dest)
+
+def copy_file_hardlink(src, dest):
+    """
+    Links dest to src.  Falls back to copying if src and dest are on 
+    different file systems (or the file system does not support links).
+    """
+    try:
+        # Renaming a link over the same file does nothing
+        if os.path.exists(dest) and os.path.samefile(src, dest):
+            return
+    except OSError:
+        pass
+    try:
+        replace_file(dest, lambda tmp_dest: os.link(src, tmp_dest))
+    except OSError:
+        replace_file(dest, lambda tmp_dest: shutil.copy2(src, tmp_dest))
+
+# Files up to this size are hashed while these are copied, so that the build
+# manifest can tell a touched asset from a changed one
+copy_hash_limit = 64 << 20
+
+def copy_file_hashed(src, dest):
+    """
+    Same as shutil.copy2, except that it returns the sha1 of the contents
+    of src (see manifest.file_hash), computed as these are copied.  Larger
+    files than copy_hash_limit are not hashed.
+    """
+    if os.path.getsize(src) > copy_hash_limit:
+        replace_file(dest, lambda tmp_dest: shutil.copy2(src, tmp_dest))
+        return None
+    def write(tmp_dest):
+        h = hashlib.sha1()
+        with open(src, 'rb') as fsrc, open(tmp_dest, 'wb') as fdest:
+            for chunk in iter(lambda: fsrc.read(1 << 20), b''):
+                h.update(chunk)
+                fdest.write(chunk)
+        shutil.copystat(src, tmp_dest)
+        return h.hexdigest()
+    return replace_file(dest, write)
+
+# How copy_file copies assets to the destination folder (see --copy-mode).
+# Hardlinked outputs share their contents with the source files.  Only 
+# copy returns a content hash, the others do not read the files.
+copy_strategies = {
+    'copy': copy_file_hashed,
+    'hardlink': copy_file_hardlink,
+    'reflink': copy_file_reflink
+}
+copy_strategy = 'copy'
+
 def copy_file(src, dest, force_copy):
+    v, s, _ = copy_file_with_hash(src, dest, force_copy)
+    return v, s
+
+def copy_file_with_hash(src, dest, force_copy):
+    """
+    Same as copy_file, also returns the content hash of src if it was 
+    computed while copying (see copy_strategies), or None.
+    """
     if not force_copy:
         try:
             if filecmp.cmp(src, dest):
-                return True, 'Exists'
+                return True, 'Exists', None
         except:
             pass
 
     try:
-        shutil.copy2(src, dest)
-        return True, 'Copied'
+        digest = copy_strategies[copy_strategy](src, dest)
+        return True, 'Copied', digest
     except:
         pass
-    return False, 'Copy failed'
+    return False, 'Copy failed', None
 
 def save_to_file(filepath, buffer):
     try:
@@ -131,11 +591,124 @@ def render(renderer, render_filepath, context, src_filepath):
 
     return renderer(template, render_filepath, context, src_filepath)
 
+class TrackingContext(dict):
+    """
+    A copy of the rendering context that remembers which keys are looked 
+    up during rendering.  pystache looks up names via "key in context" 
+    followed by "context[key]", jinja2 templates report the names these
+    look up (see TrackingJinja2Context).  Keys that are not found are 
+    remembered as well, since adding these later changes the output.
+    """
+    def __init__(self, data):
+        super().__init__(data)
+        self.accessed = set()
+
+    def __getitem__(self, key):
+        self.accessed.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.accessed.add(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.accessed.add(key)
+        return super().get(key, default)
+
+class TrackingJinja2Context(jinja2.runtime.Context):
+    """
+    jinja2 template context that adds the names looked up by the template
+    (and the templates it includes) to the accessed set handed over as
+    tracking_key, see jinja2_renderer.
+    """
+    tracking_key = '__webify_accessed__'
+
+    def resolve_or_missing(self, key):
+        accessed = self.parent.get(self.tracking_key)
+        if accessed != None:
+            accessed.add(key)
+        return super().resolve_or_missing(key)
+
+def json_default(obj):
+    # Values computed on demand that stand for markup (see 
+    # nbfile.LessonPlan) are written out as strings by |tojson
+    if hasattr(obj, '__html__'):
+        return str(obj)
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+class Jinja2Environment(jinja2.Environment):
+    context_class = TrackingJinja2Context
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.policies['json.dumps_kwargs'] = dict(self.policies['json.dumps_kwargs'], default=json_default)
+
+class Jinja2Templates:
+    """
+    Compiled jinja2 templates.  A render file shared by hundreds of pages
+    is compiled once.  Templates are keyed on the render file path and the 
+    hash of the template text, so an edited render file is picked up 
+    without checking timestamps.  The most recently used cache_size 
+    templates are kept around.
+
+    If bytecode_cache_dir is given, compiled templates are also stored on 
+    disk (see jinja2.FileSystemBytecodeCache), so that warm builds skip 
+    template compilation altogether.
+    """
+    def __init__(self, cache_size=400, bytecode_cache_dir=None):
+        bytecode_cache = None
+        if bytecode_cache_dir and make_directory(bytecode_cache_dir):
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+        self.env = Jinja2Environment(bytecode_cache=bytecode_cache)
+        self.cache_size = cache_size
+        self.templates = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, template, render_filepath):
+        key = (render_filepath, hashlib.sha1(template.encode('utf-8')).hexdigest())
+        with self.lock:
+            t = self.templates.get(key)
+            if t:
+                self.templates.move_to_end(key)
+                return t
+
+        t = self.compile(template, render_filepath)
+        with self.lock:
+            self.templates[key] = t
+            while len(self.templates) > self.cache_size:
+                self.templates.popitem(last=False)
+        return t
+
+    def compile(self, template, render_filepath):
+        logger = WebifyLogger.get('render')
+        bytecode_cache = self.env.bytecode_cache
+        if not bytecode_cache:
+            logger.debug('Compiling jinja2 template: %s' % render_filepath)
+            return self.env.from_string(template)
+
+        bucket = bytecode_cache.get_bucket(self.env, render_filepath, render_filepath, template)
+        code = bucket.code
+        if code is None:
+            logger.debug('Compiling jinja2 template: %s' % render_filepath)
+            code = self.env.compile(template, render_filepath, render_filepath)
+            bucket.code = code
+            bytecode_cache.set_bucket(bucket)
+        return self.env.template_class.from_code(self.env, code, self.env.make_globals(None))
+
+# Webify replaces this with its own (see Webify.set_dest)
+jinja2_templates = Jinja2Templates()
+
 def jinja2_renderer(template, render_filepath, context, src_filepath):
     logger = WebifyLogger.get('render')
 
     try:
-        rendered_buf = jinja2.Template(template).render(context)
+        t = jinja2_templates.get(template, render_filepath)
+        if isinstance(context, TrackingContext):
+            # Template.render() copies the context into a new dict, the 
+            # template context reports the names it looks up instead
+            rendered_buf = t.render(context, **{TrackingJinja2Context.tracking_key: context.accessed})
+        else:
+            rendered_buf = t.render(context)
         logger.debug('Success jinja2 render:\n  src:    %s\n  render: %s' % (src_filepath, render_filepath))
     except jinja2.exceptions.TemplateSyntaxError as e:
         logger.warning('Error jinja2 render:\n  src:    %s\n  render: %s' % (src_filepath, render_filepath))
@@ -145,11 +718,49 @@ def jinja2_renderer(template, render_filepath, context, src_filepath):
 
     return rendered_buf
 
+class MustacheTemplates:
+    """
+    Parsed mustache templates, keyed on the hash of the template text.
+    pystache.render() parses the template on every call; media templates
+    (see mdfilters.HTML_Filter) are applied to every image and video on a
+    page, so these are parsed once instead.  The most recently used
+    cache_size templates are kept around.
+    """
+    def __init__(self, cache_size=400):
+        self.cache_size = cache_size
+        self.templates = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Renderer keeps per-render state, so one per thread
+        self.local = threading.local()
+
+    def get(self, template):
+        key = hashlib.sha1(template.encode('utf-8')).hexdigest()
+        with self.lock:
+            t = self.templates.get(key)
+            if t:
+                self.templates.move_to_end(key)
+                return t
+
+        t = pystache.parse(template)
+        with self.lock:
+            self.templates[key] = t
+            while len(self.templates) > self.cache_size:
+                self.templates.popitem(last=False)
+        return t
+
+    def render(self, template, context):
+        renderer = getattr(self.local, 'renderer', None)
+        if not renderer:
+            renderer = self.local.renderer = pystache.Renderer()
+        return renderer.render(self.get(template), context)
+
+mustache_templates = MustacheTemplates()
+
 def mustache_renderer(template, render_filepath, context, src_filepath):
     logger = WebifyLogger.get('render')
 
     try:
-        rendered_buf = pystache.render(template, context)
+        rendered_buf = mustache_templates.render(template, context)
         logger.debug('Success mustache render:\n  src:    %s\n  render: %s' % (src_filepath, render_filepath))
     except:
         logger.warning('Error mustache render:\n  src:    %s\n  render: %s' % (src_filepath, render_filepath))
@@ -159,13 +770,30 @@ def mustache_renderer(template, render_filepath, context, src_filepath):
 
     return rendered_buf
 
+class LazyMessage:
+    """
+    A log message that is only formatted when a handler emits it.
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return self.func(*self.args, **self.kwargs)
+
 class WebifyLogger:
+    # Loggers created via make(), used to set up logging in worker processes
+    registry = {}
+
     @staticmethod
     def make(name, loglevel=logging.WARNING, logfile=None):
         logger = logging.getLogger(name)
         if logger.handlers:
             return logger
 
+        WebifyLogger.registry[name] = (loglevel, logfile)
+
         logger.setLevel(logging.DEBUG)
         
         # Console
@@ -188,6 +816,11 @@ class WebifyLogger:
     @staticmethod
     def get(name):
         return logging.getLogger(name)
+
+    @staticmethod
+    def init_worker(registry):
+        for name, (loglevel, logfile) in registry.items():
+            WebifyLogger.make(name=name, loglevel=loglevel, logfile=logfile)
     
     @staticmethod 
     def set_level(logger, level):
@@ -202,8 +835,29 @@ class WebifyLogger:
 
         logger.handlers[0].setLevel(h1)
         if len(logger.handlers) > 1: logger.handlers[1].setLevel(h2)
+
+        # Level guard: calls below the level of every handler return right
+        # away, without building a log record (logging caches this check)
+        logger.setLevel(min(h1, h2))
         return logger
 
+    @staticmethod
+    def lazy(func, *args, **kwargs):
+        """
+        Returns a log message that calls func(*args, **kwargs) only if it
+        is emitted.
+        """
+        return LazyMessage(func, *args, **kwargs)
+
+    @staticmethod
+    def pformat(obj, **kwargs):
+        """
+        Lazy pp.pformat(obj), e.g., logger.debug(util.WebifyLogger.pformat(rc.data())).
+        Pretty-printing the rendering context is expensive, and most of
+        the time debug messages are not shown.
+        """
+        return LazyMessage(pp.pformat, obj, **kwargs)
+
     @staticmethod
     def is_debug_name(name):
         try:
@@ -304,11 +958,41 @@ class Terminal:
 #         pass
     
 
+class NameMatcher:
+    """
+    Matches what fnmatch.fnmatch matches for any one of patterns.  Plain
+    names are looked up in a set and "*suffix" patterns are checked with
+    str.endswith.  Remaining patterns are combined in a single regular
+    expression.
+    """
+    wildcards = re.compile(r'[*?\[]')
+
+    def __init__(self, patterns):
+        patterns = [os.path.normcase(p) for p in patterns]
+        is_suffix = lambda p: p[0:1] == '*' and not self.wildcards.search(p[1:])
+        self.literals = set([p for p in patterns if not self.wildcards.search(p)])
+        self.suffixes = tuple([p[1:] for p in patterns if is_suffix(p)])
+        others = [p for p in patterns if self.wildcards.search(p) and not is_suffix(p)]
+        self.regex = re.compile('|'.join([fnmatch.translate(p) for p in others])) if len(others) > 0 else None
+
+    def match(self, name):
+        return name in self.literals or \
+            (len(self.suffixes) > 0 and name.endswith(self.suffixes)) or \
+            (self.regex != None and self.regex.match(name) != None)
+
 class IgnoreList:
+    """
+    Patterns read from .webifyignore files.  Each line is split into a path
+    pattern p and a name pattern f (see match).  The patterns are compiled
+    into a few combined regular expressions.  The patterns that depend on
+    the folder are resolved once per folder, so checking an entry costs the
+    same no matter how many patterns there are.
+    """
     def __init__(self, srcdir):
         self.logger = WebifyLogger.get('db-ignore')
         self.ignorelist = []
         self.srcdir = srcdir
+        self.compile()
 
     def read_ignore_file(self, ignorefile):
         self.logger.info('Reading ignore file: %s' % ignorefile)
@@ -320,21 +1004,39 @@ class IgnoreList:
                     if p or f:
                         self.ignorelist.append((p, f))
         except:
-            self.spec = None
             self.logger.warning('Cannot read ignorefile: %s' % ignorefile)
+        self.compile()
 
-    def match(self, path, name, is_dir, p, f):
+    @staticmethod
+    def combine(patterns):
+        """
+        Returns a NameMatcher for patterns, or None.
+        """
+        if len(patterns) == 0:
+            return None
+        return NameMatcher(patterns)
 
-        # if WebifyLogger.is_debug(self.logger):
-        #     print('srcdir: %s' % self.srcdir)
-        #     print('path:   %s' % path)
-        #     print('name:   %s' % name)
-        #     print('p:      %s' % p)
-        #     print('f:      %s' % f)
+    def compile(self):
+        self.names = [f for (p, f) in self.ignorelist if p == '']
+        self.dir_names = [p for (p, f) in self.ignorelist if f == '' and p[0] != '/']
+        self.dir_paths = self.combine([p for (p, f) in self.ignorelist if f == '' and p[0] == '/'])
+        self.path_names = [(NameMatcher([p]), f) for (p, f) in self.ignorelist if p != '' and f != '']
+        # Per-folder matchers for files and folders, see get_folder_patterns
+        self.folder_patterns = {}
 
-        if p == '' and f == '':
-            self.warning('Illegal empty pattern found in ignore file')
-        
+    def get_folder_patterns(self, path):
+        folder_patterns = self.folder_patterns.get(path)
+        if folder_patterns == None:
+            names = self.names + [f for (p_matcher, f) in self.path_names if p_matcher.match(os.path.normcase(path))]
+            folder_patterns = self.combine(names), self.combine(names + self.dir_names)
+            self.folder_patterns[path] = folder_patterns
+        return folder_patterns
+
+    def match(self, path, name, is_dir, p, f):
+        """
+        Checks entry name found in folder path against a single pattern.
+        This is what ignore does for all patterns at once.
+        """
         if p == '':
             r = fnmatch.fnmatch(name, f)
         elif p[0] == '/':
@@ -352,16 +1054,21 @@ class IgnoreList:
         return r
             
     def ignore(self, path, name, is_dir):
-        self.logger.debug('Checking %s %s' % (path, name))
+        self.logger.debug('Checking %s %s', path, name)
 
         path = '/' if path == self.srcdir else path.replace(self.srcdir, '')
 
-        should_ignore = False        
-        for (p, f) in self.ignorelist:
-            should_ignore = self.match(path, name, is_dir, p, f)
-            if should_ignore:
-                self.logger.debug('Ignore file')
-                return True
+        files_matcher, dirs_matcher = self.get_folder_patterns(path)
+        name = os.path.normcase(name)
+        if is_dir:
+            should_ignore = (dirs_matcher != None and dirs_matcher.match(name)) or \
+                            (self.dir_paths != None and self.dir_paths.match(os.path.normcase(os.path.join(path, name))))
+        else:
+            should_ignore = files_matcher != None and files_matcher.match(name)
+
+        if should_ignore:
+            self.logger.debug('Ignore file')
+            return True
         self.logger.debug('Do not ignore file')
         return False
 
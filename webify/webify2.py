@@ -8,16 +8,19 @@ from mdfile2 import MDfile
 import pypandoc
 import pystache
 import yaml
-import pathspec
 import datetime
 import markupsafe
 import json
 import rc as RenderingContext
 import time_util as tm
 import dirtree as dt
-import dirstack as ds
+import jobs
+import manifest as mf
+import profiling
+import yamlfile
 from yamlfile import YAMLfile
 from htmlfile import HTMLfile
+import nbfile
 from nbfile import JupyterNotebookfile, JupyterNotebookSettings
 import time
 import datetime
@@ -34,8 +37,18 @@ class Webify:
         self.rc = RenderingContext.RenderingContext()
         self.ignore = None
         self.dir_tree = dt.DirTree()
-        self.dir_stack = ds.DirStack()
         self.next_run_time = None
+        self.job_pool = None
+        self.copy_pool = None
+        self.notebook_pool = None
+        self.context_snapshot = None
+        # Folder listings saved for jobs, see get_listing_store
+        self.listing_store = None
+        self.manifest = None
+        self.file_stats = None
+        # Live runs: folders to visit, None means all (see find_affected_dirs)
+        self.visit_dirs = None
+        self.visit_trees = None
 
     def set_renderer(self):
         if self.meta_data['renderer'] in [None, 'jinja2']:
@@ -66,6 +79,70 @@ class Webify:
         self.rc.reset()
         self.rc.add(meta_data)
 
+    def set_jobs(self, num_jobs, use_threads=False):
+        if num_jobs > 1:
+            self.logger.info('Using %d jobs' % num_jobs)
+            self.job_pool = jobs.JobPool(num_jobs, use_threads)
+        else:
+            self.job_pool = None
+
+    def set_copy(self, copy_mode='copy', num_threads=0):
+        """
+        copy_mode is one of util.copy_strategies.  With num_threads > 0, 
+        files are copied in a pool of threads.
+        """
+        util.copy_strategy = copy_mode
+        if num_threads > 0:
+            self.copy_pool = jobs.CopyPool(num_threads)
+        else:
+            self.copy_pool = None
+
+    def set_notebooks(self, num_kernels=0, timeout=600):
+        """
+        With num_kernels > 0, jupyter notebooks that are executed run in a 
+        pool of threads, each driving one kernel.
+        """
+        nbfile.execute_timeout = timeout
+        if num_kernels > 0:
+            nbfile.kernel_pool = nbfile.KernelPool(max_spares=num_kernels)
+            self.notebook_pool = jobs.NotebookPool(num_kernels, nbfile.kernel_pool)
+        else:
+            nbfile.kernel_pool = None
+            self.notebook_pool = None
+
+    def shutdown(self):
+        """
+        Stops the worker processes and threads of the job, notebook and copy
+        pools, and the spare kernels.  Pools start again if traverse is 
+        called afterwards.
+        """
+        for pool in [self.job_pool, self.notebook_pool, self.copy_pool]:
+            if pool:
+                pool.shutdown()
+        if nbfile.kernel_pool:
+            nbfile.kernel_pool.shutdown()
+        if self.listing_store:
+            self.listing_store.close()
+            self.listing_store = None
+
+    def get_listing_store(self):
+        """
+        Returns the store that job snapshots keep __files__ in (see 
+        dirtree.FileListing), or None if jobs are run in this thread.
+        """
+        if self.listing_store == None and (self.job_pool or self.notebook_pool):
+            self.listing_store = dt.ListingStore.create()
+        return self.listing_store
+
+    def wait_for(self, output_filepath, skip=None):
+        """
+        Waits for pending jobs, notebooks and copies that write to 
+        output_filepath, except for those in pool skip.
+        """
+        for pool in [self.job_pool, self.notebook_pool, self.copy_pool]:
+            if pool and pool is not skip:
+                pool.wait_for(output_filepath)
+
     def set_dest(self, destdir):
         self.destdir = os.path.abspath(destdir)
 
@@ -80,6 +157,25 @@ class Webify:
         else:
             self.logger.info('Destination directory %s: %s' % (r, destdir))
 
+        self.cache_dir = os.path.abspath(self.meta_data.get('__cache_dir__') or mf.default_cache_dir(self.destdir))
+        for dirpath, name in [(self.destdir, 'destination'), (self.srcdir, 'source')]:
+            if self.cache_dir == dirpath or self.cache_dir.startswith(dirpath + os.sep):
+                raise ValueError('Cache folder is inside the %s folder: %s' % (name, self.cache_dir))
+        self.logger.info('Cache folder: %s' % self.cache_dir)
+
+        self.manifest = mf.BuildManifest(self.destdir, self.cache_dir).load()
+
+        bytecode_cache_dir = self.get_cache_dir('jinja2') if self.meta_data.get('__jinja2_bytecode_cache__') else None
+        self.jinja2_templates = util.Jinja2Templates(bytecode_cache_dir=bytecode_cache_dir)
+        util.jinja2_templates = self.jinja2_templates
+        util.pandoc_snippet_cache = util.PandocSnippetCache(self.get_cache_dir('pandoc'))
+        nbfile.notebook_cache = nbfile.NotebookCache(self.get_cache_dir('nbconvert'))
+        if self.meta_data.get('__yaml_cache__'):
+            yamlfile.yaml_cache.snapshot_dir = self.get_cache_dir('yaml')
+
+    def get_cache_dir(self, name):
+        return os.path.join(self.cache_dir, name)
+
     def check_availability_(self, s, e, filepath):
         logger_availability = util.WebifyLogger.get('availability')
 
@@ -121,7 +217,7 @@ class Webify:
         logger_availability = util.WebifyLogger.get('availability')
         
         logger_availability.debug('Checking availability for %s' % filepath)
-        logger_availability.debug(pp.pformat(availability))
+        logger_availability.debug(util.WebifyLogger.pformat(availability))
 
         try:
             s = availability[filepath]['start']
@@ -146,7 +242,8 @@ class Webify:
             for filename in dir.partials.files['yaml']:
                 filepath = self.make_src_filepath(dir, os.path.join('_partials', filename))
                 yaml_file = YAMLfile(filepath=filepath)
-                yaml_file.load()
+                with profiling.profiler.stage('yaml', filepath):
+                    yaml_file.load()
                 self.rc.add(yaml_file.data)
 
             # Load HTML
@@ -158,7 +255,8 @@ class Webify:
                 filepath = self.make_src_filepath(dir, os.path.join('_partials', filename))
                 html_file = HTMLfile(filepath)
                 buffer = html_file.load().get_buffer()
-                rendered_buf = self.render(template=buffer, render_filepath=filepath, context=self.rc.data(), src_filepath=filepath)
+                with profiling.profiler.stage('render', filepath):
+                    rendered_buf = self.render(template=buffer, render_filepath=filepath, context=self.rc.data(), src_filepath=filepath)
                 data[filename.replace('.','_')] = markupsafe.Markup(rendered_buf)
 
             # Load Markdown
@@ -176,7 +274,8 @@ class Webify:
                 self.rc.push()
                 md_file = MDfile(filepath=filepath, args=args)
                 md_file = self.md_set_defaults(md_file)
-                md_file.load(self.rc)
+                with profiling.profiler.stage('frontmatter', filepath):
+                    md_file.load(self.rc)
                 ret_type, buffer, _ = md_file.convert(self.rc)
                 self.rc.pop()
                 if not ret_type == 'buffer':
@@ -201,7 +300,8 @@ class Webify:
         for filename in dir.files['yaml']:
             filepath = self.make_src_filepath(dir, filename)
             yaml_file = YAMLfile(filepath=filepath)
-            yaml_file.load()
+            with profiling.profiler.stage('yaml', filepath):
+                yaml_file.load()
             self.rc.add(yaml_file.data)
     
     def capture_list_of(self, dir, availability, ignore_info, file_type):
@@ -217,6 +317,7 @@ class Webify:
     def capture_list_of_ipynb(self, dir, availability, ignore_info):
 
         ipynb_settings = JupyterNotebookSettings(dir, self.rc)
+        lesson_plans = nbfile.LessonPlanBatch()
 
         list_files = []
         for filename in dir.files['ipynb']:
@@ -233,7 +334,7 @@ class Webify:
                 if ipynb_settings.render_html:
                     nb_file = JupyterNotebookfile(filepath, ipynb_settings.execute_notebook or self.meta_data['execute_jupyter-notebook'])
                     nb_file.load()
-                    self.capture_dir_listing_information(list_files, filename, converted_filename, is_available, is_ignored, filepath, converted_output_filepath, 'ipynb-html', obj=nb_file, data=nb_file.get_metadata())
+                    self.capture_dir_listing_information(list_files, filename, converted_filename, is_available, is_ignored, filepath, converted_output_filepath, 'ipynb-html', obj=nb_file, data=nb_file.get_metadata(lesson_plans))
 
         return list_files
 
@@ -256,7 +357,8 @@ class Webify:
                      'pandoc-meta': self.meta_data['pandoc-meta'] }
             md_file = MDfile(filepath=filepath, args=args)
             md_file = self.md_set_defaults(md_file)
-            loaded_ok = md_file.load(self.rc)
+            with profiling.profiler.stage('frontmatter', filepath):
+                loaded_ok = md_file.load(self.rc, metadata_only=True)
             # print('loaded_ok', loaded_ok)
             if loaded_ok:
                 converted_output_filepath = md_file.make_output_filepath()
@@ -272,6 +374,7 @@ class Webify:
                 if md_file.get_value('copy-source'):
                     self.capture_dir_listing_information(list_files, filename, filename, True, False, filepath, output_filepath, 'md-src', obj=None, data=None)
 
+                md_file.set_manifest_record(self.manifest.get(converted_output_filepath), self.file_stats)
                 self.capture_dir_listing_information(list_files, filename, converted_filename, True, False, filepath,converted_output_filepath, 'md', obj=md_file, data=md_file.get_yaml())
             else:
                 # print('ZZ')
@@ -304,7 +407,9 @@ class Webify:
                     self.logger.info('x-: %s' % src_filename) 
                 else:
                     util.WebifyLogger.get('ignored').info('Ignored:\n   skipped %s' % filepath)
+                self.wait_for(output_filepath)
                 x, m = util.remove_file(output_filepath)
+                self.manifest.remove(output_filepath)
                 if x:
                     self.logger.info('    Removed %s' % output_filepath)
                 else:
@@ -317,7 +422,9 @@ class Webify:
                     self.logger.info('x-: %s' % src_filename) 
                 else:
                     util.WebifyLogger.get('available').info('Availability:\n   skipped %s' % filepath)
+                self.wait_for(output_filepath)
                 x, m = util.remove_file(output_filepath)
+                self.manifest.remove(output_filepath)
                 if x:
                     self.logger.info('    Removed %s' % output_filepath)
                 else:
@@ -334,6 +441,7 @@ class Webify:
                 self.copy_misc(filename, filepath, output_filepath)
             elif file_type == 'ipynb-html':
                 self.convert_ipynb(filename, filepath, output_filepath, i['obj'])
+                i['obj'] = None
             elif file_type == 'md-src':
                 self.copy_misc(filename, filepath, output_filepath)
             elif file_type == 'md':
@@ -343,19 +451,21 @@ class Webify:
                 pass
             
     def convert_ipynb(self, filename, filepath, output_filepath, nb_file_obj):
-        if os.path.isfile(output_filepath):
-            if not self.meta_data['__ignore_times__'] and os.path.getmtime(filepath) <= os.path.getmtime(output_filepath):
-                if util.WebifyLogger.is_info(self.logger):
-                    util.WebifyLogger.get('not-compiled').info('    Destination file already exists.  Did not compile.')
-                else:
-                    util.WebifyLogger.get('not-compiled').info('Not compiled:\n   %s\n-> %s' % (filepath, output_filepath))
-                return
+        context = mf.fingerprint({'execute_notebook': nb_file_obj.execute_notebook})
+        if self.is_up_to_date(filepath, output_filepath, context):
+            if util.WebifyLogger.is_info(self.logger):
+                util.WebifyLogger.get('not-compiled').info('    Destination file already exists.  Did not compile.')
+            else:
+                util.WebifyLogger.get('not-compiled').info('Not compiled:\n   %s\n-> %s' % (filepath, output_filepath))
+            return
 
-        self.rc.push()
-        self.rc.add({'__me__': filename})
+        report = lambda saved: self.report_ipynb(filepath, output_filepath, saved, context)
+        job_pool = self.notebook_pool if nb_file_obj.execute_notebook else None
+        self.run_job(jobs.convert_ipynb, (nb_file_obj, output_filepath, filename), output_filepath, report, job_pool)
 
-        buffer = nb_file_obj.get_html_buffer()
-        if util.save_to_file(output_filepath, buffer):
+    def report_ipynb(self, filepath, output_filepath, saved, context):
+        if saved:
+            self.manifest.set(output_filepath, mf.make_record(filepath, [filepath], output_filepath, context, self.file_stats))
             if util.WebifyLogger.is_info(self.logger):
                 self.logger.info('    Compiled.')
             else:
@@ -364,24 +474,21 @@ class Webify:
         else:
             self.logger.warning('Error saving Jupyter Notebook file %s' % output_filepath)
 
-        self.rc.pop()
-
     def convert_html(self, filename, filepath, output_filepath):
-        if os.path.isfile(output_filepath):
-            if not self.meta_data['__ignore_times__'] and os.path.getmtime(filepath) <= os.path.getmtime(output_filepath):
-                if util.WebifyLogger.is_info(self.logger):
-                    util.WebifyLogger.get('not-compiled').info('    Destination file already exists.  Did not compile.')
-                else:
-                    util.WebifyLogger.get('not-compiled').info('Not compiled:\n   %s' % filepath)
-                return
+        if self.is_up_to_date(filepath, output_filepath, rc=self.rc):
+            if util.WebifyLogger.is_info(self.logger):
+                util.WebifyLogger.get('not-compiled').info('    Destination file already exists.  Did not compile.')
+            else:
+                util.WebifyLogger.get('not-compiled').info('Not compiled:\n   %s' % filepath)
+            return
 
-        self.rc.push()
-        self.rc.add({'__me__': filename})
+        report = lambda ret: self.report_html(filepath, output_filepath, ret)
+        self.run_job(jobs.convert_html, (filepath, output_filepath, filename, self.render), output_filepath, report)
 
-        html_file = HTMLfile(filepath)
-        buffer = html_file.load().get_buffer()
-        rendered_buf = self.render(template=buffer, render_filepath=filepath, context=self.rc.data(), src_filepath=filepath)
-        if util.save_to_file(output_filepath, rendered_buf):
+    def report_html(self, filepath, output_filepath, ret):
+        saved, context_keys = ret if ret else (False, None)
+        if saved:
+            self.manifest.set(output_filepath, mf.make_record(filepath, [filepath], output_filepath, None, self.file_stats, context_keys=context_keys))
             if util.WebifyLogger.is_info(self.logger):
                 self.logger.info('    Compiled.')
             else:
@@ -390,7 +497,38 @@ class Webify:
         else:
             self.logger.warning('Error saving html file %s' % output_filepath)
 
-        self.rc.pop()
+    def is_up_to_date(self, filepath, output_filepath, context=None, rc=None):
+        """
+        Asks the build manifest whether output_filepath is up-to-date with
+        respect to filepath (and the rendering context keys it reads, if rc 
+        is given).  Falls back to comparing timestamps if the manifest 
+        doesn't know about output_filepath.
+        """
+        if self.meta_data['__ignore_times__']:
+            return False
+
+        up_to_date = mf.check(self.manifest.get(output_filepath), [filepath], output_filepath, context, self.file_stats, rc)
+        if up_to_date == None:
+            up_to_date = os.path.isfile(output_filepath) and os.path.getmtime(filepath) <= os.path.getmtime(output_filepath)
+            if up_to_date:
+                self.manifest.set(output_filepath, mf.make_record(filepath, [filepath], output_filepath, context, self.file_stats))
+        return up_to_date
+
+    def run_job(self, func, args, output_filepath, report, job_pool=None):
+        """
+        Calls func(*args, rc) and passes its result to report.  When a job
+        pool is available, func runs in a worker process with a snapshot
+        of the current rendering context.  job_pool defaults to the pool
+        set up by set_jobs.
+        """
+        job_pool = job_pool or self.job_pool
+        self.wait_for(output_filepath, skip=job_pool)
+        if job_pool:
+            if self.context_snapshot == None:
+                self.context_snapshot = jobs.snapshot_context(self.rc.data())
+            job_pool.submit(func, args, self.context_snapshot, output_filepath, report)
+        else:
+            report(func(*args, self.rc))
 
     def md_set_defaults(self, md_file):
         if self.meta_data['renderer']:
@@ -410,10 +548,12 @@ class Webify:
         return True, None, None, None
 
     def convert_md(self, filename, filepath,  output_filepath, md_file_obj):
-        self.rc.push()
-        self.rc.add({'__me__': filename})
+        report = lambda ret: self.report_md(filepath, output_filepath, ret)
+        self.run_job(jobs.convert_md, (md_file_obj, filename), output_filepath, report)
 
-        status, saved_file, _ = md_file_obj.convert(self.rc)
+    def report_md(self, filepath, output_filepath, ret):
+        (status, saved_file, _), record = ret if ret else (('error', None, filepath), None)
+        self.manifest.set(output_filepath, record)
         if status == 'file':
             if util.WebifyLogger.is_info(self.logger):
                 self.logger.info('    Compiled.')
@@ -427,8 +567,6 @@ class Webify:
         else:
             saved_file = None
             self.logger.warning('Error processing %s' % filepath)
-        
-        self.rc.pop()
                     
     def capture_dir_listing_information(self, list_files, filename, converted_filename, is_available, is_ignored, filepath, output_filepath, file_type, obj, data):
         entry = {
@@ -456,9 +594,33 @@ class Webify:
         return os.path.normpath(output_filepath)
                 
     def copy_misc(self, filename, filepath, output_filepath):
-        v, s = util.process_file(filepath, output_filepath, self.meta_data['__force_copy__'])
+        force_copy = self.meta_data['__force_copy__']
+        if not force_copy:
+            up_to_date = mf.check(self.manifest.get(output_filepath), [filepath], output_filepath, None, self.file_stats)
+            if up_to_date:
+                self.log_copy(filepath, output_filepath, True, 'Exists')
+                return
+            # The manifest knows that the file changed, no need to compare it
+            force_copy = up_to_date == False
+
+        report = lambda ret: self.report_copy(filepath, output_filepath, ret)
+        self.wait_for(output_filepath, skip=self.copy_pool)
+        if self.copy_pool:
+            self.copy_pool.submit(jobs.copy_asset, (filepath, output_filepath, force_copy), output_filepath, report)
+        else:
+            report(jobs.copy_asset(filepath, output_filepath, force_copy))
+
+    def report_copy(self, filepath, output_filepath, ret):
+        v, s, digest = ret if ret else (False, 'Copy failed', None)
+        if v:
+            if digest:
+                self.file_stats.set_hash(filepath, digest)
+            self.manifest.set(output_filepath, mf.make_record(filepath, [filepath], output_filepath, None, self.file_stats, with_hashes=digest != None))
+        self.log_copy(filepath, output_filepath, v, s)
+
+    def log_copy(self, filepath, output_filepath, v, s):
         if not v:
-            logger.warning('%s (%s)' % (filepath, s))
+            self.logger.warning('%s (%s)' % (filepath, s))
         else:
             if s == 'Exists':
                 if util.WebifyLogger.is_info(self.logger):
@@ -493,7 +655,7 @@ class Webify:
             return ignore_info
         else:
             logger_ignore.debug('Ignore information found in folder %s' % dir.get_fullpath())
-            logger_ignore.debug(pp.pformat(x))
+            logger_ignore.debug(util.WebifyLogger.pformat(x))
 
         try:
             if not isinstance(x, list):
@@ -510,14 +672,14 @@ class Webify:
                         'ignore': ignore_flag,
                         'file_or_dir': file_or_dir
                     }
-                    logger_ignore.debug(pp.pformat(ignore_info))
+                    logger_ignore.debug(util.WebifyLogger.pformat(ignore_info))
                     # util.WebifyLogger.get('ignored').info('[Ignored]: %s (%s)' % (item_path, ignore_flag))
         except:
             self.logger.warning('[Ignore]: cannot read ignore information: %s' % dir.get_fullpath())
             return ignore_info
         
         logger_ignore.debug('Ignore info:')
-        logger_ignore.debug(pp.pformat(ignore_info))
+        logger_ignore.debug(util.WebifyLogger.pformat(ignore_info))
         return ignore_info
 
     @staticmethod
@@ -539,7 +701,7 @@ class Webify:
             return availability
         else:
             logger_availability.debug('Availability information found in folder %s' % dir.get_fullpath())
-            logger_availability.debug(pp.pformat(x))
+            logger_availability.debug(util.WebifyLogger.pformat(x))
 
         try:
             if not isinstance(x, list):
@@ -556,13 +718,13 @@ class Webify:
                         'end': tm.read_time('end', i),
                         'file_or_dir': file_or_dir                     
                     }
-                    logger_availability.debug(pp.pformat(availability))
+                    logger_availability.debug(util.WebifyLogger.pformat(availability))
         except:
             self.logger.warning('[Availability]: cannot read availability information: %s' % dir.get_fullpath())
             return availability
 
         logger_availability.debug('Availability:')
-        logger_availability.debug(pp.pformat(availability))
+        logger_availability.debug(util.WebifyLogger.pformat(availability))
         return availability
 
     def find_next_time_to_run(self, ts, te, filepath):
@@ -585,21 +747,20 @@ class Webify:
 
         logger_rc =  util.WebifyLogger.get('rc')
         logger_rc.debug('Rendering context (before entering %s):' % dir.get_fullpath())
-        logger_rc.debug(pp.pformat(self.rc.data()))
+        logger_rc.debug(util.WebifyLogger.pformat(self.rc.data()))
 
         self.rc.push()
         self.rc.add({'__root__': os.path.relpath(self.srcdir, dir.get_fullpath()).replace('\\','/')})
         self.rc.remove('availability')
         self.rc.remove('ignore')
 
-        self.dir_stack.push(dir.name)
-
         logger_rc.debug('Rendering context (entering %s):' % dir.get_fullpath())
-        logger_rc.debug(pp.pformat(self.rc.data()))
+        logger_rc.debug(util.WebifyLogger.pformat(self.rc.data()))
 
     def proc_dir(self, dir):
         self.proc_yaml(dir)
-        self.proc_partials(dir)
+        with profiling.profiler.stage('partials', dir.partials.get_fullpath()) if dir.partials else profiling.null_stage:
+            self.proc_partials(dir)
 
         destdir = os.path.normpath(os.path.join(self.destdir, dir.path, dir.name))
         if os.path.isdir(destdir):
@@ -648,6 +809,14 @@ class Webify:
                 if not status:
                     util.WebifyLogger.get('available').warning('Availability: Directory removal failed: %s' % dest_path)
 
+        for child in dir.children:
+            if child.get_fullpath() in skipped_sub_dirs:
+                child.listing = None
+            elif not self.is_visited(child):
+                # Live runs: unchanged folders keep their listing from the
+                # previous run
+                skipped_sub_dirs.append(child.get_fullpath())
+
         return skipped_sub_dirs, availability, ignore_info
 
     def leave_dir(self, dir, availability, ignore_info):
@@ -662,73 +831,171 @@ class Webify:
         list_misc = self.capture_list_of(dir, availability, ignore_info, 'misc')
 
         logger_dirlist.debug('--- local list starts --- (%s)' % dir.get_fullpath())
-        logger_dirlist.debug(pp.pformat(list_html))
-        logger_dirlist.debug(pp.pformat(list_md))
-        logger_dirlist.debug(pp.pformat(list_ipynb))
-        logger_dirlist.debug(pp.pformat(list_misc))
+        logger_dirlist.debug(util.WebifyLogger.pformat(list_html))
+        logger_dirlist.debug(util.WebifyLogger.pformat(list_md))
+        logger_dirlist.debug(util.WebifyLogger.pformat(list_ipynb))
+        logger_dirlist.debug(util.WebifyLogger.pformat(list_misc))
         logger_dirlist.debug('--- local list ends ---')
 
-        self.dir_stack.top()[1].extend(list_html)
-        self.dir_stack.top()[1].extend(list_md)
-        self.dir_stack.top()[1].extend(list_ipynb)
-        self.dir_stack.top()[1].extend(list_misc)
+        dir.listing = list_html + list_md + list_ipynb + list_misc
+        dir.record_id = None
+        list_files = dt.FileListing(dir, self.get_listing_store())
 
         logger_dirlist.debug('--- full list starts --- (%s)' % dir.get_fullpath())
-        logger_dirlist.debug(pp.pformat(self.dir_stack.top()))
+        logger_dirlist.debug(util.WebifyLogger.lazy(lambda: pp.pformat((dir.name, list(list_files)))))
         logger_dirlist.debug('--- full list ends ---')
 
         self.rc.add({'__md__': list_md,
                      '__html__': list_html,
                      '__misc__': list_misc,
                      '__ipynb__': list_ipynb,
-                     '__files__': self.dir_stack.top()[1]})
+                     '__files__': list_files})
 
         logger_rc =  util.WebifyLogger.get('rc')
         logger_rc.debug('Rendering context (in %s):' % dir.get_fullpath())
-        logger_rc.debug(pp.pformat(self.rc.data()))
+        logger_rc.debug(util.WebifyLogger.pformat(self.rc.data()))
 
         if len(list_misc) > 0 or len(list_md) > 0 or len(list_html) > 0 or len(list_ipynb) > 0:
             self.logger.info('Saving files to %s' % self.make_output_filepath(dir, ''))
+            self.context_snapshot = None
             self.proc_files(dir, list_html)
             self.proc_files(dir, list_md)
             self.proc_files(dir, list_ipynb)
             self.proc_files(dir, list_misc)
+            self.context_snapshot = None
 
         self.rc.remove(['__md__', '__html__', '__misc__', '__ipynb__', '__files__'])
 
         self.rc.pop()
-        self.copy_dir_list_to_parent()
 
         logger_rc.debug('Rendering context (leaving %s):' % dir.get_fullpath())
-        logger_rc.debug(pp.pformat(self.rc.data()))
+        logger_rc.debug(util.WebifyLogger.pformat(self.rc.data()))
         
         self.logger.info('< [%d] leaving folder %s' % (self.depth_level, dir.get_fullpath()))
         self.depth_level = self.depth_level - 1
         
-    def copy_dir_list_to_parent(self):
-        logger_dirlist = util.WebifyLogger.get('dirlist')
-        logger_dirlist.debug('Copying dirlist to parent folder')
+    def find_affected_dirs(self, changed_paths):
+        """
+        Live runs: maps changed source files to the folders that need to be
+        processed again.  Returns (dirs, trees), the folders whose files are 
+        processed again and the folders whose whole sub-tree is processed
+        again (a yaml or a _partials file changed).  Folders that render 
+        files depending upon a changed file (e.g., a template) are found via 
+        the build manifest.  Returns None if a full run is needed.
+        """
+        dependents = {}
+        for record in self.manifest.records.values():
+            for dep in record['deps'].keys():
+                dependents.setdefault(dep, set()).add(record['src'])
+
+        dirs, trees = set(), set()
+        for filepath in changed_paths:
+            filepath = os.path.normpath(filepath)
+            dirpath, filename = os.path.split(filepath)
+            if filename == ignorefile:
+                return None
+
+            dir_node = self.dir_tree.find(dirpath)
+            if dir_node and dir_node.name == '_partials':
+                if self.dir_tree.find(os.path.dirname(dirpath)):
+                    trees.add(os.path.dirname(dirpath))
+            elif dir_node and not self.ignore.ignore(dirpath, filename, False):
+                known = filename in [f for v in dir_node.files.values() for f in v]
+                if known != os.path.isfile(filepath):
+                    self.dir_tree.rescan(dir_node)
+                if os.path.splitext(filename)[1].lower() == '.yaml':
+                    trees.add(dirpath)
+                else:
+                    dirs.add(dirpath)
+
+            for src_filepath in dependents.get(filepath, []):
+                dirs.add(os.path.dirname(src_filepath))
 
-        x = self.dir_stack.top()
-        logger_dirlist.debug(x[0])
-        self.dir_stack.pop()
-        y = self.dir_stack.top()
-        for i in x[1]:
-            i['filename'] = os.path.join(x[0], i['filename'])
-            y[1].append(i)        
+        return dirs, trees
 
-    def traverse(self):
+    def is_visited(self, dir):
+        if self.visit_dirs == None:
+            return True
+        dirpath = dir.get_fullpath()
+        if dirpath in self.visit_dirs:
+            return True
+        for t in self.visit_trees:
+            if dirpath.startswith(t + os.sep):
+                return True
+        return False
+
+    def traverse(self, changed_paths=None):
+        """
+        Webifies the source folder.  In live mode changed_paths lists the 
+        source files changed since the last run.  The directory tree and the
+        listings of unchanged folders are then kept from the last run, and
+        only the affected folders (and the folders above these) are 
+        processed again.
+        """
         assert(self.srcdir and self.destdir and self.meta_data)
 
         tic = time.time()
-        self.next_run_time = None
         self.depth_level = 0
-        self.dir_tree.collect(rootdir=self.srcdir, ignore=self.ignore)
+        profiling.profiler.enabled = self.meta_data.get('__profile__') != None
+        profiling.profiler.take()
+
+        affected = None
+        if changed_paths != None and self.dir_tree.rootdir:
+            affected = self.find_affected_dirs(changed_paths)
+
+        if affected == None:
+            self.visit_dirs, self.visit_trees = None, None
+            self.next_run_time = None
+            self.file_stats = mf.FileStats().scan(self.destdir)
+            snapshot_filepath = os.path.join(self.get_cache_dir('dirtree'), 'snapshot')
+            if self.meta_data.get('__dirtree_cache__') and self.dir_tree.rootdir == None:
+                self.dir_tree.load_snapshot(snapshot_filepath)
+            with profiling.profiler.stage('collect', self.srcdir):
+                self.dir_tree.collect(rootdir=self.srcdir, ignore=self.ignore)
+            if self.meta_data.get('__dirtree_cache__'):
+                self.dir_tree.save_snapshot(snapshot_filepath)
+        else:
+            dirs, trees = affected
+            if len(dirs) == 0 and len(trees) == 0:
+                self.logger.info('Nothing to webify')
+                return
+            self.logger.info('Webifying folders: %s' % ', '.join(sorted(dirs | trees)))
+            self.visit_trees = trees
+            self.visit_dirs = set()
+            for dirpath in dirs | trees:
+                while (dirpath == self.srcdir or dirpath.startswith(self.srcdir + os.sep)) and not dirpath in self.visit_dirs:
+                    self.visit_dirs.add(dirpath)
+                    dirpath = os.path.dirname(dirpath)
+            self.file_stats = mf.FileStats()
+
         self.dir_tree.traverse(enter_func=self.enter_dir, proc_func=self.proc_dir, leave_func=self.leave_dir)
+        self.visit_dirs, self.visit_trees = None, None
+        if self.job_pool:
+            self.job_pool.wait()
+        if self.notebook_pool:
+            self.notebook_pool.wait()
+            nbfile.kernel_pool.shutdown()
+        if self.copy_pool:
+            self.copy_pool.wait()
+        self.manifest.save()
         toc = time.time()
-        logger.critical('Webify took {}'.format(datetime.timedelta(seconds=toc-tic)))
+        self.logger.critical('Webify took {}'.format(datetime.timedelta(seconds=toc-tic)))
+        if profiling.profiler.enabled:
+            self.save_profile()
         util.WebifyLogger.get('next-run').debug('Next run time: %s' % self.next_run_time)
 
+    def save_profile(self):
+        logger = util.WebifyLogger.get('profile')
+        records = profiling.profiler.take()
+        report_filepath = self.meta_data['__profile__']
+        try:
+            profiling.save_report(records, report_filepath)
+            logger.critical('Profile saved to: %s' % report_filepath)
+        except Exception as e:
+            logger.warning('Cannot save profile to %s: %s' % (report_filepath, e))
+        for line in profiling.summarize(records, top=self.meta_data.get('__profile_top__', 10)):
+            logger.critical(line)
+
 def version_info():
     return 'Webify version %s' % __version__
 
@@ -750,18 +1017,20 @@ def check_cmdline_args(is_live, cmdline_args):
         if cmdline_args.upload_script != None:
             logger.warning('Upload script is only supported in "--live" mode: %s' % cmdline_args.upload_script)
 
-if __name__ == '__main__':
-    # util.terminal = util.Terminal()
-    prog_name = os.path.normpath(os.path.join(os.getcwd(), sys.argv[0]))
-    prog_dir = os.path.dirname(prog_name)
-    cur_dir = os.getcwd()
-
-    # Command line arguments
+def make_cmdline_parser():
     cmdline_parser = argparse.ArgumentParser()
     cmdline_parser.add_argument('srcdir', help='Source directory')
     cmdline_parser.add_argument('destdir', help='Destination directory')
     cmdline_parser.add_argument('-i', '--ignore-times', action='store_true', default=False, help='Forces the generation of the output file even if the source file has not changed')
     cmdline_parser.add_argument('--force-copy', action='store_true', default=False, help='Force file copy.')    
+    cmdline_parser.add_argument('-j', '--jobs', action='store', type=int, default=1, help='Number of worker processes used for markdown, html and jupyter notebook conversions.')
+    cmdline_parser.add_argument('--threads', action='store_true', default=False, help='Use threads instead of processes for --jobs.')
+    cmdline_parser.add_argument('--cache-dir', action='store', default=None, help='Folder where webify keeps its build manifest and caches.  Defaults to a folder named after the destination folder in the user cache folder (~/.cache/webify).  Must not be inside the destination folder.')
+    cmdline_parser.add_argument('--copy-mode', action='store', default='copy', choices=sorted(util.copy_strategies.keys()), help='How files are copied to the destination folder.  hardlink links these to the source files (the destination folder must then not be edited by hand), reflink clones these on file systems that support it.  Both fall back to copying.')
+    cmdline_parser.add_argument('--copy-threads', action='store', type=int, default=0, help='Number of threads used to copy files.  0 (the default) copies files as these are found.')
+    cmdline_parser.add_argument('--notebook-kernels', action='store', type=int, default=0, help='Number of jupyter notebooks executed at the same time.  0 (the default) executes notebooks one at a time, along with other conversions.')
+    cmdline_parser.add_argument('--notebook-timeout', action='store', type=int, default=600, help='Time (in seconds) allowed for each cell when executing jupyter notebooks.')
+    cmdline_parser.add_argument('--pandoc-server', action='store_true', default=False, help='Converts markdown to html using a long-lived pandoc process instead of running pandoc for each file.  Requires pandoc 3.1.1 or newer.')
 
     cmdline_parser.add_argument('--version', action='version', version=version_info())
     cmdline_parser.add_argument('-v','--verbose',action='store_true',default=False,help='Prints helpful messages')
@@ -781,6 +1050,7 @@ if __name__ == '__main__':
     cmdline_parser.add_argument('--debug-live',action='store_true',default=False,help='Turns on live run debug messages')
     cmdline_parser.add_argument('--debug-next-run',action='store_true',default=False,help='Turns on next run debug messages')
     cmdline_parser.add_argument('--debug-nb',action='store_true',default=False,help='Turns on Jupyter Notebooks debug messages')
+    cmdline_parser.add_argument('--debug-manifest',action='store_true',default=False,help='Turns on build manifest debug messages')
     cmdline_parser.add_argument('--debug-nb-settings',action='store_true',default=False,help='Turns on Jupyter Notebooks Settings debug messages')
 
     cmdline_parser.add_argument('--show-availability',action='store_true',default=False,help='Turns on messages that are displayed if a file is ignored due to availability')
@@ -798,10 +1068,56 @@ if __name__ == '__main__':
     cmdline_parser.add_argument('--pandoc-var', action='append', default=[], help='A mechanism for providing -V Name:Val for pandoc.')
     cmdline_parser.add_argument('--pandoc-meta', action='append', default=[], help='A mechanism for providing -M Name:Val for pandoc.')
 
+    cmdline_parser.add_argument('--jinja2-bytecode-cache', action='store_true', default=False, help='Stores compiled jinja2 templates in the cache folder (see --cache-dir).  Subsequent runs skip template compilation.')
+    cmdline_parser.add_argument('--dirtree-cache', action='store_true', default=False, help='Stores the listing of each source folder in the cache folder (see --cache-dir).  Subsequent runs only scan folders that changed.')
+    cmdline_parser.add_argument('--yaml-cache', action='store_true', default=False, help='Stores parsed yaml files in the cache folder (see --cache-dir).  Subsequent runs skip parsing unchanged yaml files.')
+
+    cmdline_parser.add_argument('--profile', action='store', default=None, metavar='REPORT', help='Records wall and cpu time per source file and build stage, and saves these to REPORT (.csv or .json).  Prints the time spent in each stage and the slowest files.')
+    cmdline_parser.add_argument('--profile-top', action='store', type=int, default=10, help='Number of slowest files listed by --profile.')
+
     cmdline_parser.add_argument('--execute-jupyter-notebook', action='store_true',default=False,help='Executes jupyter notebook(s) before converting these to html.  This can take a long time, depending upon the contents of the jupyter notebooks.')
+    return cmdline_parser
 
+def make_meta_data(cmdline_args, prog_name, prog_dir, cur_dir):
+    """
+    The meta data handed over to Webify.set_meta_data for cmdline_args.
+    """
+    srcdir = os.path.normpath(cmdline_args.srcdir)
+    destdir = os.path.normpath(cmdline_args.destdir)
+    cur_time = datetime.datetime.now()
+    meta_data = {
+        'prog_name': prog_name.replace('\\','/'),
+        'prog_dir': prog_dir.replace('\\','/'), # We need to do it for windows.
+        'cur_dir': cur_dir.replace('\\','/'),   # It is a bit wierd, I agree.
+        'src_dir': srcdir.replace('\\','/'),    # But it seems mustache templating engine
+        'dest_dir': destdir.replace('\\','/'),  # can't deal with \.  Will look into it more.
+        '__version__': __version__,
+        '__root__': os.path.abspath(cmdline_args.srcdir).replace('\\','/'),
+        '__last_updated__': cur_time.strftime('%Y-%m-%d %H:%M'),
+        'renderer': cmdline_args.renderer,
+        '__force_copy__': cmdline_args.force_copy,
+        '__time__': cur_time,
+        '__ignore_times__': cmdline_args.ignore_times,
+        'pandoc-var': cmdline_args.pandoc_var,
+        'pandoc-meta': cmdline_args.pandoc_meta,
+        'execute_jupyter-notebook': cmdline_args.execute_jupyter_notebook,
+        '__jinja2_bytecode_cache__': cmdline_args.jinja2_bytecode_cache,
+        '__yaml_cache__': cmdline_args.yaml_cache,
+        '__dirtree_cache__': cmdline_args.dirtree_cache,
+        '__profile__': cmdline_args.profile,
+        '__profile_top__': cmdline_args.profile_top,
+        '__cache_dir__': cmdline_args.cache_dir
+    }
+    return meta_data
 
-    cmdline_args = cmdline_parser.parse_args()
+if __name__ == '__main__':
+    # util.terminal = util.Terminal()
+    prog_name = os.path.normpath(os.path.join(os.getcwd(), sys.argv[0]))
+    prog_dir = os.path.dirname(prog_name)
+    cur_dir = os.getcwd()
+
+    # Command line arguments
+    cmdline_args = make_cmdline_parser().parse_args()
     
     # Setting up logging
     logfile = None if not cmdline_args.log else logfile
@@ -835,6 +1151,9 @@ if __name__ == '__main__':
 
     util.WebifyLogger.make(name='nb', loglevel=select_loglevel(loglevel, cmdline_args.debug_nb), logfile=logfile)
     util.WebifyLogger.make(name='nb-settings', loglevel=select_loglevel(loglevel, cmdline_args.debug_nb_settings), logfile=logfile)
+    util.WebifyLogger.make(name='jobs', loglevel=loglevel, logfile=logfile)
+    util.WebifyLogger.make(name='manifest', loglevel=logging.DEBUG if cmdline_args.debug_manifest else loglevel, logfile=logfile)
+    util.WebifyLogger.make(name='profile', loglevel=loglevel, logfile=logfile)
 
 
     logger = util.WebifyLogger.get('main')
@@ -855,31 +1174,20 @@ if __name__ == '__main__':
     srcdir = os.path.normpath(cmdline_args.srcdir)
     destdir = os.path.normpath(cmdline_args.destdir)
     
-    cur_time = datetime.datetime.now()
-    meta_data = {
-        'prog_name': prog_name.replace('\\','/'),
-        'prog_dir': prog_dir.replace('\\','/'), # We need to do it for windows.
-        'cur_dir': cur_dir.replace('\\','/'),   # It is a bit wierd, I agree.
-        'src_dir': srcdir.replace('\\','/'),    # But it seems mustache templating engine
-        'dest_dir': destdir.replace('\\','/'),  # can't deal with \.  Will look into it more.
-        '__version__': __version__,
-        '__root__': os.path.abspath(cmdline_args.srcdir).replace('\\','/'),
-        '__last_updated__': cur_time.strftime('%Y-%m-%d %H:%M'),
-        'renderer': cmdline_args.renderer,
-        '__force_copy__': cmdline_args.force_copy,
-        '__time__': cur_time,
-        '__ignore_times__': cmdline_args.ignore_times,
-        'pandoc-var': cmdline_args.pandoc_var,
-        'pandoc-meta': cmdline_args.pandoc_meta,
-        'execute_jupyter-notebook': cmdline_args.execute_jupyter_notebook
-    }
+    meta_data = make_meta_data(cmdline_args, prog_name, prog_dir, cur_dir)
     logger.debug('Meta data:')
-    logger.debug(pp.pformat(meta_data))
+    logger.debug(util.WebifyLogger.pformat(meta_data))
+
+    if cmdline_args.pandoc_server:
+        util.pandoc_converter = util.PandocServer()
 
     webify = Webify()
     try:
         webify.set_src(srcdir)
         webify.set_meta_data(meta_data)
+        webify.set_jobs(cmdline_args.jobs, cmdline_args.threads)
+        webify.set_copy(cmdline_args.copy_mode, cmdline_args.copy_threads)
+        webify.set_notebooks(cmdline_args.notebook_kernels, cmdline_args.notebook_timeout)
     except ValueError as e:
         print(e)
         exit(-1)
@@ -922,3 +1230,5 @@ if __name__ == '__main__':
         logger.critical('Press q to exit.')
 
         run.WebifyLive(webify=webify, url_prefix=cmdline_args.live_url_prefix, upload_shell_script=upload_script)
+
+    webify.shutdown()
@@ -2,8 +2,188 @@ import util2 as util
 import pprint as pp
 import yaml
 import codecs
-from util2 import filter_dict, filter_pandoc
+import os
+import re
+import pickle
+import collections
+import hashlib
+import threading
+import time
+from util2 import filter_dict, filter_pandoc, filter_pandoc_dict
 
+try:
+    SafeLoader = yaml.CSafeLoader
+except AttributeError:
+    SafeLoader = yaml.SafeLoader
+
+class YAMLCache:
+    """
+    Process-level cache of parsed yaml files, validated against the file's
+    modification time and size.  Parsed data is kept pickled, so each load
+    returns a fresh copy that the caller is free to modify.  If snapshot_dir
+    is set, entries are also stored on disk so that subsequent runs skip
+    parsing unchanged yaml files.
+    """
+    # Files modified less than this many seconds before they are parsed are
+    # parsed again next time, since a change made within the same timestamp
+    # tick would go unnoticed (see DirTree.racy_seconds)
+    racy_seconds = 2
+
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get_snapshot_filepath(self, filepath):
+        key = hashlib.sha1(os.path.abspath(filepath).encode('utf-8')).hexdigest()
+        return os.path.join(self.snapshot_dir, key)
+
+    def read_snapshot(self, filepath):
+        try:
+            with open(self.get_snapshot_filepath(filepath), 'rb') as stream:
+                snapshot_filepath, stamp, blob = pickle.load(stream)
+            if snapshot_filepath == os.path.abspath(filepath):
+                return stamp, blob
+        except:
+            pass
+        return None
+
+    def write_snapshot(self, filepath, entry):
+        snapshot_filepath = self.get_snapshot_filepath(filepath)
+        tmp_filepath = '%s.%d.%d.tmp' % (snapshot_filepath, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            with open(tmp_filepath, 'wb') as stream:
+                pickle.dump((os.path.abspath(filepath), entry[0], entry[1]), stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filepath, snapshot_filepath)
+        except:
+            util.WebifyLogger.get('yaml').debug('Cannot write YAML snapshot: %s' % snapshot_filepath)
+
+    def load(self, filepath):
+        st = os.stat(filepath)
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        with self.lock:
+            entry = self.entries.get(filepath)
+        if entry == None and self.snapshot_dir:
+            entry = self.read_snapshot(filepath)
+        if entry != None and entry[0] == stamp:
+            with self.lock:
+                self.entries[filepath] = entry
+            return pickle.loads(entry[1])
+
+        with codecs.open(filepath, 'r') as stream:
+            data = yaml.load(stream, Loader=SafeLoader)
+        if time.time_ns() - st.st_mtime_ns < self.racy_seconds * 1000000000:
+            return data
+        entry = (stamp, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.entries[filepath] = entry
+        if self.snapshot_dir:
+            self.write_snapshot(filepath, entry)
+        return data
+
+# Webify points this to the cache folder when --yaml-cache is set
+yaml_cache = YAMLCache()
+
+frontmatter_delimiter = re.compile(r'(---|\.\.\.)(\s|$)')
+
+def read_frontmatter(lines):
+    """
+    Returns the text of the first yaml document in lines, i.e., the one that
+    yaml.safe_load_all yields first, reading no further than its end.  lines
+    is an iterable of lines, line endings included, e.g., an open file.  The
+    document may be opened by a "---" line, and it runs until the next "---"
+    or "..." line.
+    """
+    frontmatter = []
+    opened = False
+    seen_content = False
+    for line in lines:
+        if len(frontmatter) == 0:
+            line = line.lstrip('\ufeff')
+
+        if frontmatter_delimiter.match(line):
+            if line[0] == '.' or opened or seen_content:
+                break
+            opened = True
+        elif not opened and not seen_content and (line.strip() == '' or line[0] in '#%'):
+            pass
+        else:
+            seen_content = True
+        frontmatter.append(line)
+    return ''.join(frontmatter)
+
+def iter_lines(buffer):
+    pos = 0
+    while pos < len(buffer):
+        end = buffer.find('\n', pos)
+        end = len(buffer) if end < 0 else end + 1
+        yield buffer[pos:end]
+        pos = end
+
+def split_frontmatter(buffer):
+    """
+    Same as read_frontmatter, for a buffer that is already in memory.
+    """
+    return read_frontmatter(iter_lines(buffer))
+
+class FrontmatterCache:
+    """
+    Parsed yaml frontmatter, keyed on the hash of the frontmatter text.
+    Preprocessed frontmatter (see MDfile.load) is parsed from the text that
+    the mustache renderer produces, so it is keyed on exactly those parts of
+    the rendering context that the frontmatter uses.  Values are kept
+    pickled, since callers may modify these.  The most recently used
+    cache_size entries are kept around.
+    """
+    def __init__(self, cache_size=20000):
+        self.cache_size = cache_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value != None:
+                self.entries.move_to_end(key)
+            return value
+
+    def store(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.cache_size:
+                self.entries.popitem(last=False)
+
+    def load(self, text, default=None):
+        """
+        Returns the first yaml document in text, or default if text contains
+        no yaml document.
+        """
+        key = ('load', hashlib.sha1(text.encode('utf-8')).hexdigest())
+        blob = self.lookup(key)
+        if blob == None:
+            data = default
+            for section in yaml.load_all(text, Loader=SafeLoader):
+                data = section
+                break
+            blob = pickle.dumps((data is default, data), protocol=pickle.HIGHEST_PROTOCOL)
+            self.store(key, blob)
+        is_default, data = pickle.loads(blob)
+        return default if is_default else data
+
+    def dump(self, text):
+        """
+        yaml.dump of the frontmatter parsed from text.
+        """
+        key = ('dump', hashlib.sha1(text.encode('utf-8')).hexdigest())
+        s = self.lookup(key)
+        if s == None:
+            s = yaml.dump(self.load(text))
+            self.store(key, s)
+        return s
+
+frontmatter_cache = FrontmatterCache()
 
 class YAMLfile:
     """
@@ -18,8 +198,7 @@ class YAMLfile:
 
     def load(self):
         try:
-            with codecs.open(self.filepath, 'r') as stream:
-                self.data = yaml.safe_load(stream)
+            self.data = yaml_cache.load(self.filepath)
             self.logger.debug('Loaded YAML file: %s' % self.filepath)
         except:
             self.logger.warning('Error loading YAML file: %s' % self.filepath)
@@ -29,8 +208,8 @@ class YAMLfile:
 
         try:
             self.logger.debug('YAML file contents (before filter application):')
-            self.logger.debug(pp.pformat(self.data))
-            self.data = filter_dict(filter_pandoc, self.data)
+            self.logger.debug(util.WebifyLogger.pformat(self.data))
+            self.data = filter_pandoc_dict(self.data)
         except:
             self.logger.warning('Error applying pandoc_filter to YAML file: %s' % self.filepath)
             self.data = {}
@@ -40,7 +219,7 @@ class YAMLfile:
             self.data = {}
 
         self.logger.debug('YAML file contents:')
-        self.logger.debug(pp.pformat(self.data))
+        self.logger.debug(util.WebifyLogger.pformat(self.data))
 
 
     # def apply_filter(self, filter, data):